@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""
+Collector Sweep Benchmark
+Runs central_collector sweeps against N simulated SSH hosts and reports
+sweep wall time, per-host latency, and the collector's CPU time and RSS.
+
+Usage:
+    python3 bench_collector.py --hosts 200 --sweeps 5
+    python3 bench_collector.py --hosts 500 --engine async --latency 0.3 --failure-rate 0.05
+"""
+
+import os
+import sys
+import json
+import random
+import argparse
+import asyncio
+import resource
+import statistics
+import tempfile
+import time
+
+# Keep benchmark runs away from real state, Supabase and Telegram. Must be
+# set before central_collector is imported (it reads config at import time).
+os.environ['MONITOR_STATE_DIR'] = tempfile.mkdtemp(prefix='l7-bench-')
+for key in ('SUPABASE_ANON_KEY', 'SUPABASE_SERVICE_ROLE_KEY', 'TELEGRAM_BOT_TOKEN'):
+    os.environ[key] = ''
+
+import central_collector as collector  # noqa: E402
+
+SERVICES = ['nginx', 'postgres', 'docker', 'node', 'n8n']
+PROCESS_NAMES = ['systemd', 'sshd', 'bash', 'python3', 'cron', 'kworker', 'rsyslogd', 'containerd',
+                 'nginx', 'postgres', 'docker', 'node', 'agetty', 'dbus-daemon', 'udisksd']
+OUTPUT_VARIANTS = 8
+
+
+class SimulatedFleet:
+    """N fake SSH hosts standing in for run_ssh_command().
+
+    Each call sleeps for the host's latency (latency +/- jitter) and returns
+    a canned probe document; failing calls wait failure_latency (or the
+    timeout, if shorter) and fail like an unreachable host. Probe documents
+    are pre-rendered per host from a synthetic process table of `procs`
+    processes, so the collector only pays for parsing, as it would for real.
+    """
+
+    def __init__(self, hosts, latency=0.2, jitter=0.5, failure_rate=0.0, failure_latency=1.0,
+                 procs=300, seed=1):
+        self.rng = random.Random(seed)
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.failure_latency = failure_latency
+        self.procs = procs
+        self.calls = 0
+        self.systems = [{
+            'hostname': f'sim-{i:04d}',
+            'display_name': f'Simulated {i}',
+            'type': 'linux',
+            'method': 'ssh',
+            'ssh_user': 'bench',
+            'ssh_host': f'sim-{i:04d}.invalid',
+            'services': SERVICES[:1 + i % len(SERVICES)],
+        } for i in range(hosts)]
+        self.outputs = {s['ssh_host']: [self._probe_output(s) for _ in range(OUTPUT_VARIANTS)]
+                        for s in self.systems}
+
+    def process_table(self):
+        """A synthetic process table: [{'name', 'cmdline', 'cpu_percent', 'memory_info'}]."""
+        table = []
+        for pid in range(self.procs):
+            name = self.rng.choice(PROCESS_NAMES)
+            table.append({'name': name, 'cmdline': [f'/usr/bin/{name}', f'--worker={pid}'],
+                          'cpu_percent': round(self.rng.uniform(0, 5), 1), 'memory_info': None})
+        return table
+
+    def _probe_output(self, system):
+        table = self.process_table()
+        services = []
+        for name in system['services']:
+            matches = [p for p in table if name in p['name']]
+            services.append({
+                'service_name': name,
+                'is_running': bool(matches),
+                'process_count': len(matches),
+                'cpu_percent': round(sum(p['cpu_percent'] for p in matches), 1) if matches else None,
+                'memory_mb': round(self.rng.uniform(20, 500), 2) if matches else None,
+            })
+        cores = [round(self.rng.uniform(0, 100), 1) for _ in range(4)]
+        return json.dumps({
+            'probe_version': collector.PROBE_VERSION,
+            'metrics': {
+                'cpu_percent': round(sum(cores) / len(cores), 1),
+                'cpu_per_core': cores,
+                'memory_percent': round(self.rng.uniform(20, 95), 1),
+                'memory_used_gb': 3.2, 'memory_total_gb': 8.0,
+                'disk_percent': round(self.rng.uniform(30, 90), 1),
+                'disk_used_gb': 40.0, 'disk_total_gb': 100.0,
+                'load_avg_1m': 0.5, 'load_avg_5m': 0.4, 'load_avg_15m': 0.3,
+                'uptime_seconds': 86400, 'process_count': len(table),
+            },
+            'services': services,
+        })
+
+    def _outcome(self, host, timeout):
+        """(delay, output, returncode) for one simulated call."""
+        self.calls += 1
+        if self.rng.random() < self.failure_rate:
+            return min(timeout, self.failure_latency), 'Timeout', None
+        delay = max(0.0, self.latency * (1 + self.rng.uniform(-self.jitter, self.jitter)))
+        if delay > timeout:
+            return timeout, 'Timeout', None
+        return delay, self.rng.choice(self.outputs[host]), 0
+
+    def run(self, host, user, command, timeout=30, input=None):
+        delay, output, returncode = self._outcome(host, timeout)
+        time.sleep(delay)
+        return output, returncode
+
+    async def run_async(self, host, user, command, timeout=30, input=None):
+        delay, output, returncode = self._outcome(host, timeout)
+        await asyncio.sleep(delay)
+        return output, returncode
+
+    def port_open(self, host, port=22, timeout=2.0):
+        """Half-open circuit breaker probe: hosts come back at 1 - failure_rate."""
+        return self.rng.random() >= self.failure_rate
+
+    def install(self):
+        """Route the collector's SSH calls and breaker probes to this fleet."""
+        collector.run_ssh_command = self.run
+        collector.run_ssh_command_async = self.run_async
+        collector.BREAKER.port_open = self.port_open
+
+
+def synthetic_index(table):
+    """A ProcessIndex over a synthetic process table instead of psutil."""
+    index = collector.ProcessIndex.__new__(collector.ProcessIndex)
+    index.procs, index.by_name = [], {}
+    for info in table:
+        index.add(dict(info))
+    return index
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def rss_mb():
+    """Current and peak resident set size of this process, in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak = peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024  # bytes on macOS, KB on Linux
+    try:
+        with open('/proc/self/statm') as f:
+            current = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        current = None
+    return current, peak
+
+
+def run_benchmark(args):
+    fleet = SimulatedFleet(args.hosts, latency=args.latency, jitter=args.jitter,
+                           failure_rate=args.failure_rate, failure_latency=args.failure_latency,
+                           procs=args.procs, seed=args.seed)
+    fleet.install()
+    if args.no_breaker:
+        collector.BREAKER.allow = lambda system, deadline=None: (True, None)
+        collector.BREAKER.record = lambda system, success: None
+
+    sweeps, latencies = [], []
+    for sweep in range(args.sweeps):
+        cpu_before = time.process_time()
+        started = time.perf_counter()
+        with open(os.devnull, 'w') as devnull:
+            stdout, sys.stdout = sys.stdout, devnull
+            try:
+                if args.engine == 'async':
+                    results = asyncio.run(collector.collect_all_async(
+                        fleet.systems, host_timeout=args.host_timeout, sweep_timeout=args.sweep_timeout))
+                else:
+                    results = collector.collect_all(
+                        fleet.systems, max_workers=args.workers, host_timeout=args.host_timeout,
+                        sweep_timeout=args.sweep_timeout)
+                collected = time.perf_counter()
+                if args.process:
+                    collector.process_results(results, verbose=False)
+            finally:
+                sys.stdout = stdout
+        finished = time.perf_counter()
+
+        online = sum(1 for r in results if r['metrics'].get('status') == 'online')
+        latencies.extend(r['elapsed'] for r in results if r['elapsed'] is not None)
+        sweeps.append({
+            'sweep': sweep + 1,
+            'wall_seconds': round(finished - started, 3),
+            'collect_seconds': round(collected - started, 3),
+            'process_seconds': round(finished - collected, 3),
+            'cpu_seconds': round(time.process_time() - cpu_before, 3),
+            'online': online,
+            'offline': len(results) - online,
+        })
+        if not args.json:
+            s = sweeps[-1]
+            print(f"  sweep {s['sweep']}: {s['wall_seconds']:.2f}s wall "
+                  f"(collect {s['collect_seconds']:.2f}s, process {s['process_seconds']:.2f}s), "
+                  f"{s['cpu_seconds']:.2f}s CPU, {online}/{len(results)} online", flush=True)
+
+    # Local-host path: matching services against a process table of this size
+    index = synthetic_index(fleet.process_table())
+    rules = [(name, name, None) for name in SERVICES]
+    started = time.perf_counter()
+    for _ in range(100):
+        index.match(rules)
+    match_ms = (time.perf_counter() - started) * 10
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    current_rss, peak_rss = rss_mb()
+    walls = [s['wall_seconds'] for s in sweeps]
+    return {
+        'config': vars(args),
+        'sweeps': sweeps,
+        'summary': {
+            'wall_seconds_mean': round(statistics.mean(walls), 3),
+            'wall_seconds_max': round(max(walls), 3),
+            'host_latency_p50': percentile(latencies, 50),
+            'host_latency_p99': percentile(latencies, 99),
+            'cpu_seconds_total': round(sum(s['cpu_seconds'] for s in sweeps), 3),
+            'cpu_user_seconds': round(usage.ru_utime, 3),
+            'cpu_system_seconds': round(usage.ru_stime, 3),
+            'rss_mb': round(current_rss, 1) if current_rss is not None else None,
+            'rss_peak_mb': round(peak_rss, 1),
+            'ssh_calls': fleet.calls,
+            'service_match_ms': round(match_ms, 3),
+        },
+        'phases': {phase: {'count': count, 'total_seconds': round(total, 4),
+                           'mean_ms': round(1000 * total / count, 3) if count else None}
+                   for phase, (_, count, total) in sorted(collector.TIMINGS.snapshot().items())},
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark collector sweeps against simulated hosts.')
+    parser.add_argument('--hosts', type=int, default=50, help='simulated SSH hosts (default %(default)s)')
+    parser.add_argument('--sweeps', type=int, default=3, help='sweeps to run (default %(default)s)')
+    parser.add_argument('--engine', choices=('threads', 'async'), default='threads')
+    parser.add_argument('--workers', type=int, default=collector.MAX_WORKERS,
+                        help='thread engine: concurrent hosts (default %(default)s)')
+    parser.add_argument('--latency', type=float, default=0.2, help='mean SSH round trip, seconds')
+    parser.add_argument('--jitter', type=float, default=0.5, help='latency spread as a fraction of --latency')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='fraction of calls that fail')
+    parser.add_argument('--failure-latency', type=float, default=1.0,
+                        help='seconds a failing call takes (capped by the host timeout)')
+    parser.add_argument('--procs', type=int, default=300, help='processes per simulated host')
+    parser.add_argument('--host-timeout', type=float, default=collector.HOST_TIMEOUT)
+    parser.add_argument('--sweep-timeout', type=float, default=collector.SWEEP_TIMEOUT)
+    parser.add_argument('--process', action='store_true',
+                        help='also run alerting and local history (process_results) each sweep')
+    parser.add_argument('--no-breaker', action='store_true', help='bypass the per-host circuit breaker')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args(argv)
+
+    if not args.json:
+        print(f"Benchmarking {args.hosts} simulated hosts, {args.sweeps} sweeps, {args.engine} engine")
+    report = run_benchmark(args)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return report
+
+    s = report['summary']
+    p50 = f"{s['host_latency_p50']:.3f}s" if s['host_latency_p50'] is not None else "n/a"
+    p99 = f"{s['host_latency_p99']:.3f}s" if s['host_latency_p99'] is not None else "n/a"
+    rss = f"{s['rss_mb']:.1f} MB" if s['rss_mb'] is not None else "n/a"
+    print()
+    print(f"Sweep wall time:  {s['wall_seconds_mean']:.3f}s mean, {s['wall_seconds_max']:.3f}s max")
+    print(f"Host latency:     p50 {p50}, p99 {p99}")
+    print(f"Collector CPU:    {s['cpu_seconds_total']:.3f}s over all sweeps "
+          f"({s['cpu_user_seconds']:.2f}s user, {s['cpu_system_seconds']:.2f}s system incl. setup)")
+    print(f"Collector RSS:    {rss} now, {s['rss_peak_mb']:.1f} MB peak")
+    print(f"SSH calls:        {s['ssh_calls']}")
+    print(f"Service match:    {s['service_match_ms']:.3f} ms per {args.procs}-process table (local host path)")
+    print("Phases:")
+    for phase, p in report['phases'].items():
+        print(f"  {phase:<16}{p['count']:>7} spans  {p['total_seconds']:>9.3f}s total  {p['mean_ms']:>9.3f} ms mean")
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -2,16 +2,39 @@
 """
 Central System Collector
 Runs on Mac Studio, collects metrics from all systems via SSH, and reports to Supabase.
+
+The spool, CPU sampler, process index, alert rules and tracker and the
+L7MS codec are imported from monitor_agent.py, which must sit next to this
+file.
 """
 
 import os
 import sys
 import json
+import bisect
+import math
+import mmap
+import struct
+import random
+import signal
+import argparse
+import asyncio
+import gzip
+import hmac
 import subprocess
 import socket
-from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import time
+import threading
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
+from urllib.parse import urlparse
+
+from monitor_agent import (
+    WIRE_CONTENT_TYPE, AlertTracker, CpuSampler, ProcessIndex, RuleEngine, Spool, decode_samples,
+    is_permanent_error,
+)
 
 try:
     import psutil
@@ -48,6 +71,96 @@ N8N_WEBHOOK_URL = os.environ.get('N8N_ALERT_WEBHOOK', '')
 TELEGRAM_BOT_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN', '')
 TELEGRAM_CHAT_ID = os.environ.get('TELEGRAM_CHAT_ID', '')
 
+# Sweep limits: hosts are collected concurrently, so a sweep takes as long as
+# the slowest host (bounded by HOST_TIMEOUT), not the sum of all hosts.
+MAX_WORKERS = int(os.environ.get('COLLECTOR_MAX_WORKERS', '8'))
+ASYNC_MAX_SSH = int(os.environ.get('COLLECTOR_MAX_SSH', '64'))  # --engine async: concurrent SSH sessions
+COLLECTOR_ENGINE = os.environ.get('COLLECTOR_ENGINE', 'threads')
+HOST_TIMEOUT = float(os.environ.get('COLLECTOR_HOST_TIMEOUT', '45'))
+SWEEP_TIMEOUT = float(os.environ.get('COLLECTOR_SWEEP_TIMEOUT', '90'))
+
+# SSH connection reuse (OpenSSH ControlMaster). Keep the control dir short:
+# unix socket paths are limited to ~104 bytes on macOS. A socket is the dir,
+# a 40-character %C hash and, while ssh sets it up, a 17-character suffix.
+SSH_CONTROL_DIR = Path(os.environ.get('COLLECTOR_SSH_CONTROL_DIR', str(Path.home() / '.ssh' / 'l7-cm')))
+SSH_SOCKET_PATH_MAX = 104
+SSH_CONTROL_PERSIST = int(os.environ.get('COLLECTOR_SSH_PERSIST', '600'))
+SSH_HEALTH_INTERVAL = 60
+
+# Daemon mode: default seconds between polls of a host (override per system
+# with an 'interval' key) and the fraction of an interval used as jitter.
+DAEMON_INTERVAL = float(os.environ.get('COLLECTOR_INTERVAL', '15'))
+DAEMON_JITTER = float(os.environ.get('COLLECTOR_JITTER', '0.1'))
+
+# Adaptive polling (daemon mode): stable hosts are polled less often, hosts
+# near trouble more often, and offline hosts back off exponentially
+ADAPTIVE_POLLING = os.environ.get('COLLECTOR_ADAPTIVE', '1') != '0'
+ADAPTIVE_MAX_FACTOR = 4.0  # stable hosts stretch to at most interval * this
+ADAPTIVE_HOT_FACTOR = 3.0  # hot hosts are polled this many times faster
+ADAPTIVE_MIN_INTERVAL = 5.0
+ADAPTIVE_MAX_BACKOFF = float(os.environ.get('COLLECTOR_MAX_BACKOFF', '600'))
+ADAPTIVE_MARGIN = 10.0  # points below a rule threshold that count as "near"
+ADAPTIVE_STABLE_DELTA = 2.0  # change in points between polls that still counts as stable
+ADAPTIVE_HOT_POLLS = 4  # fast polls after a host last looked hot
+
+# Supabase writes are buffered and sent as one bulk insert per flush window
+FLUSH_ROWS = int(os.environ.get('COLLECTOR_FLUSH_ROWS', '500'))
+FLUSH_SECONDS = float(os.environ.get('COLLECTOR_FLUSH_SECONDS', '60'))
+
+# Local state (spool, alerts, etc.) lives here. The collector and the agent
+# may share MONITOR_STATE_DIR on one machine, so each keeps its own subdirectory.
+STATE_DIR = Path(os.environ.get('MONITOR_STATE_DIR', str(Path(__file__).parent / '.state'))) / 'collector'
+
+# Rows that can't reach Supabase are spooled to disk and replayed later
+SPOOL_DIR = STATE_DIR / 'spool'
+SPOOL_MAX_BYTES = int(os.environ.get('MONITOR_SPOOL_MAX_BYTES', str(64 * 1024 * 1024)))
+
+# Per-host circuit breaker for SSH systems: after BREAKER_FAILURES straight
+# failures a host is skipped for BREAKER_COOLDOWN seconds (doubling up to
+# BREAKER_MAX_COOLDOWN while it stays down), then probed with a TCP connect
+BREAKER_STATE_PATH = STATE_DIR / 'breakers.json'
+BREAKER_FAILURES = int(os.environ.get('COLLECTOR_BREAKER_FAILURES', '2'))
+BREAKER_COOLDOWN = float(os.environ.get('COLLECTOR_BREAKER_COOLDOWN', '120'))
+BREAKER_MAX_COOLDOWN = 1800
+BREAKER_PROBE_TIMEOUT = 2.0
+
+# Alert state and rate() history. The rules file (MONITOR_ALERT_RULES) and
+# the notification policy are monitor_agent.py's ALERT_RULES_PATH and
+# ALERT_POLICY; DEFAULT_ALERT_RULES below apply when there is no rules file.
+ALERT_STATE_PATH = STATE_DIR / 'alerts.json'
+RULE_HISTORY_PATH = STATE_DIR / 'rule_history.json'
+
+# Local metric history: (tier, bucket seconds, capacity). Raw keeps the
+# last 8640 samples (24h at 10s), 1m keeps 7 days and 1h keeps a year.
+# Completed 1m/1h buckets are also written to system_metrics_rollup.
+HISTORY_DIR = STATE_DIR / 'history'
+HISTORY_METRICS = ('cpu_percent', 'memory_percent', 'disk_percent', 'load_avg_1m')
+HISTORY_TIERS = (('raw', 0, 8640), ('1m', 60, 7 * 1440), ('1h', 3600, 365 * 24))
+HISTORY_MAX_OPEN = 96  # ring files kept mapped at once (one fd each)
+
+# HTTP endpoint (daemon mode, --http-port): /metrics for Prometheus, /ingest for agents
+HTTP_HOST = os.environ.get('COLLECTOR_HTTP_HOST', '127.0.0.1')
+HTTP_PORT = int(os.environ.get('COLLECTOR_HTTP_PORT', '0'))
+INGEST_TOKEN = os.environ.get('COLLECTOR_INGEST_TOKEN', '')
+INGEST_MAX_BYTES = 1024 * 1024
+PUSH_STALE_SECONDS = int(os.environ.get('COLLECTOR_PUSH_STALE', '120'))
+
+# Self-instrumentation: histogram bucket bounds (seconds) for phase timings
+TIMING_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+DEFAULT_ALERT_RULES = [
+    {'type': 'system_offline', 'when': "status == 'offline'", 'offline': True, 'severity': 'critical',
+     'message': '🔴 {hostname} is OFFLINE'},
+    {'type': 'high_cpu', 'when': 'cpu_percent > 90', 'critical': 'cpu_percent > 95',
+     'metric': 'cpu_percent', 'threshold': 90, 'message': '⚠️ High CPU on {hostname}: {cpu_percent}%'},
+    {'type': 'high_memory', 'when': 'memory_percent > 85', 'critical': 'memory_percent > 95',
+     'metric': 'memory_percent', 'threshold': 85, 'message': '⚠️ High Memory on {hostname}: {memory_percent}%'},
+    {'type': 'disk_space', 'when': 'disk_percent > 80', 'critical': 'disk_percent > 90',
+     'metric': 'disk_percent', 'threshold': 80, 'message': '💾 Low Disk Space on {hostname}: {disk_percent}%'},
+    {'type': 'service_down', 'scope': 'service', 'when': 'not is_running', 'severity': 'critical',
+     'message': '🔴 {service_name} is DOWN on {hostname}'},
+]
+
 # Systems to monitor
 SYSTEMS = [
     {
@@ -78,21 +191,377 @@ SYSTEMS = [
 ]
 
 
-def run_ssh_command(host, user, command, timeout=30):
-    """Execute command on remote host via SSH."""
+class Timings:
+    """Self-instrumentation: how long each phase of collection takes.
+
+    span(phase) times a block. Durations feed cumulative histograms (served
+    at /metrics) and a per-sweep window that drain() summarises and resets
+    (the 'timings' in --json output).
+    """
+
+    def __init__(self, buckets=TIMING_BUCKETS):
+        self.buckets = tuple(float(b) for b in buckets)
+        self.histograms = {}
+        self.window = {}
+        self._lock = threading.Lock()
+
+    def span(self, phase):
+        return _Span(self, phase)
+
+    def observe(self, phase, seconds):
+        with self._lock:
+            hist = self.histograms.get(phase)
+            if hist is None:
+                hist = self.histograms[phase] = {'counts': [0] * (len(self.buckets) + 1), 'sum': 0.0}
+            hist['counts'][bisect.bisect_left(self.buckets, seconds)] += 1
+            hist['sum'] += seconds
+            self.window.setdefault(phase, []).append(seconds)
+
+    def snapshot(self):
+        """Cumulative histograms: {phase: (cumulative bucket counts incl. +Inf, count, sum)}."""
+        with self._lock:
+            snapshot = {}
+            for phase, hist in self.histograms.items():
+                cumulative, running = [], 0
+                for count in hist['counts']:
+                    running += count
+                    cumulative.append(running)
+                snapshot[phase] = (cumulative, running, hist['sum'])
+            return snapshot
+
+    def drain(self):
+        """Summarise the spans recorded since the last drain() and start a new window."""
+        with self._lock:
+            window, self.window = self.window, {}
+
+        summary = {}
+        for phase, values in sorted(window.items()):
+            values.sort()
+            summary[phase] = {
+                'count': len(values),
+                'total': round(sum(values), 4),
+                'p50': round(values[(len(values) - 1) // 2], 4),
+                'p95': round(values[int(0.95 * (len(values) - 1))], 4),
+                'max': round(values[-1], 4),
+            }
+        return summary
+
+
+class _Span:
+    """Context manager for Timings.span(); .seconds is set on exit."""
+
+    __slots__ = ('timings', 'phase', 'started', 'seconds')
+
+    def __init__(self, timings, phase):
+        self.timings = timings
+        self.phase = phase
+        self.seconds = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.seconds = time.perf_counter() - self.started
+        self.timings.observe(self.phase, self.seconds)
+        return False
+
+
+TIMINGS = Timings()
+
+
+def time_left(deadline, default=30):
+    """Seconds remaining until a monotonic deadline (default when no deadline)."""
+    if deadline is None:
+        return default
+    return min(default, deadline - time.monotonic())
+
+
+class SSHPool:
+    """One persistent SSH master connection per host.
+
+    Commands ride on an OpenSSH ControlMaster socket, so only the first
+    command to a host pays the TCP + key exchange handshake; the master stays
+    up for SSH_CONTROL_PERSIST seconds after the last use (across cron runs
+    too). Masters are health-checked periodically and torn down when stale so
+    the next command reconnects cleanly. If control_dir is too long for a
+    socket path, ssh would refuse every command, so the pool falls back to
+    one plain connection per command.
+    """
+
+    def __init__(self, control_dir=SSH_CONTROL_DIR, persist=SSH_CONTROL_PERSIST,
+                 health_interval=SSH_HEALTH_INTERVAL):
+        self.control_dir = Path(control_dir)
+        self.persist = persist
+        self.health_interval = health_interval
+        self._lock = threading.Lock()
+        self._last_check = {}
+        self.multiplex = len(os.fsencode(self.control_dir)) + 1 + 40 + 17 < SSH_SOCKET_PATH_MAX
+        if not self.multiplex:
+            print(f"⚠️  SSH control dir {self.control_dir} is too long for a socket path; "
+                  f"not reusing connections (set COLLECTOR_SSH_CONTROL_DIR)")
+
+    def _options(self):
+        options = ['-o', 'ConnectTimeout=10', '-o', 'StrictHostKeyChecking=no']
+        if not self.multiplex:
+            return options + ['-o', 'ControlMaster=no', '-o', 'ControlPath=none']
+        return options + [
+            '-o', 'ControlMaster=auto',
+            '-o', f'ControlPath={self.control_dir / "%C"}',
+            '-o', f'ControlPersist={self.persist}',
+        ]
+
+    def _control(self, target, operation):
+        """Run an `ssh -O <operation>` against the master for target."""
+        if not self.multiplex:
+            return False
+        try:
+            result = subprocess.run(
+                ['ssh', *self._options(), '-O', operation, target],
+                capture_output=True, text=True, timeout=5,
+            )
+            return result.returncode == 0
+        except (subprocess.TimeoutExpired, OSError):
+            return False
+
+    def is_alive(self, target):
+        """Check whether a master connection is up for target."""
+        return self._control(target, 'check')
+
+    def reset(self, target):
+        """Tear down the master for target; the next command reconnects."""
+        self._control(target, 'exit')
+        with self._lock:
+            self._last_check.pop(target, None)
+
+    def _health_check(self, target):
+        """Drop a dead master (stale socket) at most once per health_interval."""
+        now = time.monotonic()
+        with self._lock:
+            last = self._last_check.get(target)
+            if last is not None and now - last < self.health_interval:
+                return
+            self._last_check[target] = now
+        if last is not None and not self.is_alive(target):
+            self.reset(target)
+
+    def run(self, host, user, command, timeout=30, input=None):
+        """Execute command on host over the pooled connection.
+
+        Returns the CompletedProcess. A command that fails on a broken control
+        socket is retried once on a fresh connection.
+        """
+        if self.multiplex:
+            self.control_dir.mkdir(mode=0o700, parents=True, exist_ok=True)
+        target = f'{user}@{host}'
+        self._health_check(target)
+
+        started = time.monotonic()
+        args = ['ssh', *self._options(), target, command]
+        result = subprocess.run(args, capture_output=True, text=True, input=input, timeout=timeout)
+
+        if result.returncode == 255 and 'mux_client' in result.stderr.lower():
+            self.reset(target)
+            remaining = timeout - (time.monotonic() - started)
+            if remaining > 0:
+                result = subprocess.run(args, capture_output=True, text=True, input=input,
+                                        timeout=remaining)
+
+        return result
+
+    async def run_async(self, host, user, command, timeout=30, input=None):
+        """Asyncio twin of run(); returns (returncode, stdout, stderr).
+
+        Raises asyncio.TimeoutError once timeout passes; the ssh process is
+        killed on timeout or cancellation.
+        """
+        if self.multiplex:
+            self.control_dir.mkdir(mode=0o700, parents=True, exist_ok=True)
+        target = f'{user}@{host}'
+        await asyncio.to_thread(self._health_check, target)
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        args = ['ssh', *self._options(), target, command]
+        for attempt in range(2):
+            proc = await asyncio.create_subprocess_exec(
+                *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+                stdin=asyncio.subprocess.PIPE if input is not None else asyncio.subprocess.DEVNULL,
+            )
+            try:
+                stdout, stderr = await asyncio.wait_for(
+                    proc.communicate(input.encode() if input is not None else None),
+                    timeout=max(0.0, deadline - loop.time()),
+                )
+            except BaseException:
+                try:
+                    proc.kill()
+                except ProcessLookupError:
+                    pass
+                await proc.wait()
+                raise
+
+            stdout, stderr = stdout.decode(errors='replace'), stderr.decode(errors='replace')
+            if (proc.returncode == 255 and 'mux_client' in stderr.lower() and attempt == 0
+                    and deadline > loop.time()):
+                await asyncio.to_thread(self.reset, target)
+                continue
+            return proc.returncode, stdout, stderr
+
+    def close(self, systems=None):
+        """Shut down the masters for the given systems (default: all SSH systems)."""
+        for system in systems or SYSTEMS:
+            if system.get('method') == 'ssh':
+                self.reset(f"{system['ssh_user']}@{system['ssh_host']}")
+
+
+SSH_POOL = SSHPool()
+
+
+def run_ssh_command(host, user, command, timeout=30, input=None):
+    """Execute command on remote host via SSH.
+
+    Returns (output, returncode); on failure output falls back to stderr.
+    returncode is None when ssh timed out or could not be started.
+    """
+    if timeout <= 0:
+        return "Timeout", None
+
     try:
-        result = subprocess.run(
-            ['ssh', '-o', 'ConnectTimeout=10', '-o', 'StrictHostKeyChecking=no',
-             f'{user}@{host}', command],
-            capture_output=True,
-            text=True,
-            timeout=timeout
-        )
-        return result.stdout.strip(), result.returncode == 0
+        result = SSH_POOL.run(host, user, command, timeout=timeout, input=input)
+        if result.returncode != 0:
+            return (result.stdout.strip() or result.stderr.strip()), result.returncode
+        return result.stdout.strip(), 0
     except subprocess.TimeoutExpired:
-        return "Timeout", False
+        return "Timeout", None
+    except Exception as e:
+        return str(e), None
+
+
+async def run_ssh_command_async(host, user, command, timeout=30, input=None):
+    """Asyncio twin of run_ssh_command(); returns (output, returncode)."""
+    if timeout <= 0:
+        return "Timeout", None
+
+    try:
+        returncode, stdout, stderr = await SSH_POOL.run_async(host, user, command, timeout=timeout, input=input)
+    except asyncio.TimeoutError:
+        return "Timeout", None
     except Exception as e:
-        return str(e), False
+        return str(e), None
+    if returncode != 0:
+        return (stdout.strip() or stderr.strip()), returncode
+    return stdout.strip(), 0
+
+
+def ssh_reached_host(returncode):
+    """Whether an SSH attempt got through to the host.
+
+    ssh itself exits 255 when it can't connect or authenticate (refused,
+    unreachable, bad key), and None means it timed out. Any other exit code
+    comes from the remote command, so the host is up even if the probe failed.
+    """
+    return returncode is not None and returncode != 255
+
+
+class CircuitBreaker:
+    """Per-host circuit breaker in front of SSH collection.
+
+    closed     collect normally; BREAKER_FAILURES consecutive SSH transport
+               failures (see ssh_reached_host) open the circuit
+    open       skip the host (reported offline at no cost) until its
+               cooldown passes
+    half_open  after the cooldown, a TCP connect to the SSH port decides:
+               unreachable re-opens with a doubled cooldown, reachable lets
+               one SSH attempt through, whose result closes or re-opens it
+
+    State is saved to disk so one-shot runs share it.
+    """
+
+    def __init__(self, path=BREAKER_STATE_PATH, failures=BREAKER_FAILURES, cooldown=BREAKER_COOLDOWN):
+        self.path = Path(path)
+        self.failures = failures
+        self.cooldown = cooldown
+        self.state = self._load()
+        self._lock = threading.Lock()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save(self):
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_suffix('.tmp')
+            with open(tmp, 'w') as f:
+                json.dump(self.state, f, indent=1)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print(f"Error saving breaker state: {e}")
+
+    def _entry(self, hostname):
+        return self.state.setdefault(hostname, {'state': 'closed', 'failures': 0, 'opened_at': 0,
+                                                'cooldown': self.cooldown})
+
+    @staticmethod
+    def port_open(host, port=22, timeout=BREAKER_PROBE_TIMEOUT):
+        """Cheap reachability check: can a TCP connection be made at all?"""
+        try:
+            socket.create_connection((host, port), timeout=timeout).close()
+            return True
+        except OSError:
+            return False
+
+    def allow(self, system, deadline=None):
+        """Whether to attempt SSH now; returns (allowed, reason if not)."""
+        hostname = system['hostname']
+        with self._lock:
+            entry = self._entry(hostname)
+            if entry['state'] != 'open':
+                return True, None
+            remaining = entry['opened_at'] + entry['cooldown'] - time.time()
+            if remaining > 0:
+                return False, f"Circuit open after {entry['failures']} failures (retry in {remaining:.0f}s)"
+
+        port = system.get('ssh_port', 22)
+        reachable = self.port_open(system['ssh_host'], port, timeout=max(0.1, time_left(deadline, BREAKER_PROBE_TIMEOUT)))
+        with self._lock:
+            entry = self._entry(hostname)
+            if reachable:
+                entry['state'] = 'half_open'
+            else:
+                entry['opened_at'] = time.time()
+                entry['cooldown'] = min(entry['cooldown'] * 2, BREAKER_MAX_COOLDOWN)
+            self.save()
+        if reachable:
+            return True, None
+        return False, f"Circuit open: port {port} unreachable (retry in {entry['cooldown']:.0f}s)"
+
+    def record(self, system, success):
+        """Feed back whether an SSH attempt allowed by allow() reached the host."""
+        with self._lock:
+            entry = self._entry(system['hostname'])
+            previous = entry['state']
+            if success:
+                entry.update(state='closed', failures=0, cooldown=self.cooldown)
+            else:
+                entry['failures'] += 1
+                if previous == 'half_open' or entry['failures'] >= self.failures:
+                    if previous == 'half_open':
+                        entry['cooldown'] = min(entry['cooldown'] * 2, BREAKER_MAX_COOLDOWN)
+                    entry.update(state='open', opened_at=time.time())
+            if entry['state'] != previous:
+                print(f"  Circuit for {system['display_name']}: {previous} -> {entry['state']}", flush=True)
+                self.save()
+
+
+BREAKER = CircuitBreaker()
+
+
+CPU_SAMPLER = CpuSampler()
 
 
 def collect_local_metrics():
@@ -107,8 +576,8 @@ def collect_local_metrics():
         'status': 'online',
     }
 
-    # CPU
-    metrics['cpu_percent'] = psutil.cpu_percent(interval=1)
+    # CPU (delta since the previous sample; no blocking interval)
+    metrics['cpu_percent'], metrics['cpu_per_core'] = CPU_SAMPLER.sample()
 
     # Memory
     mem = psutil.virtual_memory()
@@ -138,197 +607,362 @@ def collect_local_metrics():
     return metrics
 
 
-def collect_windows_metrics(system):
-    """Collect metrics from Windows VM via SSH."""
-    host = system['ssh_host']
-    user = system['ssh_user']
+# Remote probe: a self-contained script piped to the host's Python over stdin
+# (`python3 - <services...>`), so there is nothing to escape and every host
+# answers with the same JSON document in a single round trip. Uses psutil when
+# the host has it and falls back to /proc on Linux. Bump PROBE_VERSION when the
+# output schema changes.
+PROBE_VERSION = 2
+
+PROBE_SCRIPT = r'''
+import json, os, sys, time
+
+PROBE_VERSION = 2
+# CPU is measured as the delta against the counters saved by the previous
+# run; only a first (or stale) run has to sample for PRIME_SECONDS.
+STATE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'l7-probe')
+STATE_PATH = os.path.join(STATE_DIR, 'state.json')
+MAX_STATE_AGE = 900
+PRIME_SECONDS = 0.25
+STATE_FORMAT = 2  # bump when the saved snapshot layout changes
+GB = 1024 ** 3
+services = [s.lower() for s in sys.argv[1:]]
+# This probe and the shell that started it carry every service name in their command lines
+OWN_PIDS = (os.getpid(), os.getppid())
+
+
+def proc_name(name):
+    name = (name or '').lower()
+    return name[:-4] if name.endswith('.exe') else name
+
+
+def match_services(name, cmdline):
+    """Services whose name is a substring of the process name, or failing
+    that of its command line (Linux truncates comm names to 15 characters,
+    and e.g. n8n runs as node)."""
+    matched = [svc for svc in services if svc in name]
+    if len(matched) < len(services):
+        cmdline = cmdline().lower()
+        matched += [svc for svc in services if svc not in matched and svc in cmdline]
+    return matched
+
+
+class PsutilHost(object):
+    def __init__(self):
+        import psutil
+        self.psutil = psutil
+
+    def snapshot(self):
+        # Guest time is also counted in user/nice on Linux
+        cores = [[sum(t) - getattr(t, 'guest', 0) - getattr(t, 'guest_nice', 0),
+                  t.idle + getattr(t, 'iowait', 0)]
+                 for t in self.psutil.cpu_times(percpu=True)]
+        procs = {}
+        for p in self.psutil.process_iter(['name', 'cmdline', 'cpu_times', 'memory_info']):
+            if p.pid in OWN_PIDS:
+                continue
+            name = proc_name(p.info['name'])
+            matched = match_services(name, lambda: ' '.join(p.info['cmdline'] or []))
+            if matched and p.info['cpu_times'] and p.info['memory_info']:
+                t = p.info['cpu_times']
+                procs[str(p.pid)] = [name, t.user + t.system, p.info['memory_info'].rss, matched]
+        return {'format': STATE_FORMAT, 'time': time.time(), 'cores': cores, 'procs': procs}
+
+    def metrics(self):
+        mem = self.psutil.virtual_memory()
+        disk = self.psutil.disk_usage('C:/' if os.name == 'nt' else '/')
+        return {
+            'memory_percent': mem.percent,
+            'memory_used_gb': round(mem.used / GB, 2),
+            'memory_total_gb': round(mem.total / GB, 2),
+            'disk_percent': disk.percent,
+            'disk_used_gb': round(disk.used / GB, 2),
+            'disk_total_gb': round(disk.total / GB, 2),
+            'uptime_seconds': int(time.time() - self.psutil.boot_time()),
+            'process_count': len(self.psutil.pids()),
+        }
+
+
+class ProcHost(object):
+    """Linux hosts without psutil: read /proc directly."""
+
+    def __init__(self):
+        self.hz = os.sysconf('SC_CLK_TCK')
+        self.page = os.sysconf('SC_PAGE_SIZE')
+        self.pids = 0
+
+    def snapshot(self):
+        cores = []
+        with open('/proc/stat') as f:
+            for line in f:
+                if line.startswith('cpu') and line[3].isdigit():
+                    values = [int(v) for v in line.split()[1:]]
+                    # Fields 9-10 (guest, guest_nice) are already in user/nice
+                    cores.append([sum(values[:8]), values[3] + values[4]])
+        procs = {}
+        self.pids = 0
+        for pid in os.listdir('/proc'):
+            if not pid.isdigit():
+                continue
+            self.pids += 1
+            if int(pid) in OWN_PIDS:
+                continue
+            try:
+                with open('/proc/%s/stat' % pid) as f:
+                    stat = f.read()
+                name = proc_name(stat[stat.index('(') + 1:stat.rindex(')')])
+                matched = match_services(name, lambda: self.cmdline(pid))
+                if not matched:
+                    continue
+                fields = stat[stat.rindex(')') + 2:].split()
+                ticks = int(fields[11]) + int(fields[12])
+                procs[pid] = [name, float(ticks) / self.hz, int(fields[21]) * self.page, matched]
+            except (OSError, ValueError, IndexError):
+                continue
+        return {'format': STATE_FORMAT, 'time': time.time(), 'cores': cores, 'procs': procs}
+
+    @staticmethod
+    def cmdline(pid):
+        try:
+            with open('/proc/%s/cmdline' % pid, 'rb') as f:
+                return f.read().replace(b'\0', b' ').decode('utf-8', 'replace')
+        except OSError:
+            return ''
+
+    def metrics(self):
+        meminfo = {}
+        with open('/proc/meminfo') as f:
+            for line in f:
+                key, value = line.split(':', 1)
+                meminfo[key] = int(value.split()[0]) * 1024
+        mem_total = meminfo['MemTotal']
+        mem_used = mem_total - meminfo.get('MemAvailable', meminfo.get('MemFree', 0))
+        st = os.statvfs('/')
+        disk_total = st.f_blocks * st.f_frsize
+        disk_used = (st.f_blocks - st.f_bfree) * st.f_frsize
+        disk_avail = st.f_bavail * st.f_frsize
+        with open('/proc/uptime') as f:
+            uptime = int(float(f.read().split()[0]))
+        return {
+            'memory_percent': round(100.0 * mem_used / mem_total, 1),
+            'memory_used_gb': round(mem_used / GB, 2),
+            'memory_total_gb': round(mem_total / GB, 2),
+            'disk_percent': round(100.0 * disk_used / (disk_used + disk_avail), 1) if disk_total else None,
+            'disk_used_gb': round(disk_used / GB, 2),
+            'disk_total_gb': round(disk_total / GB, 2),
+            'uptime_seconds': uptime,
+            'process_count': self.pids,
+        }
+
+
+def load_state():
+    try:
+        with open(STATE_PATH) as f:
+            state = json.load(f)
+        if state.get('format') == STATE_FORMAT and 0 < time.time() - state['time'] < MAX_STATE_AGE:
+            return state
+    except (OSError, ValueError, KeyError):
+        pass
+    return None
 
-    # Simple Python command with short keys to avoid SSH escaping issues
-    python_cmd = "python -c \"import json,psutil;m=psutil.virtual_memory();d=psutil.disk_usage('C:/');print(json.dumps({'c':psutil.cpu_percent(interval=1),'m':m.percent,'mu':round(m.used/(1024**3),2),'mt':round(m.total/(1024**3),2),'d':d.percent,'du':round(d.used/(1024**3),2),'dt':round(d.total/(1024**3),2),'p':len(psutil.pids())}))\""
 
-    output, success = run_ssh_command(host, user, python_cmd)
+def save_state(state):
+    try:
+        # A private per-user directory: a shared temp dir would let other
+        # users plant a symlink or a poisoned state file
+        if not os.path.isdir(STATE_DIR):
+            os.makedirs(STATE_DIR, 0o700)
+        tmp = STATE_PATH + '.tmp'
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp, STATE_PATH)
+    except OSError:
+        pass
 
-    if success:
-        try:
-            data = json.loads(output)
-            # Map short keys to full names (for SSH escaping simplicity)
-            metrics = {
-                'hostname': system['hostname'],
-                'timestamp': datetime.utcnow().isoformat(),
-                'system_type': 'windows',
-                'status': 'online',
-                'cpu_percent': data.get('c', data.get('cpu_percent')),
-                'memory_percent': data.get('m', data.get('memory_percent')),
-                'memory_used_gb': data.get('mu', data.get('memory_used_gb')),
-                'memory_total_gb': data.get('mt', data.get('memory_total_gb')),
-                'disk_percent': data.get('d', data.get('disk_percent')),
-                'disk_used_gb': data.get('du', data.get('disk_used_gb')),
-                'disk_total_gb': data.get('dt', data.get('disk_total_gb')),
-                'process_count': data.get('p', data.get('process_count')),
-            }
-            return metrics
-        except json.JSONDecodeError:
-            pass
 
-    return {
+def busy_percent(before, after):
+    total = after[0] - before[0]
+    idle = after[1] - before[1]
+    return round(100.0 * (total - idle) / total, 1) if total > 0 else 0.0
+
+
+try:
+    host = PsutilHost()
+except ImportError:
+    host = ProcHost()
+
+previous = load_state()
+if previous is None:
+    previous = host.snapshot()
+    time.sleep(PRIME_SECONDS)
+current = host.snapshot()
+save_state(current)
+
+elapsed = max(current['time'] - previous['time'], 1e-6)
+metrics = host.metrics()
+if len(previous['cores']) == len(current['cores']):
+    per_core = [busy_percent(b, a) for b, a in zip(previous['cores'], current['cores'])]
+    total_before = [sum(c[0] for c in previous['cores']), sum(c[1] for c in previous['cores'])]
+    total_after = [sum(c[0] for c in current['cores']), sum(c[1] for c in current['cores'])]
+    metrics['cpu_percent'] = busy_percent(total_before, total_after)
+    metrics['cpu_per_core'] = per_core
+
+try:
+    load = os.getloadavg()
+    metrics['load_avg_1m'] = round(load[0], 2)
+    metrics['load_avg_5m'] = round(load[1], 2)
+    metrics['load_avg_15m'] = round(load[2], 2)
+except (AttributeError, OSError):
+    pass
+
+report = []
+for svc in services:
+    matched = [(pid, p) for pid, p in current['procs'].items() if svc in p[3]]
+    cpu = [100.0 * (p[1] - previous['procs'][pid][1]) / elapsed
+           for pid, p in matched
+           if pid in previous['procs'] and previous['procs'][pid][0] == p[0]]
+    report.append({
+        'service_name': svc,
+        'is_running': bool(matched),
+        'process_count': len(matched),
+        'cpu_percent': round(sum(cpu), 1) if cpu else None,
+        'memory_mb': round(sum(p[2] for _, p in matched) / (1024 ** 2), 2) if matched else None,
+    })
+
+print(json.dumps({
+    'probe_version': PROBE_VERSION,
+    'metrics': metrics,
+    'services': report,
+}))
+'''
+
+# Metric fields accepted from a probe document
+PROBE_METRIC_FIELDS = (
+    'cpu_percent', 'memory_percent', 'memory_used_gb', 'memory_total_gb',
+    'disk_percent', 'disk_used_gb', 'disk_total_gb',
+    'load_avg_1m', 'load_avg_5m', 'load_avg_15m',
+    'uptime_seconds', 'process_count', 'cpu_per_core',
+)
+
+
+def build_probe_command(system):
+    """Remote command line that runs PROBE_SCRIPT (fed on stdin) for a system."""
+    python = system.get('python', 'python' if system['type'] == 'windows' else 'python3')
+    return ' '.join([python, '-', *system.get('services', [])])
+
+
+def parse_probe_output(system, output):
+    """Parse a probe document into (metrics, services).
+
+    Raises ValueError if the output is not a probe document of the expected version.
+    """
+    try:
+        data = json.loads(output)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Invalid probe output: {e}")
+
+    if not isinstance(data, dict) or data.get('probe_version') != PROBE_VERSION:
+        raise ValueError(f"Unsupported probe version: {data.get('probe_version') if isinstance(data, dict) else None}")
+
+    reported = data.get('metrics') or {}
+    metrics = {
         'hostname': system['hostname'],
         'timestamp': datetime.utcnow().isoformat(),
-        'system_type': 'windows',
-        'status': 'offline',
-        'error': output if not success else 'Parse error',
+        'system_type': system['type'],
+        'status': 'online',
     }
+    for field in PROBE_METRIC_FIELDS:
+        if reported.get(field) is not None:
+            metrics[field] = reported[field]
+
+    # Report services under their configured names (the probe lowercases them)
+    names = {name.lower(): name for name in system.get('services', [])}
+    services = []
+    for svc in data.get('services') or []:
+        services.append({
+            'service_name': names.get(svc['service_name'], svc['service_name']),
+            'is_running': bool(svc.get('is_running')),
+            'process_count': svc.get('process_count', 0),
+            'cpu_percent': svc.get('cpu_percent'),
+            'memory_mb': svc.get('memory_mb'),
+        })
 
+    return metrics, services
 
-def collect_linux_metrics(system):
-    """Collect metrics from Linux/Pi via SSH."""
-    host = system['ssh_host']
-    user = system['ssh_user']
 
-    # Simple shell commands that work without psutil
-    cmd = '''
-    echo "{
-        \\"cpu_percent\\": $(top -bn1 | grep 'Cpu(s)' | awk '{print $2}' | cut -d'%' -f1 || echo 0),
-        \\"memory_percent\\": $(free | grep Mem | awk '{printf \\"%.1f\\", $3/$2 * 100}'),
-        \\"disk_percent\\": $(df / | tail -1 | awk '{print $5}' | tr -d '%'),
-        \\"uptime_seconds\\": $(cat /proc/uptime | awk '{print int($1)}')
-    }"
-    '''
+def collect_remote_metrics(system, deadline=None):
+    """Collect metrics and service status from a remote system in one SSH call.
 
-    output, success = run_ssh_command(host, user, cmd)
+    Hosts whose circuit breaker is open are reported offline without
+    attempting SSH.
+    """
+    allowed, error = BREAKER.allow(system, deadline)
+    if not allowed:
+        return failed_metrics(system, error), []
 
-    if success:
-        try:
-            metrics = json.loads(output)
-            metrics['hostname'] = system['hostname']
-            metrics['timestamp'] = datetime.utcnow().isoformat()
-            metrics['system_type'] = system['type']
-            metrics['status'] = 'online'
-            return metrics
-        except:
-            pass
+    with TIMINGS.span('ssh_exec') as ssh:
+        output, returncode = run_ssh_command(system['ssh_host'], system['ssh_user'], build_probe_command(system),
+                                             timeout=time_left(deadline), input=PROBE_SCRIPT)
+    BREAKER.record(system, ssh_reached_host(returncode))
+    with TIMINGS.span('parse') as parse:
+        metrics, services = probe_result(system, output, returncode == 0)
+    metrics['timings'] = {'ssh_exec': round(ssh.seconds, 4), 'parse': round(parse.seconds, 4)}
+    return metrics, services
 
-    # Fallback - just check if SSH works
-    ping_output, ping_success = run_ssh_command(host, user, 'echo online')
 
+def probe_result(system, output, success):
+    """(metrics, services) from the (output, success) of a probe run."""
+    if not success:
+        return failed_metrics(system, output or 'SSH connection failed'), []
+    try:
+        return parse_probe_output(system, output)
+    except ValueError as e:
+        # SSH works, the probe itself misbehaved
+        return failed_metrics(system, str(e), status='online'), []
+
+
+def failed_metrics(system, error, status='offline'):
+    """Metrics placeholder for a system that couldn't be collected."""
     return {
         'hostname': system['hostname'],
         'timestamp': datetime.utcnow().isoformat(),
         'system_type': system['type'],
-        'status': 'online' if ping_success else 'offline',
-        'error': None if ping_success else 'SSH connection failed',
+        'status': status,
+        'error': error,
     }
 
 
-def collect_service_status(system, metrics):
-    """Check service status on a system."""
+def collect_service_status(system, metrics, index=None):
+    """Check service status on the local system.
+
+    All services are resolved against one process-table snapshot (pass index
+    to reuse one built elsewhere in the sweep).
+    """
     services = []
 
-    if system['method'] == 'local':
-        # Local Mac - use psutil
-        if HAS_PSUTIL:
-            for svc_name in system.get('services', []):
-                is_running = False
-                for proc in psutil.process_iter(['name']):
-                    try:
-                        if svc_name.lower() in proc.info['name'].lower():
-                            is_running = True
-                            break
-                    except:
-                        continue
-                services.append({
-                    'service_name': svc_name,
-                    'is_running': is_running,
-                })
-    elif system['type'] == 'windows':
-        # Windows via SSH
-        host = system['ssh_host']
-        user = system['ssh_user']
-        for svc_name in system.get('services', []):
-            cmd = f'powershell -Command "Get-Process {svc_name} -ErrorAction SilentlyContinue | Select-Object -First 1 Name"'
-            output, success = run_ssh_command(host, user, cmd)
-            services.append({
-                'service_name': svc_name,
-                'is_running': bool(output and svc_name.lower() in output.lower()),
-            })
-    else:
-        # Linux via SSH
-        host = system['ssh_host']
-        user = system['ssh_user']
-        for svc_name in system.get('services', []):
-            cmd = f'pgrep -x {svc_name} >/dev/null && echo running || echo stopped'
-            output, success = run_ssh_command(host, user, cmd)
+    if HAS_PSUTIL:
+        index = index or ProcessIndex()
+        names = system.get('services', [])
+        matches = index.match((svc_name, svc_name, None) for svc_name in names)
+        for svc_name in names:
             services.append({
                 'service_name': svc_name,
-                'is_running': 'running' in output.lower(),
+                'is_running': bool(matches[svc_name]),
             })
 
     return services
 
 
-def check_alerts(all_metrics):
-    """Check all metrics for alert conditions."""
-    alerts = []
-
-    for system_data in all_metrics:
-        metrics = system_data['metrics']
-        services = system_data.get('services', [])
-        hostname = metrics.get('hostname', 'unknown')
-
-        # System offline
-        if metrics.get('status') == 'offline':
-            alerts.append({
-                'hostname': hostname,
-                'type': 'system_offline',
-                'severity': 'critical',
-                'message': f"🔴 {hostname} is OFFLINE",
-            })
-            continue
-
-        # CPU alert
-        cpu = metrics.get('cpu_percent')
-        if cpu and float(cpu) > 90:
-            alerts.append({
-                'hostname': hostname,
-                'type': 'high_cpu',
-                'severity': 'critical' if float(cpu) > 95 else 'warning',
-                'message': f"⚠️ High CPU on {hostname}: {cpu}%",
-                'value': cpu,
-            })
+RULE_ENGINE = RuleEngine(history_path=RULE_HISTORY_PATH, default_rules=DEFAULT_ALERT_RULES)
 
-        # Memory alert
-        mem = metrics.get('memory_percent')
-        if mem and float(mem) > 85:
-            alerts.append({
-                'hostname': hostname,
-                'type': 'high_memory',
-                'severity': 'critical' if float(mem) > 95 else 'warning',
-                'message': f"⚠️ High Memory on {hostname}: {mem}%",
-                'value': mem,
-            })
 
-        # Disk alert
-        disk = metrics.get('disk_percent')
-        if disk and float(disk) > 80:
-            alerts.append({
-                'hostname': hostname,
-                'type': 'disk_space',
-                'severity': 'critical' if float(disk) > 90 else 'warning',
-                'message': f"💾 Low Disk Space on {hostname}: {disk}%",
-                'value': disk,
-            })
+def check_alerts(all_metrics):
+    """Check all metrics for alert conditions."""
+    return RULE_ENGINE.evaluate(all_metrics)
 
-        # Service alerts
-        for svc in services:
-            if not svc['is_running']:
-                alerts.append({
-                    'hostname': hostname,
-                    'type': 'service_down',
-                    'severity': 'critical',
-                    'message': f"🔴 {svc['service_name']} is DOWN on {hostname}",
-                    'service': svc['service_name'],
-                })
 
-    return alerts
+ALERT_TRACKER = AlertTracker(path=ALERT_STATE_PATH)
 
 
 def send_telegram_alert(message):
@@ -338,48 +972,457 @@ def send_telegram_alert(message):
 
     try:
         url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
-        response = requests.post(url, json={
-            'chat_id': TELEGRAM_CHAT_ID,
-            'text': message,
-            'parse_mode': 'HTML',
-        }, timeout=10)
+        with TIMINGS.span('telegram'):
+            response = requests.post(url, json={
+                'chat_id': TELEGRAM_CHAT_ID,
+                'text': message,
+                'parse_mode': 'HTML',
+            }, timeout=10)
         return response.status_code == 200
     except Exception as e:
         print(f"Telegram error: {e}")
         return False
 
 
-def send_to_supabase(all_metrics):
-    """Store metrics in Supabase."""
-    if not HAS_SUPABASE or not SUPABASE_KEY:
-        return False
+_supabase_client = None
+
+
+def get_supabase():
+    """Return a shared Supabase client, created on first use."""
+    global _supabase_client
+    if _supabase_client is None:
+        _supabase_client = create_client(SUPABASE_URL, SUPABASE_KEY)
+    return _supabase_client
 
+
+def metrics_to_row(metrics):
+    """Convert a collected metrics dict into a system_metrics row."""
+    return {
+        'hostname': metrics['hostname'],
+        'timestamp': metrics.get('timestamp') or datetime.utcnow().isoformat(),
+        'cpu_percent': metrics.get('cpu_percent'),
+        'memory_percent': metrics.get('memory_percent'),
+        'memory_used_gb': metrics.get('memory_used_gb'),
+        'memory_total_gb': metrics.get('memory_total_gb'),
+        'disk_percent': metrics.get('disk_percent'),
+        'disk_used_gb': metrics.get('disk_used_gb'),
+        'disk_total_gb': metrics.get('disk_total_gb'),
+        'load_avg_1m': metrics.get('load_avg_1m'),
+        'load_avg_5m': metrics.get('load_avg_5m'),
+        'load_avg_15m': metrics.get('load_avg_15m'),
+        'uptime_seconds': metrics.get('uptime_seconds'),
+        'process_count': metrics.get('process_count'),
+        'extra_data': {
+            'status': metrics.get('status'),
+            'cpu_per_core': metrics.get('cpu_per_core'),
+            'timings': metrics.get('timings'),
+        },
+    }
+
+
+def write_rows(table, op, rows, on_conflict=None):
+    """Write rows to a Supabase table in one request (raises on failure)."""
+    with TIMINGS.span('supabase_write'):
+        query = get_supabase().table(table)
+        if op == 'upsert':
+            query.upsert(rows, on_conflict=on_conflict).execute()
+        else:
+            query.insert(rows).execute()
+
+
+class MetricsWriter:
+    """Buffers rows per table and writes each table in one bulk request.
+
+    A flush happens when FLUSH_ROWS rows are pending or the oldest pending
+    row is FLUSH_SECONDS old, so in daemon mode several sweeps share one
+    round trip. Rows that fail to write go to the spool and are replayed,
+    in order, ahead of new rows once Supabase is reachable again. Rows the
+    database rejects for good (a missing table, a value out of range) are
+    dead-lettered to spool.dead instead, so they can't hold up the rest.
+    """
+
+    def __init__(self, max_rows=FLUSH_ROWS, max_age=FLUSH_SECONDS, spool=None):
+        self.max_rows = max_rows
+        self.max_age = max_age
+        self.spool = spool or Spool(directory=SPOOL_DIR, max_bytes=SPOOL_MAX_BYTES)
+        self._buffers = {}
+        self._oldest = None
+        self._lock = threading.Lock()
+
+    def add(self, table, rows, op='insert', on_conflict=None):
+        """Queue rows for a table (op is 'insert' or 'upsert')."""
+        if not rows:
+            return
+        with self._lock:
+            self._buffers.setdefault((table, op, on_conflict), []).extend(rows)
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+
+    def pending(self):
+        """Number of rows waiting to be written."""
+        with self._lock:
+            return sum(len(rows) for rows in self._buffers.values())
+
+    def should_flush(self, now=None):
+        """Whether the size or age threshold has been reached."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if self._oldest is None:
+                return False
+            count = sum(len(rows) for rows in self._buffers.values())
+            return count >= self.max_rows or now - self._oldest >= self.max_age
+
+    def flush(self):
+        """Write all pending rows. Returns False if any table failed."""
+        with self._lock:
+            buffers, self._buffers, self._oldest = self._buffers, {}, None
+
+        if self.spool.pending():
+            replayed = self.spool.replay(write_rows)
+            if replayed:
+                print(f"Replayed {replayed} spooled records")
+            if self.spool.pending():
+                # Sink still down (or backlog remains): queue behind the backlog
+                for (table, op, on_conflict), rows in buffers.items():
+                    self.spool.append(table, rows, op=op, on_conflict=on_conflict)
+                self.spool.sync()
+                return False
+
+        ok = True
+        for (table, op, on_conflict), rows in buffers.items():
+            try:
+                write_rows(table, op, rows, on_conflict)
+            except Exception as e:
+                if not is_permanent_error(e):
+                    print(f"Supabase error ({table}, {len(rows)} rows spooled): {e}")
+                self.spool.failed(table, rows, e, op=op, on_conflict=on_conflict)
+                ok = False
+        self.spool.sync()
+        return ok
+
+
+WRITER = MetricsWriter()
+
+
+# Cleared by check_rollup_table() when system_metrics_rollup doesn't exist
+ROLLUPS_ENABLED = True
+
+
+def check_rollup_table():
+    """Disable rollup writes, with a warning, if system_metrics_rollup is missing.
+
+    Checked once at startup so a database that predates the table doesn't
+    dead-letter a batch of rollup rows every sweep. A transient error leaves
+    rollups enabled; the spool covers that.
+    """
+    global ROLLUPS_ENABLED
+    if not HAS_SUPABASE or not SUPABASE_KEY:
+        return
     try:
-        supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
-
-        for system_data in all_metrics:
-            metrics = system_data['metrics']
-            # Insert metrics
-            supabase.table('system_metrics').insert({
-                'hostname': metrics['hostname'],
-                'timestamp': metrics['timestamp'],
-                'cpu_percent': metrics.get('cpu_percent'),
-                'memory_percent': metrics.get('memory_percent'),
-                'memory_used_gb': metrics.get('memory_used_gb'),
-                'memory_total_gb': metrics.get('memory_total_gb'),
-                'disk_percent': metrics.get('disk_percent'),
-                'disk_used_gb': metrics.get('disk_used_gb'),
-                'disk_total_gb': metrics.get('disk_total_gb'),
-                'uptime_seconds': metrics.get('uptime_seconds'),
-                'process_count': metrics.get('process_count'),
-                'extra_data': {'status': metrics.get('status')},
-            }).execute()
-
-        return True
+        get_supabase().table('system_metrics_rollup').select('hostname').limit(1).execute()
     except Exception as e:
-        print(f"Supabase error: {e}")
+        if is_permanent_error(e):
+            ROLLUPS_ENABLED = False
+            print(f"⚠️  Rollups disabled, system_metrics_rollup unavailable (re-run schema.sql): {e}")
+        else:
+            print(f"Error checking system_metrics_rollup: {e}")
+
+
+def send_to_supabase(all_metrics, flush=True, rollups=None):
+    """Store metrics (and any completed rollup rows) in Supabase.
+
+    Rows are queued on WRITER; with flush=False they are only written once
+    a flush threshold is reached.
+    """
+    if not HAS_SUPABASE or not SUPABASE_KEY:
         return False
 
+    # Push hosts carry every sample pushed since the last sweep
+    WRITER.add('system_metrics', [metrics_to_row(metrics) for d in all_metrics
+                                  for metrics in d.get('samples', [d['metrics']])])
+    if ROLLUPS_ENABLED:
+        WRITER.add('system_metrics_rollup', rollups or [], op='upsert',
+                   on_conflict='hostname,metric,resolution,bucket_start')
+
+    if flush or WRITER.should_flush():
+        return WRITER.flush()
+    return True
+
+
+class RingSeries:
+    """Fixed-capacity ring buffer of samples in a memory-mapped file.
+
+    The file is a small header followed by one contiguous float64 array per
+    column (e.g. ts, value), so appends are a handful of stores and range
+    queries are a binary search plus C-level slices. Rollup tiers also keep
+    their open (not yet complete) bucket in the header, so downsampling
+    survives process restarts. The file is closed once mapped; the mapping
+    holds the only descriptor.
+    """
+
+    MAGIC = b'L7TS'
+    VERSION = 1
+    HEADER = struct.Struct('<4sHHIII5d')
+
+    def __init__(self, path, columns, capacity):
+        self.path = Path(path)
+        self.columns = tuple(columns)
+        self.capacity = capacity
+        size = self.HEADER.size + capacity * len(self.columns) * 8
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fresh = not self.path.exists() or self.path.stat().st_size != size
+        with open(self.path, 'r+b' if not fresh else 'w+b') as f:
+            if fresh:
+                f.truncate(size)
+            self._mm = mmap.mmap(f.fileno(), size)
+
+        magic, version, ncols, cap, self.head, self.count, *self.pending = self.HEADER.unpack_from(self._mm)
+        if fresh or magic != self.MAGIC or version != self.VERSION or ncols != len(self.columns) or cap != capacity:
+            self.head, self.count, self.pending = 0, 0, [0.0] * 5
+            self._write_header()
+
+        body = memoryview(self._mm)[self.HEADER.size:].cast('d')
+        self._cols = {name: body[i * capacity:(i + 1) * capacity] for i, name in enumerate(self.columns)}
+
+    def _write_header(self):
+        self.HEADER.pack_into(self._mm, 0, self.MAGIC, self.VERSION, len(self.columns),
+                              self.capacity, self.head, self.count, *self.pending)
+
+    def append(self, *values):
+        """Append one row (one value per column), overwriting the oldest when full."""
+        for name, value in zip(self.columns, values):
+            self._cols[name][self.head] = value
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+        self._write_header()
+
+    def set_pending(self, pending):
+        self.pending = list(pending)
+        self._write_header()
+
+    def _slices(self, column, start):
+        """Column values from logical index start to newest, as a list."""
+        col = self._cols[column]
+        first = (self.head - self.count) % self.capacity
+        begin = (first + start) % self.capacity
+        if begin + (self.count - start) <= self.capacity:
+            return col[begin:begin + self.count - start].tolist()
+        return col[begin:].tolist() + col[:self.head].tolist()
+
+    def _bisect(self, since):
+        """Logical index of the first row with ts >= since."""
+        ts = self._cols['ts']
+        first = (self.head - self.count) % self.capacity
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if ts[(first + mid) % self.capacity] < since:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def query(self, since=None):
+        """Rows with ts >= since, oldest first, as {column: [values]}."""
+        start = self._bisect(since) if since is not None else 0
+        if start >= self.count:
+            return {name: [] for name in self.columns}
+        return {name: self._slices(name, start) for name in self.columns}
+
+    def oldest(self):
+        """Timestamp of the oldest row, or None when empty."""
+        if not self.count:
+            return None
+        return self._cols['ts'][(self.head - self.count) % self.capacity]
+
+    def close(self):
+        self._mm.flush()
+        self._cols = {}
+        self._mm.close()
+
+
+def sample_time(metrics, default):
+    """Unix time of a metrics dict's UTC 'timestamp', or default without a usable one."""
+    try:
+        return datetime.fromisoformat(metrics['timestamp']).replace(tzinfo=timezone.utc).timestamp()
+    except (KeyError, TypeError, ValueError):
+        return default
+
+
+class HistoryStore:
+    """Local per-host, per-metric history in RingSeries files.
+
+    Every sample goes into the 'raw' tier and is downsampled into 1-minute
+    and 1-hour tiers (avg/min/max per bucket), so questions like "last 24h of
+    CPU for the Pi" are answered from local files without touching Supabase.
+    Each bucket that completes also becomes a system_metrics_rollup row, with
+    its p95 taken from the raw samples it covers.
+
+    Each host has a file per metric and tier, so only the max_open most
+    recently used files stay mapped; the rest are closed and reopened on
+    demand, which keeps large fleets under low fd limits.
+    """
+
+    def __init__(self, directory=HISTORY_DIR, metrics=HISTORY_METRICS, tiers=HISTORY_TIERS,
+                 max_open=HISTORY_MAX_OPEN):
+        self.directory = Path(directory)
+        self.metrics = metrics
+        self.tiers = tiers
+        # One write touches every tier of a metric, and they must stay open
+        self.max_open = max(max_open, len(tiers))
+        self._series = {}  # least recently used first
+        self._open_buckets = {}  # (hostname, metric, tier) -> start of its open bucket
+        self._lock = threading.Lock()
+
+    def _get(self, hostname, metric, tier):
+        key = (hostname, metric, tier)
+        series = self._series.pop(key, None)
+        if series is None:
+            while len(self._series) >= self.max_open:
+                self._series.pop(next(iter(self._series))).close()
+            name, bucket, capacity = next(t for t in self.tiers if t[0] == tier)
+            columns = ('ts', 'value') if not bucket else ('ts', 'avg', 'min', 'max')
+            safe_host = ''.join(c if c.isalnum() or c in '-_.' else '_' for c in hostname)
+            path = self.directory / safe_host / f'{metric}.{name}.ring'
+            series = RingSeries(path, columns, capacity)
+        self._series[key] = series
+        return series
+
+    def record(self, all_metrics, now=None):
+        """Store the online hosts' metrics from a sweep.
+
+        Push hosts contribute every sample pushed since the last sweep, each
+        at its own timestamp; polled hosts contribute their metrics at now.
+        Returns system_metrics_rollup rows for the buckets that completed,
+        including open buckets of hosts that stopped reporting.
+        """
+        now = time.time() if now is None else now
+        rollups = []
+        with self._lock:
+            for system_data in all_metrics:
+                if system_data['metrics'].get('status') != 'online':
+                    continue
+                if 'samples' in system_data:
+                    samples = [(sample_time(m, now), m) for m in system_data['samples']]
+                else:
+                    samples = [(now, system_data['metrics'])]
+                for ts, metrics in samples:
+                    for metric in self.metrics:
+                        value = metrics.get(metric)
+                        if value is None:
+                            continue
+                        rollups.extend(self._add(metrics['hostname'], metric, ts, float(value)))
+
+            # Close buckets that have gone a whole bucket length without data
+            bucket_by_tier = {name: bucket for name, bucket, _ in self.tiers}
+            for (hostname, metric, name), start in list(self._open_buckets.items()):
+                bucket = bucket_by_tier[name]
+                if now >= start + 2 * bucket:
+                    series = self._get(hostname, metric, name)
+                    rollups.append(self._close(hostname, metric, name, bucket, series))
+        return rollups
+
+    def _add(self, hostname, metric, ts, value):
+        completed = []
+        for name, bucket, _ in self.tiers:
+            series = self._get(hostname, metric, name)
+            if not bucket:
+                series.append(ts, value)
+                continue
+
+            start = ts - ts % bucket
+            open_start, vmin, vmax, total, n = series.pending
+            if n and start != open_start:
+                completed.append(self._close(hostname, metric, name, bucket, series))
+                n = 0
+            if not n:
+                series.set_pending((start, value, value, value, 1))
+            else:
+                series.set_pending((start, min(vmin, value), max(vmax, value), total + value, n + 1))
+            self._open_buckets[(hostname, metric, name)] = start
+        return completed
+
+    def _close(self, hostname, metric, name, bucket, series):
+        """Persist a tier's open bucket and return it as a rollup row."""
+        start, vmin, vmax, total, n = series.pending
+        series.append(start, total / n, vmin, vmax)
+        series.set_pending((0.0, 0.0, 0.0, 0.0, 0))
+        self._open_buckets.pop((hostname, metric, name), None)
+
+        # Nearest-rank p95 over the raw samples still held for the bucket
+        raw = self._get(hostname, metric, self.tiers[0][0]).query(start)
+        values = sorted(v for t, v in zip(raw['ts'], raw['value']) if t < start + bucket)
+        p95 = values[max(0, math.ceil(0.95 * len(values)) - 1)] if values else None
+
+        return {
+            'hostname': hostname,
+            'metric': metric,
+            'resolution': name,
+            'bucket_start': datetime.utcfromtimestamp(start).isoformat(),
+            'sample_count': int(n),
+            'min_value': round(vmin, 3),
+            'max_value': round(vmax, 3),
+            'avg_value': round(total / n, 3),
+            'p95_value': round(p95, 3) if p95 is not None else None,
+        }
+
+    def query(self, hostname, metric, since=None, tier='raw'):
+        """Stored rows for a host/metric/tier since a unix timestamp."""
+        with self._lock:
+            return self._get(hostname, metric, tier).query(since)
+
+    def stats(self, hostname, metric, window=24 * 3600, now=None):
+        """avg/min/max and trend (change per hour) over the last window seconds.
+
+        Uses the finest tier whose data reaches back over the whole window
+        (raw if none does yet). Returns None without data.
+        """
+        now = time.time() if now is None else now
+        since = now - window
+        with self._lock:
+            name, bucket = self.tiers[0][0], 0
+            for tier, tier_bucket, _ in self.tiers:
+                oldest = self._get(hostname, metric, tier).oldest()
+                if oldest is not None and oldest <= since:
+                    name, bucket = tier, tier_bucket
+                    break
+            # Include the bucket that straddles the start of the window
+            rows = self._get(hostname, metric, name).query(since - bucket)
+        ts = rows['ts']
+        if not ts:
+            return None
+        values = rows['value'] if 'value' in rows else rows['avg']
+        lows = rows.get('min', values)
+        highs = rows.get('max', values)
+
+        trend = None
+        if len(ts) >= 2 and ts[-1] > ts[0]:
+            # Least-squares slope, scaled to per hour
+            mean_t = sum(ts) / len(ts)
+            mean_v = sum(values) / len(values)
+            var = sum((t - mean_t) ** 2 for t in ts)
+            if var:
+                trend = round(sum((t - mean_t) * (v - mean_v) for t, v in zip(ts, values)) / var * 3600, 3)
+
+        return {
+            'avg': round(sum(values) / len(values), 2),
+            'min': round(min(lows), 2),
+            'max': round(max(highs), 2),
+            'trend_per_hour': trend,
+            'samples': len(ts),
+            'tier': name,
+        }
+
+    def close(self):
+        with self._lock:
+            for series in self._series.values():
+                series.close()
+            self._series = {}
+
+
+HISTORY = HistoryStore()
+
 
 def format_summary(all_metrics, alerts):
     """Format a summary for display."""
@@ -402,6 +1445,17 @@ def format_summary(all_metrics, alerts):
             lines.append(f"  Memory: {m.get('memory_percent', 'N/A')}% ({m.get('memory_used_gb', '?')}/{m.get('memory_total_gb', '?')} GB)")
             lines.append(f"  Disk: {m.get('disk_percent', 'N/A')}%")
 
+            try:
+                cpu_24h = HISTORY.stats(m['hostname'], 'cpu_percent')
+                disk_24h = HISTORY.stats(m['hostname'], 'disk_percent')
+            except OSError as e:
+                print(f"History error: {e}")
+                cpu_24h = disk_24h = None
+            if cpu_24h and cpu_24h['samples'] > 1:
+                trend = disk_24h and disk_24h['trend_per_hour']
+                lines.append(f"  24h: CPU avg {cpu_24h['avg']}% (max {cpu_24h['max']}%)"
+                             + (f", Disk {trend:+.2f}%/h" if trend is not None else ""))
+
             if services:
                 svc_status = []
                 for svc in services:
@@ -423,60 +1477,188 @@ def format_summary(all_metrics, alerts):
     return "\n".join(lines)
 
 
-def collect_all():
-    """Collect metrics from all systems."""
-    all_metrics = []
+def collect_system(system, host_timeout=HOST_TIMEOUT):
+    """Collect metrics and service status from a single system."""
+    started = time.monotonic()
+    deadline = started + host_timeout
 
-    for system in SYSTEMS:
-        print(f"Collecting from {system['display_name']}...", end=" ", flush=True)
+    if system['method'] == 'push':
+        return INGEST.collect(system)
+    if system['method'] == 'local':
+        metrics = collect_local_metrics()
+        services = []
+        if metrics:
+            with TIMINGS.span('service_check') as check:
+                services = collect_service_status(system, metrics)
+            metrics['timings'] = {'service_check': round(check.seconds, 4)}
+    else:
+        metrics, services = collect_remote_metrics(system, deadline)
 
-        if system['method'] == 'local':
-            metrics = collect_local_metrics()
-        elif system['type'] == 'windows':
-            metrics = collect_windows_metrics(system)
-        else:
-            metrics = collect_linux_metrics(system)
+    return {
+        'system': system,
+        'metrics': metrics or {'hostname': system['hostname'], 'status': 'error'},
+        'services': services,
+        'elapsed': round(time.monotonic() - started, 3),
+    }
 
-        services = collect_service_status(system, metrics) if metrics else []
 
-        all_metrics.append({
-            'system': system,
-            'metrics': metrics or {'hostname': system['hostname'], 'status': 'error'},
-            'services': services,
-        })
+def timed_out_result(system, error):
+    """Placeholder result for a system that did not report in time."""
+    return {
+        'system': system,
+        'metrics': failed_metrics(system, error),
+        'services': [],
+        'elapsed': None,
+    }
 
-        status = "✓" if metrics and metrics.get('status') == 'online' else "✗"
-        print(status)
 
-    return all_metrics
+def print_host_status(system, result):
+    """One progress line per collected host."""
+    status = "✓" if result['metrics'].get('status') == 'online' else "✗"
+    timing = f" ({result['elapsed']:.1f}s)" if result['elapsed'] is not None else ""
+    print(f"  {status} {system['display_name']}{timing}", flush=True)
 
 
-def main():
-    """Main entry point."""
-    print("Starting system collection...\n")
+def collect_all(systems=None, max_workers=MAX_WORKERS, host_timeout=HOST_TIMEOUT,
+                sweep_timeout=SWEEP_TIMEOUT):
+    """Collect metrics from all systems concurrently.
+
+    Each host gets its own deadline (SSH commands are cut short once it
+    passes) and the sweep as a whole gives up after sweep_timeout; hosts
+    still running at that point are reported offline. Results keep the
+    order of SYSTEMS; push systems that haven't reported since startup are
+    left out.
+    """
+    systems = SYSTEMS if systems is None else systems
+    results = {}
+
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(systems) or 1)))
+    futures = {
+        executor.submit(collect_system, system, host_timeout): index
+        for index, system in enumerate(systems)
+    }
+
+    try:
+        for future in as_completed(futures, timeout=sweep_timeout):
+            index = futures[future]
+            system = systems[index]
+            try:
+                results[index] = future.result()
+            except Exception as e:
+                results[index] = timed_out_result(system, f"Collection error: {e}")
+            if results[index] is not None:
+                print_host_status(system, results[index])
+    except FuturesTimeout:
+        for future, index in futures.items():
+            if index not in results:
+                future.cancel()
+                system = systems[index]
+                results[index] = timed_out_result(system, f"Sweep timeout after {sweep_timeout:.0f}s")
+                print(f"  ✗ {system['display_name']} (timeout)", flush=True)
+    finally:
+        # Don't wait on stragglers; their SSH calls are bounded by the host deadline
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    return [results[index] for index in range(len(systems)) if results[index] is not None]
+
+
+async def collect_system_async(system, semaphore, host_timeout=HOST_TIMEOUT):
+    """Asyncio twin of collect_system(); SSH runs as an asyncio subprocess.
+
+    At most `semaphore` SSH sessions run at once. Local collection and the
+    breaker's TCP probe are blocking, so they run in the default executor.
+    """
+    if system['method'] == 'push':
+        return INGEST.collect(system)
+    if system['method'] == 'local':
+        return await asyncio.to_thread(collect_system, system, host_timeout)
+
+    started = time.monotonic()
+    deadline = started + host_timeout
+    allowed, error = await asyncio.to_thread(BREAKER.allow, system, deadline)
+    if not allowed:
+        metrics, services = failed_metrics(system, error), []
+    else:
+        async with semaphore:
+            with TIMINGS.span('ssh_exec') as ssh:
+                output, returncode = await run_ssh_command_async(
+                    system['ssh_host'], system['ssh_user'], build_probe_command(system),
+                    timeout=time_left(deadline), input=PROBE_SCRIPT)
+        BREAKER.record(system, ssh_reached_host(returncode))
+        with TIMINGS.span('parse') as parse:
+            metrics, services = probe_result(system, output, returncode == 0)
+        metrics['timings'] = {'ssh_exec': round(ssh.seconds, 4), 'parse': round(parse.seconds, 4)}
+
+    return {
+        'system': system,
+        'metrics': metrics,
+        'services': services,
+        'elapsed': round(time.monotonic() - started, 3),
+    }
 
-    # Collect from all systems
-    all_metrics = collect_all()
 
+async def collect_all_async(systems=None, host_timeout=HOST_TIMEOUT, sweep_timeout=SWEEP_TIMEOUT,
+                            semaphore=None):
+    """Asyncio twin of collect_all(): one task per host instead of one thread."""
+    systems = SYSTEMS if systems is None else systems
+    semaphore = semaphore or asyncio.Semaphore(ASYNC_MAX_SSH)
+    results = {}
+
+    async def collect(index, system):
+        try:
+            results[index] = await collect_system_async(system, semaphore, host_timeout)
+        except Exception as e:
+            results[index] = timed_out_result(system, f"Collection error: {e}")
+        if results[index] is not None:
+            print_host_status(system, results[index])
+
+    tasks = {asyncio.create_task(collect(index, system)): index for index, system in enumerate(systems)}
+    if tasks:
+        _, pending = await asyncio.wait(tasks, timeout=sweep_timeout)
+        for task in pending:
+            task.cancel()
+            index = tasks[task]
+            results[index] = timed_out_result(systems[index], f"Sweep timeout after {sweep_timeout:.0f}s")
+            print(f"  ✗ {systems[index]['display_name']} (timeout)", flush=True)
+
+    return [results[index] for index in range(len(systems)) if results[index] is not None]
+
+
+def process_results(all_metrics, verbose=True, flush=True):
+    """Alert on, display and store the results of a sweep."""
     # Check for alerts
-    alerts = check_alerts(all_metrics)
+    with TIMINGS.span('alert_eval'):
+        alerts = check_alerts(all_metrics)
+
+    # Keep local history for trends; completed 1m/1h buckets become rollup rows
+    try:
+        with TIMINGS.span('history'):
+            rollups = HISTORY.record(all_metrics)
+    except OSError as e:
+        print(f"History error: {e}")
+        rollups = []
 
     # Print summary
     summary = format_summary(all_metrics, alerts)
-    print(summary)
+    if verbose:
+        print(summary)
 
     # Send to Supabase
     if HAS_SUPABASE and SUPABASE_KEY:
-        print("\nSending to Supabase...", end=" ")
-        if send_to_supabase(all_metrics):
-            print("✓")
-        else:
-            print("✗")
+        if verbose:
+            print("\nSending to Supabase...", end=" ")
+        stored = send_to_supabase(all_metrics, flush=flush, rollups=rollups)
+        if verbose:
+            print("✓" if stored else "✗")
+
+    # Only alert state changes go out (new, escalated, repeated, resolved)
+    snapshots = {d['metrics'].get('hostname'): d['metrics'] for d in all_metrics}
+    notifications = ALERT_TRACKER.update(alerts, snapshots)
 
     # Send alerts via Telegram
-    if alerts and TELEGRAM_BOT_TOKEN:
+    if notifications and TELEGRAM_BOT_TOKEN:
         alert_msg = "🚨 <b>System Alert</b>\n\n"
-        for alert in alerts:
+        for alert in notifications:
             alert_msg += f"• {alert['message']}\n"
         send_telegram_alert(alert_msg)
 
@@ -485,11 +1667,574 @@ def main():
         'timestamp': datetime.utcnow().isoformat(),
         'systems': all_metrics,
         'alerts': alerts,
+        'notifications': notifications,
         'summary': summary,
+        'timings': TIMINGS.drain(),
     }
 
 
-if __name__ == '__main__':
-    result = main()
-    if '--json' in sys.argv:
+class MetricsExporter:
+    """Latest-sweep snapshot rendered in Prometheus/OpenMetrics text format.
+
+    update() re-renders the page once per sweep; scrapes just return the
+    cached bytes, so scraping never triggers collection or recomputation.
+    In daemon mode each host keeps its most recent result and alert count,
+    so l7_alerts_active covers the whole fleet even when a sweep only
+    collected the hosts that were due.
+    """
+
+    # (metric name, metrics key, help text)
+    HOST_GAUGES = (
+        ('l7_host_cpu_percent', 'cpu_percent', 'CPU utilisation in percent.'),
+        ('l7_host_memory_percent', 'memory_percent', 'Memory utilisation in percent.'),
+        ('l7_host_memory_used_gb', 'memory_used_gb', 'Memory in use, GB.'),
+        ('l7_host_disk_percent', 'disk_percent', 'Root disk utilisation in percent.'),
+        ('l7_host_disk_used_gb', 'disk_used_gb', 'Root disk space in use, GB.'),
+        ('l7_host_load1', 'load_avg_1m', '1-minute load average.'),
+        ('l7_host_load5', 'load_avg_5m', '5-minute load average.'),
+        ('l7_host_load15', 'load_avg_15m', '15-minute load average.'),
+        ('l7_host_uptime_seconds', 'uptime_seconds', 'Seconds since boot.'),
+        ('l7_host_processes', 'process_count', 'Number of processes.'),
+    )
+
+    def __init__(self):
+        self.hosts = {}
+        self.alerts = {}  # hostname -> alerts active after its last collection
+        self.sweep = {}
+        self._page = b'# EOF\n'
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _labels(**labels):
+        def escape(value):
+            return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        return '{' + ','.join(f'{k}="{escape(v)}"' for k, v in labels.items()) + '}'
+
+    def update(self, all_metrics, sweep_seconds=None, alerts=None):
+        """Record a sweep's results and re-render the exposition page.
+
+        alerts are those evaluated for the hosts in all_metrics; other hosts
+        keep their previous count.
+        """
+        with self._lock:
+            for system_data in all_metrics:
+                hostname = system_data['metrics'].get('hostname', system_data['system']['hostname'])
+                self.hosts[hostname] = system_data
+                self.alerts[hostname] = 0
+            for alert in alerts or []:
+                hostname = alert.get('hostname', '')
+                self.alerts[hostname] = self.alerts.get(hostname, 0) + 1
+            self.sweep = {
+                'duration': sweep_seconds,
+                'timestamp': time.time(),
+                'alerts': sum(self.alerts.values()),
+            }
+            self._page = self._render().encode()
+
+    def _render(self):
+        lines = []
+
+        def family(name, kind, help_text, samples):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in samples:
+                lines.append(f'{name}{labels} {value}')
+
+        hosts = sorted(self.hosts.items())
+        family('l7_host_up', 'gauge', 'Whether the host answered the last collection.',
+               [(self._labels(host=h, type=d['metrics'].get('system_type', '')),
+                 1 if d['metrics'].get('status') == 'online' else 0) for h, d in hosts])
+        for name, key, help_text in self.HOST_GAUGES:
+            samples = [(self._labels(host=h), float(d['metrics'][key])) for h, d in hosts
+                       if d['metrics'].get('status') == 'online' and d['metrics'].get(key) is not None]
+            family(name, 'gauge', help_text, samples)
+        family('l7_service_up', 'gauge', 'Whether a monitored service is running.',
+               [(self._labels(host=h, service=svc['service_name']), 1 if svc['is_running'] else 0)
+                for h, d in hosts for svc in d.get('services', [])])
+        family('l7_host_collection_seconds', 'gauge', 'Time taken to collect the host in its last sweep.',
+               [(self._labels(host=h), d['elapsed']) for h, d in hosts if d.get('elapsed') is not None])
+        if self.sweep.get('duration') is not None:
+            family('l7_sweep_duration_seconds', 'gauge', 'Wall time of the last sweep.',
+                   [('', round(self.sweep['duration'], 3))])
+        family('l7_sweep_timestamp_seconds', 'gauge', 'Unix time the last sweep finished.',
+               [('', round(self.sweep['timestamp'], 3))])
+        family('l7_alerts_active', 'gauge', 'Alerts active across all hosts after the last sweep.',
+               [('', self.sweep['alerts'])])
+
+        phases = sorted(TIMINGS.snapshot().items())
+        if phases:
+            name = 'l7_collector_phase_seconds'
+            lines.append(f'# HELP {name} Time spent in each collector phase.')
+            lines.append(f'# TYPE {name} histogram')
+            for phase, (cumulative, count, total) in phases:
+                for bound, n in zip(TIMINGS.buckets + ('+Inf',), cumulative):
+                    lines.append(f'{name}_bucket{self._labels(phase=phase, le=bound)} {n}')
+                lines.append(f'{name}_sum{self._labels(phase=phase)} {round(total, 6)}')
+                lines.append(f'{name}_count{self._labels(phase=phase)} {count}')
+        lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+    def page(self):
+        with self._lock:
+            return self._page
+
+
+EXPORTER = MetricsExporter()
+
+
+class IngestStore:
+    """Samples pushed by each agent (monitor_agent.py --push).
+
+    Systems with method 'push' are never SSH-polled. Pushed samples are
+    queued per host and a sweep drains them: every new sample is stored,
+    and the newest one is used for alerting and history. A host is reported
+    offline once its newest sample is more than `stale` seconds old.
+    """
+
+    def __init__(self, stale=PUSH_STALE_SECONDS, max_queued=10000):
+        self.stale = stale
+        self.max_queued = max_queued
+        self.started = time.time()
+        self.latest = {}
+        self.queued = {}
+        self._lock = threading.Lock()
+
+    def ingest(self, batch):
+        """Queue the new samples of a pushed batch; returns samples accepted.
+
+        Samples no newer than the host's newest one (e.g. a retried batch)
+        are skipped. Raises KeyError for hosts that aren't push systems in
+        SYSTEMS and ValueError for malformed batches.
+        """
+        if not isinstance(batch, dict):
+            raise ValueError("batch must be an object")
+        hostname = batch.get('hostname')
+        if not any(s['hostname'] == hostname and s['method'] == 'push' for s in SYSTEMS):
+            raise KeyError(hostname)
+        samples = batch.get('samples')
+        if not isinstance(samples, list) or not samples:
+            raise ValueError("batch has no samples")
+        for sample in samples:
+            if not isinstance(sample, dict) or not isinstance(sample.get('metrics'), dict):
+                raise ValueError("sample without metrics")
+            try:
+                sample['ts'] = float(sample['ts'])
+            except (KeyError, TypeError, ValueError):
+                raise ValueError("sample without a numeric ts") from None
+
+        with self._lock:
+            current = self.latest.get(hostname)
+            fresh = sorted((s for s in samples if current is None or s['ts'] > current['ts']),
+                           key=lambda s: s['ts'])
+            if fresh:
+                self.latest[hostname] = fresh[-1]
+                queue = self.queued.setdefault(hostname, [])
+                queue.extend(fresh)
+                del queue[:-self.max_queued]
+        return len(fresh)
+
+    def collect(self, system, now=None):
+        """Result for a push system in collect_system()'s shape.
+
+        'metrics' is the newest sample; 'samples' holds the metrics of every
+        sample pushed since the last call, to be stored. Returns None while
+        waiting for an agent's first push after startup.
+        """
+        now = now or time.time()
+        with self._lock:
+            sample = self.latest.get(system['hostname'])
+            queued = self.queued.pop(system['hostname'], [])
+
+        if sample is None:
+            if now - self.started < self.stale:
+                return None
+            return timed_out_result(system, "No samples pushed since collector start")
+        if now - sample['ts'] > self.stale:
+            return timed_out_result(system, f"Last push {now - sample['ts']:.0f}s ago")
+
+        def online(pushed):
+            return {
+                **pushed['metrics'],
+                'hostname': system['hostname'],
+                'system_type': system['type'],
+                'status': 'online',
+            }
+
+        return {
+            'system': system,
+            'metrics': online(sample),
+            'samples': [online(pushed) for pushed in queued],
+            'services': sample.get('services') or [],
+            'elapsed': None,
+        }
+
+
+INGEST = IngestStore()
+
+
+class CollectorHandler(BaseHTTPRequestHandler):
+    """Serves EXPORTER's cached page at /metrics and accepts agent pushes at /ingest."""
+
+    def log_message(self, format, *args):
+        """Scrapes are frequent; keep them out of the log."""
+        pass
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == '/metrics':
+            body = EXPORTER.page()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/openmetrics-text; version=1.0.0; charset=utf-8')
+        elif path == '/health':
+            body = b'ok\n'
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain')
+        else:
+            body = b'Not found\n'
+            self.send_response(404)
+            self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _reply(self, code, data):
+        body = json.dumps(data).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if urlparse(self.path).path != '/ingest':
+            return self._reply(404, {'error': 'not found'})
+        if not INGEST_TOKEN:
+            return self._reply(403, {'error': 'ingest disabled (set COLLECTOR_INGEST_TOKEN)'})
+        if not hmac.compare_digest(self.headers.get('X-Ingest-Token', ''), INGEST_TOKEN):
+            return self._reply(401, {'error': 'bad token'})
+
+        length = int(self.headers.get('Content-Length') or 0)
+        if not 0 < length <= INGEST_MAX_BYTES:
+            return self._reply(413, {'error': f'body must be 1-{INGEST_MAX_BYTES} bytes'})
+        try:
+            body = self.rfile.read(length)
+            if self.headers.get('Content-Type') == WIRE_CONTENT_TYPE:
+                batch = decode_samples(body)
+            else:
+                # JSON batches from agents that predate the binary format
+                if self.headers.get('Content-Encoding') == 'gzip':
+                    body = gzip.decompress(body)
+                batch = json.loads(body)
+            accepted = INGEST.ingest(batch)
+        except KeyError as e:
+            return self._reply(404, {'error': f'unknown push host {e}'})
+        except (ValueError, TypeError, OSError, EOFError) as e:
+            return self._reply(400, {'error': str(e)})
+        self._reply(202, {'accepted': accepted})
+
+
+def start_http_server(port, host=HTTP_HOST):
+    """Serve /metrics and /ingest from a background thread; returns the server."""
+    server = ThreadingHTTPServer((host, port), CollectorHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    print(f"Serving http://{host}:{port}/metrics" + (" and /ingest" if INGEST_TOKEN else ""))
+    return server
+
+
+def warn_unreachable_ingest(server):
+    """Warn at startup when configured push systems can't reach /ingest."""
+    if not any(s['method'] == 'push' for s in SYSTEMS):
+        return
+    if not server:
+        print("⚠️  Push systems configured but no --http-port; they will be reported offline")
+    elif server.server_address[0] in ('127.0.0.1', '::1', 'localhost'):
+        print(f"⚠️  Push systems configured but /ingest only listens on {server.server_address[0]}; "
+              f"set COLLECTOR_HTTP_HOST for agents on other hosts")
+
+
+class Scheduler:
+    """Fixed-rate, per-host poll schedule for daemon mode.
+
+    Each host ticks at anchor + k * interval, so the schedule never drifts
+    with how long a collection takes. Jitter is applied per tick without
+    accumulating, and ticks that were missed while a slow collection was
+    running are skipped rather than queued up (overrun skipping).
+
+    With adaptive polling, each collection also sets the host's next
+    interval (re-anchoring the schedule when it changes):
+      - offline hosts back off exponentially, up to ADAPTIVE_MAX_BACKOFF
+      - hosts with a metric moving within ADAPTIVE_MARGIN of a rule
+        threshold, or a service that started/stopped, are polled
+        ADAPTIVE_HOT_FACTOR times faster for a few polls
+      - hosts whose metrics barely move (even above a threshold) stretch
+        gradually toward ADAPTIVE_MAX_FACTOR times their interval
+    Push hosts keep their interval; reading them costs nothing.
+    """
+
+    def __init__(self, systems, default_interval=DAEMON_INTERVAL, jitter=DAEMON_JITTER,
+                 adaptive=ADAPTIVE_POLLING, rules=None):
+        now = time.monotonic()
+        self.jitter = jitter
+        self.adaptive = adaptive
+        rules = RULE_ENGINE.host_rules if rules is None else rules
+        self.thresholds = [(r['metric'], float(r['threshold'])) for r in rules
+                           if r.get('metric') and isinstance(r.get('threshold'), (int, float))]
+        self.watched = sorted({'cpu_percent', 'memory_percent', 'disk_percent'} | {m for m, _ in self.thresholds})
+        self.hosts = {}
+        for system in systems:
+            interval = float(system.get('interval', default_interval))
+            # Random phase so hosts sharing an interval don't all fire at once
+            nominal = now + random.uniform(0, jitter * interval)
+            self.hosts[system['hostname']] = {
+                'system': system,
+                'base': interval,
+                'interval': interval,
+                'nominal': nominal,
+                'due': nominal,
+                'skipped': 0,
+                'failures': 0,
+                'factor': 1.0,
+                'hot': 0,
+                'last': None,
+                'running': None,
+            }
+
+    def due(self, now=None):
+        """Systems whose next tick has arrived."""
+        now = time.monotonic() if now is None else now
+        return [h['system'] for h in self.hosts.values() if h['due'] <= now]
+
+    def advance(self, hostname, result=None, now=None):
+        """Move a host to its next tick after it has been collected.
+
+        Pass the host's result to adapt its interval.
+        """
+        now = time.monotonic() if now is None else now
+        host = self.hosts[hostname]
+        if self.adaptive and result is not None and host['system']['method'] != 'push':
+            interval = self._adapt(host, result)
+            if interval != host['interval']:
+                host['interval'] = interval
+                host['nominal'] = now
+
+        interval = host['interval']
+        host['nominal'] += interval
+        if host['nominal'] <= now:
+            missed = int((now - host['nominal']) // interval) + 1
+            host['nominal'] += missed * interval
+            host['skipped'] += missed
+        host['due'] = host['nominal'] + random.uniform(0, self.jitter * interval)
+
+    def _adapt(self, host, result):
+        """Next poll interval for a host given its latest result."""
+        base = host['base']
+        metrics = result['metrics']
+        if metrics.get('status') != 'online':
+            host['failures'] += 1
+            host['last'] = host['running'] = None
+            return min(base * 2 ** host['failures'], max(base, ADAPTIVE_MAX_BACKOFF))
+        host['failures'] = 0
+
+        running = {svc['service_name']: svc['is_running'] for svc in result.get('services', [])}
+        flapped = host['running'] is not None and running != host['running']
+        host['running'] = running
+
+        values = {m: metrics.get(m) for m in self.watched if isinstance(metrics.get(m), (int, float))}
+        last, host['last'] = host['last'], values
+        moving = {m for m, v in values.items() if last is None or abs(v - last.get(m, v)) > ADAPTIVE_STABLE_DELTA}
+        stable = last is not None and not moving
+
+        near = any(metric in moving and values[metric] >= threshold - ADAPTIVE_MARGIN
+                   for metric, threshold in self.thresholds)
+        if flapped or near:
+            host['hot'] = ADAPTIVE_HOT_POLLS
+
+        if host['hot']:
+            host['hot'] -= 1
+            host['factor'] = 1.0
+            return min(base, max(ADAPTIVE_MIN_INTERVAL, base / ADAPTIVE_HOT_FACTOR))
+        host['factor'] = min(host['factor'] * 1.5, ADAPTIVE_MAX_FACTOR) if stable else 1.0
+        return base * host['factor']
+
+    def hold(self, hostname):
+        """Take a host out of due() while it is being collected (until advance())."""
+        self.hosts[hostname]['due'] = float('inf')
+
+    def next_wakeup(self):
+        """Monotonic time of the earliest upcoming tick."""
+        return min(h['due'] for h in self.hosts.values())
+
+
+def run_daemon(interval=DAEMON_INTERVAL, http_port=HTTP_PORT):
+    """Poll systems on a fixed-rate schedule until SIGINT/SIGTERM.
+
+    Imports, config, the Supabase client and SSH master connections stay warm
+    between sweeps. With http_port, the latest results are also served
+    for Prometheus at /metrics, and push agents can report to /ingest.
+    """
+    stop = threading.Event()
+
+    def _stop(signum, frame):
+        stop.set()
+
+    signal.signal(signal.SIGINT, _stop)
+    signal.signal(signal.SIGTERM, _stop)
+
+    scheduler = Scheduler(SYSTEMS, default_interval=interval)
+    if HAS_PSUTIL:
+        CPU_SAMPLER.prime()
+    server = start_http_server(http_port) if http_port else None
+    warn_unreachable_ingest(server)
+    print(f"System collector daemon started ({len(SYSTEMS)} systems, {interval:g}s interval)")
+
+    while not stop.is_set():
+        due = scheduler.due()
+        if due:
+            started = time.monotonic()
+            results = collect_all(due)
+            result = process_results(results, verbose=False, flush=False)
+            by_host = {r['system']['hostname']: r for r in results}
+            for system in due:
+                scheduler.advance(system['hostname'], by_host.get(system['hostname']))
+            elapsed = time.monotonic() - started
+            EXPORTER.update(results, elapsed, result['alerts'])
+            print(f"[{datetime.now():%H:%M:%S}] swept {len(due)} systems in "
+                  f"{elapsed:.1f}s, {len(result['alerts'])} alerts", flush=True)
+
+        if WRITER.should_flush():
+            WRITER.flush()
+
+        wakeup = scheduler.next_wakeup()
+        if WRITER.pending():
+            wakeup = min(wakeup, time.monotonic() + WRITER.max_age)
+        stop.wait(max(0.0, wakeup - time.monotonic()))
+
+    if WRITER.pending():
+        WRITER.flush()
+    if server:
+        server.shutdown()
+    print("System collector daemon stopped")
+
+
+async def run_daemon_async(interval=DAEMON_INTERVAL, http_port=HTTP_PORT, max_ssh=ASYNC_MAX_SSH):
+    """Asyncio twin of run_daemon(): every host is polled in its own task.
+
+    A slow host never holds up the others: each one is collected as soon as
+    it is due. Results are alerted on and stored in batches (in a worker
+    thread, one batch at a time) while collection carries on.
+    """
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    wake = asyncio.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, lambda: (stop.set(), wake.set()))
+
+    scheduler = Scheduler(SYSTEMS, default_interval=interval)
+    semaphore = asyncio.Semaphore(max_ssh)
+    if HAS_PSUTIL:
+        CPU_SAMPLER.prime()
+    server = start_http_server(http_port) if http_port else None
+    warn_unreachable_ingest(server)
+    print(f"System collector daemon started ({len(SYSTEMS)} systems, {interval:g}s interval, async engine)")
+
+    polls = set()
+    finished = []
+    processing = None
+
+    async def poll(system):
+        try:
+            result = await collect_system_async(system, semaphore)
+        except Exception as e:
+            result = timed_out_result(system, f"Collection error: {e}")
+        scheduler.advance(system['hostname'], result)
+        if result is not None:
+            finished.append(result)
+        wake.set()
+
+    async def process(batch):
+        started = time.monotonic()
+        result = await asyncio.to_thread(process_results, batch, False, False)
+        elapsed = time.monotonic() - started
+        EXPORTER.update(batch, elapsed, result['alerts'])
+        print(f"[{datetime.now():%H:%M:%S}] processed {len(batch)} results in "
+              f"{elapsed:.1f}s, {len(result['alerts'])} alerts", flush=True)
+        wake.set()
+
+    while not stop.is_set():
+        wake.clear()
+        for system in scheduler.due():
+            scheduler.hold(system['hostname'])
+            task = asyncio.create_task(poll(system))
+            polls.add(task)
+            task.add_done_callback(polls.discard)
+
+        if processing is None or processing.done():
+            if finished:
+                batch, finished[:] = finished[:], []
+                processing = asyncio.create_task(process(batch))
+            elif WRITER.should_flush():
+                processing = asyncio.create_task(asyncio.to_thread(WRITER.flush))
+
+        timeout = scheduler.next_wakeup() - time.monotonic()
+        if WRITER.pending():
+            timeout = min(timeout, WRITER.max_age)
+        try:
+            await asyncio.wait_for(wake.wait(), timeout=max(0.0, timeout) if timeout != float('inf') else None)
+        except asyncio.TimeoutError:
+            pass
+
+    for task in list(polls):
+        task.cancel()
+    await asyncio.gather(*polls, return_exceptions=True)
+    if processing is not None:
+        await processing
+    if finished:
+        await process(finished[:])
+    if WRITER.pending():
+        await asyncio.to_thread(WRITER.flush)
+    if server:
+        server.shutdown()
+    print("System collector daemon stopped")
+
+
+def main(argv=None):
+    """Main entry point."""
+    parser = argparse.ArgumentParser(description='Collect metrics from all monitored systems.')
+    parser.add_argument('--json', action='store_true', help='print the sweep result as JSON')
+    parser.add_argument('--daemon', action='store_true', help='run continuously instead of once')
+    parser.add_argument('--interval', type=float, default=DAEMON_INTERVAL,
+                        help=f'seconds between polls in daemon mode (default {DAEMON_INTERVAL:g})')
+    parser.add_argument('--http-port', type=int, default=HTTP_PORT,
+                        help='daemon mode: serve /metrics and /ingest on this port')
+    parser.add_argument('--engine', choices=('threads', 'async'), default=COLLECTOR_ENGINE,
+                        help='thread pool or asyncio collection (default %(default)s)')
+    args = parser.parse_args(argv)
+
+    check_rollup_table()
+
+    if args.daemon:
+        if args.engine == 'async':
+            asyncio.run(run_daemon_async(args.interval, args.http_port))
+        else:
+            run_daemon(args.interval, args.http_port)
+        return None
+
+    print("Starting system collection...\n")
+
+    # Prime CPU counters now; remote hosts take long enough that the local
+    # sample gets a meaningful window without sleeping
+    if HAS_PSUTIL:
+        CPU_SAMPLER.prime()
+
+    # Collect from all systems
+    all_metrics = asyncio.run(collect_all_async()) if args.engine == 'async' else collect_all()
+
+    result = process_results(all_metrics)
+    if args.json:
         print(json.dumps(result, default=str, indent=2))
+    return result
+
+
+if __name__ == '__main__':
+    main()
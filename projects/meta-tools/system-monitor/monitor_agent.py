@@ -3,14 +3,29 @@
 Universal System Monitor Agent
 Collects metrics and reports to Supabase for centralized monitoring.
 Works on Mac, Windows, and Linux.
+
+Deployed as a single file. central_collector.py imports the code both
+programs need from here (Spool, CpuSampler, ProcessIndex, RuleEngine,
+AlertTracker and the L7MS codec), so those take their paths and defaults
+as arguments rather than assuming the agent's.
 """
 
 import os
 import sys
 import json
+import argparse
+import ast
+import fnmatch
 import socket
 import platform
+import signal
+import struct
 import subprocess
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import deque
 from datetime import datetime
 from pathlib import Path
 
@@ -40,6 +55,109 @@ SUPABASE_URL = os.environ.get('SUPABASE_URL', 'https://jbwmrqfbgvjivemkquao.supa
 SUPABASE_KEY = os.environ.get('SUPABASE_ANON_KEY', '')
 WEBHOOK_URL = os.environ.get('MONITOR_WEBHOOK_URL', '')  # n8n webhook for alerts
 
+# Local state (spool, alerts, etc.) lives here. The collector and the agent
+# may share MONITOR_STATE_DIR on one machine, so each keeps its own subdirectory.
+STATE_DIR = Path(os.environ.get('MONITOR_STATE_DIR', str(Path(__file__).parent / '.state'))) / 'agent'
+
+# Rows that can't reach Supabase are spooled to disk and replayed later
+SPOOL_DIR = STATE_DIR / 'spool'
+SPOOL_SEGMENT_BYTES = 1024 * 1024
+SPOOL_MAX_BYTES = int(os.environ.get('MONITOR_SPOOL_MAX_BYTES', str(16 * 1024 * 1024)))
+SPOOL_FSYNC_EVERY = 20
+
+# Backup folders to index: (backup_type, directory, filename glob). The
+# index is incremental; see BackupIndex.
+BACKUP_SOURCES = [
+    ('tradestation', Path(r'C:\Users\jeff\Desktop\TS Backups'), '*.tsa'),
+    ('tradestation', Path.home() / 'Desktop' / 'TS Backups', '*.tsa'),
+]
+BACKUP_MANIFEST_PATH = STATE_DIR / 'backups.json'
+BACKUP_SETTLE_SECONDS = 300  # files modified more recently may still be being written
+BACKUP_FULL_SCAN_SECONDS = 24 * 3600
+
+# Supabase writes. Unchanged service rows are skipped (see WriteTracker) and a
+# whole tick goes out as one ingest_agent_batch() call when schema.sql's
+# function is installed, falling back to per-table writes otherwise.
+WRITE_STATE_PATH = STATE_DIR / 'writes.json'
+SERVICE_REFRESH_SECONDS = int(os.environ.get('MONITOR_SERVICE_REFRESH', '300'))
+REGISTRY_REFRESH_SECONDS = int(os.environ.get('MONITOR_REGISTRY_REFRESH', '300'))
+SERVICE_CPU_STEP = 5.0      # percentage points
+SERVICE_MEMORY_STEP = 0.1   # fraction of the last written value
+BATCH_RPC_RETRY_SECONDS = 3600
+
+# Push mode (--push URL): stream batched samples to central_collector.py's
+# /ingest instead of writing to Supabase; the collector stops SSH-polling us
+PUSH_URL = os.environ.get('MONITOR_PUSH_URL', '')
+PUSH_TOKEN = os.environ.get('MONITOR_PUSH_TOKEN', '')
+PUSH_INTERVAL = float(os.environ.get('MONITOR_PUSH_INTERVAL', '15'))  # seconds between samples
+PUSH_BATCH = int(os.environ.get('MONITOR_PUSH_BATCH', '2'))  # samples per request
+PUSH_BACKLOG = 240  # samples kept while the collector is unreachable
+
+# Loop mode (--loop): collect and report every LOOP_INTERVAL seconds in one
+# long-lived process; the local IP is only re-resolved when the network
+# interfaces change (or every LOCAL_IP_TTL seconds without psutil)
+LOOP_INTERVAL = float(os.environ.get('MONITOR_INTERVAL', '60'))
+LOCAL_IP_TTL = 600
+
+# Host identity (hostname, system type, ...) is detected once and reused for
+# HOST_FACTS_TTL seconds; SIGHUP forces re-detection in long-running modes
+HOST_FACTS_TTL = float(os.environ.get('MONITOR_HOST_FACTS_TTL', '3600'))
+
+# Compact binary encoding of pushed sample batches ("L7MS"). Bump
+# WIRE_VERSION whenever WIRE_METRICS or the layout changes; decoders reject
+# versions they don't know.
+WIRE_MAGIC = b'L7MS'
+WIRE_VERSION = 1
+WIRE_CONTENT_TYPE = 'application/x-l7-samples'
+WIRE_METRICS = (
+    ('cpu_percent', 'f'), ('memory_percent', 'f'), ('memory_used_gb', 'f'), ('memory_total_gb', 'f'),
+    ('disk_percent', 'f'), ('disk_used_gb', 'f'), ('disk_total_gb', 'f'),
+    ('load_avg_1m', 'f'), ('load_avg_5m', 'f'), ('load_avg_15m', 'f'),
+    ('uptime_seconds', 'd'), ('process_count', 'f'),
+)
+WIRE_INTS = {'uptime_seconds', 'process_count'}
+
+# Alert notification policy (seconds / percentage points). An alert must hold
+# for min_duration before it fires, isn't re-notified within cooldown, is
+# re-sent every repeat while it stays firing, and only resolves once the value
+# is hysteresis points below its threshold.
+ALERT_STATE_PATH = STATE_DIR / 'alerts.json'
+ALERT_STATE_RETENTION = 24 * 3600
+ALERT_POLICY = {
+    'default': {'min_duration': 0, 'cooldown': 1800, 'repeat': 6 * 3600, 'hysteresis': 5},
+    'high_cpu': {'min_duration': 120},
+}
+
+# Alert rules: JSON list in the format of DEFAULT_ALERT_RULES (see RuleEngine).
+# rate() history is kept here, one sample per metric per RULE_HISTORY_STEP.
+ALERT_RULES_PATH = Path(os.environ.get('MONITOR_ALERT_RULES', str(Path(__file__).parent / 'alert_rules.json')))
+RULE_HISTORY_PATH = STATE_DIR / 'rule_history.json'
+RULE_HISTORY_SECONDS = 6 * 3600
+RULE_HISTORY_STEP = 60
+NAN = float('nan')
+
+DEFAULT_ALERT_RULES = [
+    {'type': 'high_cpu', 'when': 'cpu_percent > 90', 'critical': 'cpu_percent > 95',
+     'metric': 'cpu_percent', 'threshold': 90, 'message': 'CPU at {cpu_percent}% on {hostname}'},
+    {'type': 'high_memory', 'when': 'memory_percent > 85', 'critical': 'memory_percent > 95',
+     'metric': 'memory_percent', 'threshold': 85, 'message': 'Memory at {memory_percent}% on {hostname}'},
+    {'type': 'disk_space', 'when': 'disk_percent > 80', 'critical': 'disk_percent > 90',
+     'metric': 'disk_percent', 'threshold': 80, 'message': 'Disk at {disk_percent}% on {hostname}'},
+    {'type': 'service_down', 'scope': 'service', 'when': 'not is_running', 'severity': 'critical',
+     'message': '{service_name} is DOWN on {hostname}'},
+]
+
+# Columns of the system_metrics table; anything else goes into extra_data
+METRIC_COLUMNS = (
+    'hostname', 'timestamp', 'cpu_percent', 'memory_percent', 'memory_used_gb',
+    'memory_total_gb', 'disk_percent', 'disk_used_gb', 'disk_total_gb',
+    'load_avg_1m', 'load_avg_5m', 'load_avg_15m', 'uptime_seconds', 'process_count',
+)
+SERVICE_COLUMNS = (
+    'hostname', 'service_name', 'service_type', 'is_running', 'cpu_percent',
+    'memory_mb', 'port', 'last_checked',
+)
+
 # Services to monitor per system type
 SERVICES_CONFIG = {
     'mac': [
@@ -60,8 +178,8 @@ SERVICES_CONFIG = {
 }
 
 
-def get_system_type():
-    """Detect system type."""
+def detect_system_type():
+    """Detect system type from the OS (and /proc/cpuinfo on Linux)."""
     system = platform.system().lower()
     if system == 'darwin':
         return 'mac'
@@ -78,9 +196,110 @@ def get_system_type():
         return 'linux'
 
 
+class HostFacts:
+    """Host identity and static facts, detected once and shared by every collector.
+
+    Facts are re-detected after ttl seconds, or on the next access after
+    invalidate() (wired to SIGHUP), so a renamed host is picked up without
+    restarting a long-running agent.
+    """
+
+    def __init__(self, ttl=HOST_FACTS_TTL):
+        self.ttl = ttl
+        self._facts = None
+        self._expires = 0.0
+        self._lock = threading.Lock()
+
+    def _detect(self):
+        return {
+            'hostname': socket.gethostname(),
+            'system_type': detect_system_type(),
+            'cpu_count': os.cpu_count() or 1,
+            'boot_time': psutil.boot_time() if HAS_PSUTIL else None,
+        }
+
+    def get(self, now=None):
+        """The current facts dict (hostname, system_type, cpu_count, boot_time)."""
+        now = time.monotonic() if now is None else now
+        if self._facts is None or now >= self._expires:
+            with self._lock:
+                if self._facts is None or now >= self._expires:
+                    self._facts = self._detect()
+                    self._expires = now + self.ttl
+        return self._facts
+
+    def invalidate(self, *_):
+        """Force re-detection on next access (usable as a signal handler)."""
+        self._expires = 0.0
+
+
+HOST_FACTS = HostFacts()
+
+
+def get_system_type():
+    """Detected system type (cached in HOST_FACTS)."""
+    return HOST_FACTS.get()['system_type']
+
+
 def get_hostname():
-    """Get system hostname."""
-    return socket.gethostname()
+    """System hostname (cached in HOST_FACTS)."""
+    return HOST_FACTS.get()['hostname']
+
+
+class CpuSampler:
+    """Non-blocking CPU utilisation from cpu_times deltas.
+
+    prime() records the counters; each sample() returns total and per-core
+    usage since the previous sample, so reading CPU costs microseconds instead
+    of the one-second sleep in psutil.cpu_percent(interval=1). Only when the
+    previous sample is less than min_interval old does it wait out the rest.
+    """
+
+    def __init__(self, min_interval=0.25):
+        self.min_interval = min_interval
+        self._last = None
+        self._last_time = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _read():
+        # Linux counts guest time inside user/nice as well, so leave it out of the total
+        return [(sum(t) - getattr(t, 'guest', 0) - getattr(t, 'guest_nice', 0),
+                 t.idle + getattr(t, 'iowait', 0))
+                for t in psutil.cpu_times(percpu=True)]
+
+    @staticmethod
+    def _busy(before, after):
+        total = after[0] - before[0]
+        idle = after[1] - before[1]
+        return round(100.0 * (total - idle) / total, 1) if total > 0 else 0.0
+
+    def prime(self):
+        """Record the baseline counters (no-op once primed)."""
+        with self._lock:
+            if self._last is None:
+                self._last, self._last_time = self._read(), time.monotonic()
+
+    def sample(self):
+        """Return (cpu_percent, per_core_percents) since the previous sample."""
+        self.prime()
+        with self._lock:
+            wait = self.min_interval - (time.monotonic() - self._last_time)
+            if wait > 0:
+                time.sleep(wait)
+            current = self._read()
+            before, self._last, self._last_time = self._last, current, time.monotonic()
+
+        if len(before) != len(current):
+            # CPUs came or went; nothing meaningful to compare against
+            return None, []
+        per_core = [self._busy(b, a) for b, a in zip(before, current)]
+        total = self._busy((sum(b[0] for b in before), sum(b[1] for b in before)),
+                           (sum(a[0] for a in current), sum(a[1] for a in current)))
+        return total, per_core
+
+
+CPU_SAMPLER = CpuSampler()
 
 
 def get_system_metrics():
@@ -88,14 +307,15 @@ def get_system_metrics():
     if not HAS_PSUTIL:
         return get_system_metrics_fallback()
 
+    facts = HOST_FACTS.get()
     metrics = {
-        'hostname': get_hostname(),
+        'hostname': facts['hostname'],
         'timestamp': datetime.utcnow().isoformat(),
-        'system_type': get_system_type(),
+        'system_type': facts['system_type'],
     }
 
-    # CPU
-    metrics['cpu_percent'] = psutil.cpu_percent(interval=1)
+    # CPU (delta since the previous sample; no blocking interval)
+    metrics['cpu_percent'], metrics['cpu_per_core'] = CPU_SAMPLER.sample()
 
     # Memory
     mem = psutil.virtual_memory()
@@ -121,7 +341,7 @@ def get_system_metrics():
         metrics['load_avg_15m'] = None
 
     # Uptime
-    metrics['uptime_seconds'] = int(datetime.now().timestamp() - psutil.boot_time())
+    metrics['uptime_seconds'] = int(time.time() - facts['boot_time'])
 
     # Process count
     metrics['process_count'] = len(psutil.pids())
@@ -131,14 +351,14 @@ def get_system_metrics():
 
 def get_system_metrics_fallback():
     """Fallback metrics collection without psutil."""
+    facts = HOST_FACTS.get()
+    system_type = facts['system_type']
     metrics = {
-        'hostname': get_hostname(),
+        'hostname': facts['hostname'],
         'timestamp': datetime.utcnow().isoformat(),
-        'system_type': get_system_type(),
+        'system_type': system_type,
     }
 
-    system_type = get_system_type()
-
     if system_type == 'windows':
         # Windows fallback using wmic
         try:
@@ -152,118 +372,853 @@ def get_system_metrics_fallback():
             load = os.getloadavg()
             metrics['load_avg_1m'] = round(load[0], 2)
             # Estimate CPU percent from load avg
-            cpu_count = os.cpu_count() or 1
-            metrics['cpu_percent'] = round((load[0] / cpu_count) * 100, 2)
+            metrics['cpu_percent'] = round((load[0] / facts['cpu_count']) * 100, 2)
         except:
             metrics['cpu_percent'] = None
 
     return metrics
 
 
-def get_service_status(services_config):
-    """Check status of configured services."""
+class ProcessIndex:
+    """A single snapshot of the process table, indexed for service matching.
+
+    Built once per sweep. Processes are grouped under their lowercased name,
+    so match() tests each distinct name once per rule (and, for rules that
+    need it, each command line once).
+    """
+
+    def __init__(self, attrs=('name',)):
+        attrs = list(attrs)
+        self.procs = []
+        self.by_name = {}
+        for proc in psutil.process_iter(attrs):
+            try:
+                info = dict(proc.info)
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                continue
+            info['proc'] = proc
+            self.add(info)
+
+    def add(self, info):
+        """Add one process info dict (name, cmdline, ...) to the snapshot."""
+        self.by_name.setdefault((info.get('name') or '').lower(), []).append(len(self.procs))
+        self.procs.append(info)
+
+    def match(self, rules):
+        """Resolve rules of (key, name_substring, cmdline_substring_or_None).
+
+        A process matches a rule when its name contains name_substring or its
+        command line contains cmdline_substring. Returns {key: [process info]}
+        with processes in snapshot order. Matches are collected as positions
+        during the scan, so building the result costs only the matches.
+        Hosts have a handful of rules, for which plain substring tests
+        measured faster than a multi-pattern automaton.
+        """
+        rules = list(rules)
+        positions = {key: set() for key, _, _ in rules}
+
+        name_rules = [(key, name.lower()) for key, name, _ in rules]
+        for name, members in self.by_name.items():
+            for key, pattern in name_rules:
+                if pattern in name:
+                    positions[key].update(members)
+
+        cmd_rules = [(key, cmd.lower()) for key, _, cmd in rules if cmd]
+        if cmd_rules:
+            for position, info in enumerate(self.procs):
+                cmdline = ' '.join(info.get('cmdline') or []).lower()
+                for key, pattern in cmd_rules:
+                    if pattern in cmdline:
+                        positions[key].add(position)
+
+        return {key: [self.procs[position] for position in sorted(found)]
+                for key, found in positions.items()}
+
+
+class PidTracker:
+    """Per-service CPU, memory, thread and fd usage from persistent process handles.
+
+    A Process from a fresh process_iter() has no CPU history (its first
+    cpu_percent() is always 0.0), so the tracker keeps one handle per PID
+    across ticks. Handles are keyed by create_time, so a recycled PID starts
+    over. CPU is the cpu_times delta since that handle's previous reading,
+    like the remote probe's. Only processes matched to a service are read,
+    in one oneshot() each. PIDs not seen in a tick are pruned. If the
+    previous reading is less than min_interval old, sample() waits out the
+    rest (as CpuSampler does) rather than report a noisy delta.
+    """
+
+    def __init__(self, min_interval=0.25):
+        self.min_interval = min_interval
+        self._procs = {}  # pid -> {'created', 'proc', 'cpu', 'at'}
+        self._lock = threading.Lock()
+
+    def _read(self, info, now):
+        """Read one process; returns its usage, or None once it's gone."""
+        proc = info['proc']
+        created = info.get('create_time')
+        entry = self._procs.get(proc.pid)
+        if entry is None or entry['created'] != created:
+            entry = {'created': created, 'proc': proc, 'cpu': None, 'at': None}
+            self._procs[proc.pid] = entry
+
+        usage = {'cpu_percent': None, 'rss': None, 'threads': None, 'fds': None}
+        handle = entry['proc']
+        try:
+            with handle.oneshot():
+                try:
+                    times = handle.cpu_times()
+                    seconds = times.user + times.system
+                    if entry['cpu'] is not None and now > entry['at']:
+                        usage['cpu_percent'] = max(0.0, 100.0 * (seconds - entry['cpu']) / (now - entry['at']))
+                    entry['cpu'], entry['at'] = seconds, now
+                except psutil.AccessDenied:
+                    pass
+                for key, read in (('rss', lambda: handle.memory_info().rss),
+                                  ('threads', handle.num_threads),
+                                  ('fds', getattr(handle, 'num_fds', None) or handle.num_handles)):
+                    try:
+                        usage[key] = read()
+                    except psutil.AccessDenied:
+                        pass
+        except psutil.NoSuchProcess:
+            del self._procs[proc.pid]
+            return None
+        return usage
+
+    def prime(self, matches):
+        """Record CPU baselines for matched processes, ahead of the first sample()."""
+        with self._lock:
+            now = time.monotonic()
+            for procs in matches.values():
+                for info in procs:
+                    self._read(info, now)
+
+    def sample(self, matches):
+        """Aggregate usage per service from {key: [process info]} (ProcessIndex.match)."""
+        with self._lock:
+            infos = {info['proc'].pid: info for procs in matches.values() for info in procs}
+            baselines = [self._procs[pid]['at'] for pid, info in infos.items()
+                         if pid in self._procs and self._procs[pid]['created'] == info.get('create_time')
+                         and self._procs[pid]['at'] is not None]
+            if baselines:
+                wait = self.min_interval - (time.monotonic() - max(baselines))
+                if wait > 0:
+                    time.sleep(wait)
+
+            now = time.monotonic()
+            usage = {pid: self._read(info, now) for pid, info in infos.items()}
+            for pid in set(self._procs) - set(infos):
+                del self._procs[pid]
+
+        totals = {}
+        for key, procs in matches.items():
+            readings = [usage[info['proc'].pid] for info in procs if usage.get(info['proc'].pid)]
+            total = {'process_count': len(readings)}
+            for field in ('cpu_percent', 'rss', 'threads', 'fds'):
+                values = [r[field] for r in readings if r[field] is not None]
+                total[field] = sum(values) if values else None
+            totals[key] = total
+        return totals
+
+
+PID_TRACKER = PidTracker()
+
+
+def service_index():
+    """A process snapshot with the fields service matching and PID_TRACKER need."""
+    return ProcessIndex(['name', 'cmdline', 'create_time'])
+
+
+def prime_counters():
+    """Prime CPU_SAMPLER and PID_TRACKER ahead of the first tick.
+
+    Returns the process snapshot used, for the first get_service_status()
+    to reuse instead of walking the process table again (None without psutil).
+    """
+    if not HAS_PSUTIL:
+        return None
+    CPU_SAMPLER.prime()
+    index = service_index()
+    PID_TRACKER.prime(match_services(SERVICES_CONFIG, index)[1])
+    return index
+
+
+def match_services(services_config, index=None):
+    """Resolve this host's configured services against a process snapshot.
+
+    Returns (config, {service_name: [process info]}).
+    """
+    config = services_config.get(HOST_FACTS.get()['system_type'], [])
+    index = index or service_index()
+    return config, index.match((svc['name'], svc['process'], svc.get('contains')) for svc in config)
+
+
+def get_service_status(services_config, index=None):
+    """Check status of configured services.
+
+    Every service is resolved against one process-table snapshot in a single
+    pass; pass index to reuse a snapshot taken elsewhere in the tick. CPU,
+    memory, threads and fds are summed over all of a service's processes
+    (e.g. every node worker) via PID_TRACKER. As in top, 100% CPU is one
+    core, so a service busy on several cores can report more than 100.
+    """
     if not HAS_PSUTIL:
         return []
 
     services = []
-    system_type = get_system_type()
-    config = services_config.get(system_type, [])
+    hostname = HOST_FACTS.get()['hostname']
+    config, matches = match_services(services_config, index)
+    usage = PID_TRACKER.sample(matches)
 
     for svc in config:
+        total = usage[svc['name']]
         status = {
-            'hostname': get_hostname(),
+            'hostname': hostname,
             'service_name': svc['name'],
             'service_type': svc.get('type', 'process'),
-            'is_running': False,
+            'is_running': total['process_count'] > 0,
             'cpu_percent': None,
             'memory_mb': None,
+            'process_count': total['process_count'],
+            'threads': total['threads'],
+            'open_fds': total['fds'],
             'last_checked': datetime.utcnow().isoformat(),
         }
+        if total['cpu_percent'] is not None:
+            status['cpu_percent'] = round(total['cpu_percent'], 1)
+        if total['rss'] is not None:
+            status['memory_mb'] = round(total['rss'] / (1024**2), 2)
+
+        services.append(status)
+
+    return services
+
+
+class BackupIndex:
+    """Incremental index of backup archives, persisted between runs.
+
+    The manifest keeps (size, mtime) per file and the mtime of each scanned
+    directory. A directory whose mtime hasn't moved has had no files added,
+    removed or renamed, so it is skipped without listing it. Directories
+    holding a file still being written (modified within BACKUP_SETTLE_SECONDS)
+    are rescanned until it settles, and everything is rescanned every
+    BACKUP_FULL_SCAN_SECONDS to catch in-place rewrites. scan() reports only
+    what changed since the last run.
+    """
+
+    def __init__(self, sources=BACKUP_SOURCES, path=BACKUP_MANIFEST_PATH):
+        self.sources = sources
+        self.path = Path(path)
+        manifest = self._load()
+        self.dirs = manifest.get('dirs', {})
+        self.files = manifest.get('files', {})
+        self.full_scan_at = manifest.get('full_scan_at', 0)
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save(self):
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_suffix('.tmp')
+            with open(tmp, 'w') as f:
+                json.dump({'dirs': self.dirs, 'files': self.files, 'full_scan_at': self.full_scan_at}, f)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print(f"Error saving backup manifest: {e}")
+
+    @staticmethod
+    def _row(hostname, path, entry, status):
+        return {
+            'hostname': hostname,
+            'backup_type': entry['type'],
+            'backup_name': os.path.basename(path),
+            'backup_path': path,
+            'size_bytes': entry['size'],
+            'created_at': datetime.fromtimestamp(entry['mtime']).isoformat(),
+            'extra_data': {'status': status},
+        }
+
+    def _scan_dir(self, directory, backup_type, pattern, hostname, delta, now):
+        """List one directory, diffing its files against the manifest."""
+        present = set()
+        settled = True
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if not fnmatch.fnmatch(entry.name, pattern):
+                    continue
+                try:
+                    if not entry.is_file():
+                        continue
+                    st = entry.stat()
+                except OSError:
+                    continue
+                path = entry.path
+                present.add(path)
+                current = {'dir': directory, 'type': backup_type, 'size': st.st_size, 'mtime': st.st_mtime}
+                previous = self.files.get(path)
+                if previous is None:
+                    delta['new'].append(self._row(hostname, path, current, 'present'))
+                elif previous['size'] != current['size'] or previous['mtime'] != current['mtime']:
+                    delta['changed'].append(self._row(hostname, path, current, 'present'))
+                self.files[path] = current
+                if now - st.st_mtime < BACKUP_SETTLE_SECONDS:
+                    settled = False
+
+        for path in [p for p, e in self.files.items() if e['dir'] == directory and p not in present]:
+            delta['missing'].append(self._row(hostname, path, self.files.pop(path), 'missing'))
+        return settled
+
+    def scan(self, hostname):
+        """Update the index; returns the delta and a summary of what's indexed."""
+        now = time.time()
+        delta = {'new': [], 'changed': [], 'missing': []}
+        full = now - self.full_scan_at >= BACKUP_FULL_SCAN_SECONDS
+        scanned = 0
+        seen = set()
+
+        for backup_type, directory, pattern in self.sources:
+            directory = os.path.normcase(os.path.abspath(directory))
+            if directory in seen:
+                continue
+            seen.add(directory)
+            try:
+                mtime_ns = os.stat(directory).st_mtime_ns
+            except OSError:
+                mtime_ns = None
+
+            known = self.dirs.get(directory)
+            if (not full and known and known['mtime_ns'] == mtime_ns and known['settled']
+                    and known['pattern'] == pattern):
+                continue
+
+            if mtime_ns is None:
+                # Directory gone (or unreadable): whatever it held is missing
+                for path in [p for p, e in self.files.items() if e['dir'] == directory]:
+                    delta['missing'].append(self._row(hostname, path, self.files.pop(path), 'missing'))
+                self.dirs.pop(directory, None)
+                continue
 
-        # Find matching process
-        for proc in psutil.process_iter(['name', 'cmdline', 'cpu_percent', 'memory_info']):
             try:
-                name = proc.info['name'].lower()
-                cmdline = ' '.join(proc.info.get('cmdline') or []).lower()
-
-                match = False
-                if svc['process'].lower() in name:
-                    match = True
-                elif 'contains' in svc and svc['contains'].lower() in cmdline:
-                    match = True
-
-                if match:
-                    status['is_running'] = True
-                    status['cpu_percent'] = proc.info.get('cpu_percent')
-                    mem = proc.info.get('memory_info')
-                    if mem:
-                        status['memory_mb'] = round(mem.rss / (1024**2), 2)
-                    break
-            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                settled = self._scan_dir(directory, backup_type, pattern, hostname, delta, now)
+            except OSError as e:
+                print(f"Error scanning backups in {directory}: {e}")
                 continue
+            self.dirs[directory] = {'mtime_ns': mtime_ns, 'settled': settled, 'pattern': pattern}
+            scanned += 1
+
+        if full:
+            self.full_scan_at = now
+        if scanned or any(delta.values()) or full:
+            self.save()
+
+        newest = max(self.files.items(), key=lambda item: item[1]['mtime'], default=None)
+        return {
+            **delta,
+            'count': len(self.files),
+            'total_bytes': sum(e['size'] for e in self.files.values()),
+            'newest_name': os.path.basename(newest[0]) if newest else None,
+            'newest_age_seconds': round(now - newest[1]['mtime']) if newest else None,
+            'scanned_dirs': scanned,
+        }
 
-        services.append(status)
 
-    return services
+BACKUP_INDEX = BackupIndex()
 
 
 def get_backup_status():
-    """Check backup status for TradeStation and other backups."""
-    backups = []
-    hostname = get_hostname()
-
-    # TradeStation backups (Windows)
-    ts_backup_paths = [
-        Path(r'C:\Users\jeff\Desktop\TS Backups'),
-        Path.home() / 'Desktop' / 'TS Backups',
-    ]
+    """Check backup status for TradeStation and other backups.
 
-    for backup_path in ts_backup_paths:
-        if backup_path.exists():
-            for f in backup_path.glob('*.tsa'):
-                backups.append({
-                    'hostname': hostname,
-                    'backup_type': 'tradestation',
-                    'backup_name': f.name,
-                    'backup_path': str(f),
-                    'size_bytes': f.stat().st_size,
-                    'created_at': datetime.fromtimestamp(f.stat().st_mtime).isoformat(),
-                })
+    Returns the changes since the last run (new/changed/missing rows for
+    backup_tracking) plus count and age of the newest backup.
+    """
+    return BACKUP_INDEX.scan(get_hostname())
+
+
+def metrics_to_row(metrics):
+    """Convert a metrics dict into a system_metrics row."""
+    row = {key: metrics.get(key) for key in METRIC_COLUMNS}
+    extra = {key: value for key, value in metrics.items() if key not in METRIC_COLUMNS}
+    if extra:
+        row['extra_data'] = extra
+    return row
+
+
+def service_to_row(service):
+    """Convert a service status dict into a service_status row."""
+    row = {key: service[key] for key in SERVICE_COLUMNS if key in service}
+    extra = {key: value for key, value in service.items() if key not in SERVICE_COLUMNS}
+    if extra:
+        row['extra_data'] = extra
+    return row
+
+
+_supabase_client = None
+
+
+def get_supabase():
+    """Return a shared Supabase client, created on first use."""
+    global _supabase_client
+    if _supabase_client is None:
+        _supabase_client = create_client(SUPABASE_URL, SUPABASE_KEY)
+    return _supabase_client
+
+
+def write_rows(table, op, rows, on_conflict=None):
+    """Write rows to a Supabase table in one request (raises on failure)."""
+    query = get_supabase().table(table)
+    if op == 'upsert':
+        query.upsert(rows, on_conflict=on_conflict).execute()
+    else:
+        query.insert(rows).execute()
 
-    return backups
+
+def is_permanent_error(error):
+    """Whether a failed write would fail the same way if retried.
+
+    Postgres data, constraint and undefined table/column/function errors
+    (SQLSTATE classes 22, 23 and 42), PostgREST request errors and other
+    4xx responses are permanent. Network errors, timeouts, 5xx, rate limits
+    and auth failures (which a config fix cures) are transient.
+    """
+    code = str(getattr(error, 'code', None) or '')
+    if code[:2] in ('22', '23', '42'):
+        return True
+    if code.startswith('PGRST'):
+        return code[5:6] in ('1', '2')
+    response = getattr(error, 'response', None)
+    status = getattr(response, 'status_code', None) or getattr(error, 'status_code', None)
+    return isinstance(status, int) and 400 <= status < 500 and status not in (401, 403, 408, 429)
+
+
+class Spool:
+    """Append-only on-disk write-ahead spool for rows the sink couldn't take.
+
+    Each record is one JSON line ({'table', 'op', 'rows', 'on_conflict'}) in
+    numbered segment files. Appends are fsync'd in batches. replay() reads a
+    window of records oldest-first, sends one bulk call per table/op (rows
+    in spool order), and then advances a persisted (segment, offset) cursor,
+    so delivery is at-least-once. Lines that don't decode (e.g. a torn write)
+    are moved to spool.corrupt and skipped. Rows the database rejects for
+    good (see is_permanent_error) go to spool.dead instead of blocking
+    everything queued behind them. Fully replayed segments are deleted, and
+    the oldest segments are dropped once the spool exceeds max_bytes.
+    """
+
+    def __init__(self, directory=SPOOL_DIR, segment_bytes=SPOOL_SEGMENT_BYTES,
+                 max_bytes=SPOOL_MAX_BYTES, fsync_every=SPOOL_FSYNC_EVERY):
+        self.directory = Path(directory)
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.fsync_every = fsync_every
+        self._lock = threading.Lock()
+        self._file = None
+        self._unsynced = 0
+
+    def _segment_path(self, number):
+        return self.directory / f'segment-{number:08d}.jsonl'
+
+    def _segments(self):
+        if not self.directory.exists():
+            return []
+        return sorted(int(p.stem.split('-')[1]) for p in self.directory.glob('segment-*.jsonl'))
+
+    def _read_cursor(self):
+        try:
+            with open(self.directory / 'cursor.json') as f:
+                cursor = json.load(f)
+            return cursor['segment'], cursor['offset']
+        except (OSError, ValueError, KeyError):
+            segments = self._segments()
+            return (segments[0] if segments else 0), 0
+
+    def _write_cursor(self, segment, offset):
+        tmp = self.directory / 'cursor.json.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'segment': segment, 'offset': offset}, f)
+        os.replace(tmp, self.directory / 'cursor.json')
+
+    def _close_file(self):
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+            self._unsynced = 0
+
+    def append(self, table, rows, op='insert', on_conflict=None):
+        """Durably queue rows for later replay."""
+        if not rows:
+            return
+        line = json.dumps({'table': table, 'op': op, 'rows': rows, 'on_conflict': on_conflict},
+                          default=str) + '\n'
+        with self._lock:
+            if self._file is None or self._file.tell() >= self.segment_bytes:
+                self._close_file()
+                self.directory.mkdir(parents=True, exist_ok=True)
+                segments = self._segments()
+                number = segments[-1] if segments else 1
+                if segments and self._segment_path(number).stat().st_size >= self.segment_bytes:
+                    number += 1
+                self._file = open(self._segment_path(number), 'a+b')
+                if number not in segments:
+                    # Enforce max_bytes while offline too, not only after a replay
+                    self._compact()
+                # Terminate a torn final write so it can't swallow this record
+                if self._file.tell() > 0:
+                    self._file.seek(-1, os.SEEK_END)
+                    if self._file.read(1) != b'\n':
+                        self._file.write(b'\n')
+            self._file.write(line.encode())
+            self._unsynced += 1
+            if self._unsynced >= self.fsync_every:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self._unsynced = 0
+
+    def failed(self, table, rows, error, op='insert', on_conflict=None):
+        """Queue rows whose write raised error.
+
+        Transient failures are spooled for replay; permanent ones are
+        dead-lettered, since replaying them would only fail again.
+        """
+        if not rows:
+            return
+        if not is_permanent_error(error):
+            self.append(table, rows, op=op, on_conflict=on_conflict)
+            return
+        with self._lock:
+            self._dead_letter(table, op, rows, on_conflict, error)
+
+    def _dead_letter(self, table, op, rows, on_conflict, error):
+        print(f"Spool: {len(rows)} {table} rows rejected, kept in spool.dead: {error}")
+        self.directory.mkdir(parents=True, exist_ok=True)
+        line = json.dumps({'table': table, 'op': op, 'rows': rows, 'on_conflict': on_conflict,
+                           'error': str(error), 'failed_at': datetime.utcnow().isoformat()}, default=str)
+        with open(self.directory / 'spool.dead', 'a') as f:
+            f.write(line + '\n')
+
+    def sync(self):
+        """Flush and fsync any batched appends."""
+        with self._lock:
+            if self._file is not None and self._unsynced:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self._unsynced = 0
+
+    def pending(self):
+        """Whether any spooled records have not been replayed yet."""
+        with self._lock:
+            segments = self._segments()
+            if not segments:
+                return False
+            if self._file is not None:
+                self._file.flush()
+            segment, offset = self._read_cursor()
+            return any(n > segment or (n == segment and self._segment_path(n).stat().st_size > offset)
+                       for n in segments)
+
+    def replay(self, sink, max_records=1000):
+        """Send up to max_records spooled records to sink(table, op, rows, on_conflict).
+
+        Stops at the first transient sink failure (leaving the window
+        spooled) and returns the number of records delivered. Groups that
+        fail permanently are dead-lettered and the replay carries on.
+        """
+        with self._lock:
+            # Seal the active segment so replay never races the appender
+            self._close_file()
+            segment, offset = self._read_cursor()
+            groups, count, end = {}, 0, None
+
+            for number in self._segments():
+                if number < segment:
+                    continue
+                with open(self._segment_path(number), 'rb') as f:
+                    f.seek(offset if number == segment else 0)
+                    while count < max_records:
+                        line = f.readline()
+                        if not line.endswith(b'\n'):
+                            break  # end of segment (or a torn final write)
+                        try:
+                            record = json.loads(line)
+                            key = (record['table'], record.get('op', 'insert'), record.get('on_conflict'))
+                            rows = list(record['rows'])
+                        except (ValueError, KeyError, TypeError, AttributeError):
+                            self._quarantine(line)
+                            end = (number, f.tell())
+                            continue
+                        groups.setdefault(key, []).extend(rows)
+                        count, end = count + 1, (number, f.tell())
+                if count >= max_records:
+                    break
+
+            for (table, op, on_conflict), rows in groups.items():
+                if op == 'upsert' and on_conflict:
+                    # A bulk upsert can't touch the same row twice; keep the latest
+                    columns = [c.strip() for c in on_conflict.split(',')]
+                    rows = list({tuple(r.get(c) for c in columns): r for r in rows}.values())
+                try:
+                    sink(table, op, rows, on_conflict)
+                except Exception as e:
+                    if not is_permanent_error(e):
+                        print(f"Spool replay stopped: {e}")
+                        return 0
+                    self._dead_letter(table, op, rows, on_conflict, e)
+
+            if end is not None:
+                self._write_cursor(*end)
+            self._compact()
+            return count
+
+    def _quarantine(self, line):
+        """Move an undecodable line out of the way (kept for inspection)."""
+        print(f"Spool: skipping corrupt record ({len(line)} bytes)")
+        with open(self.directory / 'spool.corrupt', 'ab') as f:
+            f.write(line)
+
+    def _compact(self):
+        """Delete replayed segments and enforce max_bytes (oldest first)."""
+        segment, offset = self._read_cursor()
+        segments = self._segments()
+        for number in segments:
+            path = self._segment_path(number)
+            if number < segment or (number == segment and offset and offset >= path.stat().st_size
+                                    and number != segments[-1]):
+                path.unlink()
+
+        segments = self._segments()
+        sizes = {n: self._segment_path(n).stat().st_size for n in segments}
+        while len(segments) > 1 and sum(sizes.values()) > self.max_bytes:
+            dropped = segments.pop(0)
+            self._segment_path(dropped).unlink()
+            del sizes[dropped]
+            print(f"Spool over {self.max_bytes} bytes, dropped segment {dropped}")
+            if dropped >= segment:
+                self._write_cursor(segments[0], 0)
+
+
+SPOOL = Spool()
+
+
+class WriteTracker:
+    """Remembers what the agent last wrote, so unchanged rows can be skipped.
+
+    A service row is re-sent when its running state, type or process count
+    changes, its CPU moves by SERVICE_CPU_STEP points or its memory by
+    SERVICE_MEMORY_STEP, and otherwise every SERVICE_REFRESH_SECONDS to keep last_checked fresh.
+    The registry is updated when the IP changes or every
+    REGISTRY_REFRESH_SECONDS. Persisted, since the agent usually runs once
+    per cron tick. Also remembers whether ingest_agent_batch is installed.
+    """
+
+    def __init__(self, path=WRITE_STATE_PATH):
+        self.path = Path(path)
+        state = self._load()
+        self.services = state.get('services', {})
+        self.registry = state.get('registry', {})
+        self.rpc_missing_at = state.get('rpc_missing_at')
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save(self):
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_suffix('.tmp')
+            with open(tmp, 'w') as f:
+                json.dump({'services': self.services, 'registry': self.registry,
+                           'rpc_missing_at': self.rpc_missing_at}, f)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print(f"Error saving write state: {e}")
+
+    @staticmethod
+    def _key(row):
+        return f"{row['hostname']}/{row['service_name']}"
+
+    def _service_changed(self, row, now):
+        last = self.services.get(self._key(row))
+        if last is None or now - last['at'] >= SERVICE_REFRESH_SECONDS:
+            return True
+        if (last['is_running'] != row['is_running'] or last['service_type'] != row['service_type']
+                or last.get('process_count') != row.get('process_count')):
+            return True
+        if abs((row['cpu_percent'] or 0) - (last['cpu_percent'] or 0)) >= SERVICE_CPU_STEP:
+            return True
+        memory, last_memory = row['memory_mb'] or 0, last['memory_mb'] or 0
+        return abs(memory - last_memory) > SERVICE_MEMORY_STEP * max(last_memory, 1)
+
+    def services_due(self, rows, now):
+        """The service rows that need writing this tick."""
+        return [row for row in rows if self._service_changed(row, now)]
+
+    def registry_due(self, hostname, ip_address, now):
+        return (self.registry.get('hostname') != hostname
+                or self.registry.get('ip_address') != ip_address
+                or now - self.registry.get('at', 0) >= REGISTRY_REFRESH_SECONDS)
+
+    def rpc_enabled(self, now):
+        return self.rpc_missing_at is None or now - self.rpc_missing_at >= BATCH_RPC_RETRY_SECONDS
+
+    def rpc_missing(self, now):
+        self.rpc_missing_at = now
+        self.save()
+
+    def commit(self, services, registry, now):
+        """Record rows as written."""
+        for row in services:
+            self.services[self._key(row)] = {
+                'is_running': row['is_running'],
+                'service_type': row['service_type'],
+                'process_count': row.get('process_count'),
+                'cpu_percent': row['cpu_percent'],
+                'memory_mb': row['memory_mb'],
+                'at': now,
+            }
+        if registry:
+            self.registry = {'hostname': registry['hostname'], 'ip_address': registry['ip_address'], 'at': now}
+        if services or registry:
+            self.save()
+
+
+WRITES = WriteTracker()
+
+# Parameter of ingest_agent_batch() for each table it writes
+BATCH_RPC_PARAMS = {
+    'system_metrics': 'p_metrics',
+    'service_status': 'p_services',
+    'backup_tracking': 'p_backups',
+}
+
+
+def is_missing_function(error):
+    """Whether a Supabase error means the RPC function doesn't exist."""
+    return getattr(error, 'code', None) in ('PGRST202', '42883') or 'PGRST202' in str(error)
+
+
+def write_batch(records, registry):
+    """Write a tick's rows and registry update with one ingest_agent_batch call.
+
+    Returns False, and stops trying for BATCH_RPC_RETRY_SECONDS, if the
+    function isn't installed; other failures raise.
+    """
+    params = {param: [] for param in BATCH_RPC_PARAMS.values()}
+    for table, op, rows, on_conflict in records:
+        params[BATCH_RPC_PARAMS[table]].extend(rows)
+    params['p_registry'] = registry
+    try:
+        get_supabase().rpc('ingest_agent_batch', params).execute()
+        return True
+    except Exception as e:
+        if not is_missing_function(e):
+            raise
+        WRITES.rpc_missing(time.time())
+        print("ingest_agent_batch() not installed, using per-table writes (re-run schema.sql to add it)")
+        return False
 
 
 def send_to_supabase(metrics, services, backups):
-    """Send collected data to Supabase."""
+    """Send collected data to Supabase.
+
+    Metrics and service rows that can't be written are spooled to disk and
+    replayed, oldest first, on the next run that reaches Supabase. Rows the
+    database rejects outright go to spool.dead so they can't block the rest. Only
+    service rows that changed are written, and the registry only when due
+    (see WriteTracker); everything goes in one request when possible.
+    """
     if not HAS_SUPABASE or not SUPABASE_KEY:
         print("Supabase not configured, printing locally:")
         print(json.dumps({'metrics': metrics, 'services': services}, indent=2))
         return False
 
-    try:
-        supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
-
-        # Insert metrics
-        supabase.table('system_metrics').insert(metrics).execute()
+    now = time.time()
+    ip_address = LOCAL_ADDRESS.get()
+    service_rows = WRITES.services_due(services, now)
+    registry = None
+    if WRITES.registry_due(metrics['hostname'], ip_address, now):
+        registry = {
+            'hostname': metrics['hostname'],
+            'last_seen': datetime.utcnow().isoformat(),
+            'ip_address': ip_address,
+        }
 
-        # Upsert service status
-        for svc in services:
-            supabase.table('service_status').upsert(
-                svc,
-                on_conflict='hostname,service_name'
-            ).execute()
+    records = [
+        ('system_metrics', 'insert', [metrics_to_row(metrics)], None),
+        ('service_status', 'upsert', [service_to_row(row) for row in service_rows], 'hostname,service_name'),
+        ('backup_tracking', 'upsert', backups['new'] + backups['changed'] + backups['missing'],
+         'hostname,backup_path'),
+    ]
 
-        # Update system registry last_seen
-        supabase.table('system_registry').update({
-            'last_seen': datetime.utcnow().isoformat(),
-            'ip_address': get_local_ip()
-        }).eq('hostname', metrics['hostname']).execute()
+    if SPOOL.pending():
+        replayed = SPOOL.replay(write_rows)
+        if replayed:
+            print(f"Replayed {replayed} spooled records")
+        if SPOOL.pending():
+            # Still offline (or backlog remains): keep ordering by queueing behind it
+            for table, op, rows, on_conflict in records:
+                SPOOL.append(table, rows, op=op, on_conflict=on_conflict)
+            SPOOL.sync()
+            print(f"[{datetime.now()}] Supabase unreachable, metrics spooled")
+            return False
 
-        print(f"[{datetime.now()}] Metrics sent successfully")
-        return True
+    try:
+        batched = WRITES.rpc_enabled(now) and write_batch(records, registry)
     except Exception as e:
-        print(f"Error sending to Supabase: {e}")
+        if not is_permanent_error(e):
+            for table, op, rows, on_conflict in records:
+                SPOOL.append(table, rows, op=op, on_conflict=on_conflict)
+            SPOOL.sync()
+            print(f"Error sending to Supabase: {e}")
+            return False
+        # The batch is one transaction; write table by table to keep the good rows
+        print(f"ingest_agent_batch() rejected the batch, writing tables separately: {e}")
+        batched = False
+
+    rejected = set()
+    if not batched:
+        for index, (table, op, rows, on_conflict) in enumerate(records):
+            if not rows:
+                continue
+            try:
+                write_rows(table, op, rows, on_conflict)
+            except Exception as e:
+                if is_permanent_error(e):
+                    SPOOL.failed(table, rows, e, op=op, on_conflict=on_conflict)
+                    rejected.add(table)
+                    continue
+                for table, op, rows, on_conflict in records[index:]:
+                    SPOOL.append(table, rows, op=op, on_conflict=on_conflict)
+                SPOOL.sync()
+                print(f"Error sending to Supabase: {e}")
+                return False
+
+        if registry:
+            try:
+                get_supabase().table('system_registry').update({
+                    'last_seen': registry['last_seen'],
+                    'ip_address': registry['ip_address'],
+                }).eq('hostname', registry['hostname']).execute()
+            except Exception as e:
+                print(f"Error updating system_registry: {e}")
+                registry = None
+
+    WRITES.commit([] if 'service_status' in rejected else service_rows, registry, now)
+    if rejected:
+        print(f"[{datetime.now()}] Metrics sent, rows for {', '.join(sorted(rejected))} rejected")
         return False
+    print(f"[{datetime.now()}] Metrics sent successfully "
+          f"({len(service_rows)}/{len(services)} services changed)")
+    return True
 
 
 def send_to_webhook(data):
@@ -291,61 +1246,708 @@ def get_local_ip():
         return None
 
 
+class LocalAddress:
+    """The local IP, re-resolved only when the network interfaces change.
+
+    get_local_ip() opens a socket every call; comparing a fingerprint of
+    psutil.net_if_addrs() is much cheaper. Without psutil the address is
+    refreshed every ttl seconds.
+    """
+
+    def __init__(self, ttl=LOCAL_IP_TTL):
+        self.ttl = ttl
+        self.ip = None
+        self.fingerprint = None
+        self.resolved_at = None
+
+    @staticmethod
+    def _fingerprint():
+        if not HAS_PSUTIL:
+            return None
+        try:
+            return tuple(sorted((name, tuple(sorted(addr.address for addr in addrs)))
+                                for name, addrs in psutil.net_if_addrs().items()))
+        except Exception:
+            return None
+
+    def get(self, now=None):
+        now = time.monotonic() if now is None else now
+        fingerprint = self._fingerprint()
+        if fingerprint is None:
+            stale = self.resolved_at is None or now - self.resolved_at > self.ttl
+        else:
+            stale = fingerprint != self.fingerprint
+        if stale:
+            self.ip = get_local_ip()
+            self.fingerprint = fingerprint
+            self.resolved_at = now
+        return self.ip
+
+
+LOCAL_ADDRESS = LocalAddress()
+
+
+class AlertTracker:
+    """Persistent alert state so only changes are notified.
+
+    Alerts are keyed by (hostname, type, service). A new condition is
+    'pending' until it has held for min_duration, then 'firing'. A firing
+    metric alert only resolves once the value drops hysteresis points below
+    its threshold. Notifications go out on firing, escalation and
+    resolution. A key that fires again within cooldown of its last
+    notification is announced when the cooldown ends, if still firing. A
+    long-running alert is re-sent every repeat seconds. State is saved to
+    disk so one-shot runs share it.
+    """
+
+    def __init__(self, path=ALERT_STATE_PATH, policy=ALERT_POLICY):
+        self.path = Path(path)
+        self.policy = policy
+        self.state = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix('.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(self.state, f, indent=1)
+        os.replace(tmp, self.path)
+
+    def _policy(self, alert_type):
+        return {**self.policy['default'], **self.policy.get(alert_type, {})}
+
+    @staticmethod
+    def key(alert):
+        return f"{alert.get('hostname', '')}|{alert['type']}|{alert.get('service') or ''}"
+
+    def update(self, alerts, snapshots, now=None):
+        """Feed one evaluation round and return the notifications to send.
+
+        snapshots maps each evaluated hostname to its metrics; keys for hosts
+        not evaluated this round are left untouched. Each notification is the
+        alert dict plus a 'transition' of firing, escalated, repeat or
+        resolved.
+        """
+        now = time.time() if now is None else now
+        notifications = []
+        active = {self.key(alert): alert for alert in alerts}
+
+        for key, alert in active.items():
+            policy = self._policy(alert['type'])
+            entry = self.state.get(key)
+            if entry is None or entry['state'] == 'resolved':
+                entry = {**(entry or {}), 'state': 'pending', 'since': now, 'notified': False}
+                self.state[key] = entry
+            entry.update({
+                'hostname': alert.get('hostname'),
+                'type': alert['type'],
+                'message': alert['message'],
+                'metric': alert.get('metric'),
+                'threshold': alert.get('threshold'),
+            })
+
+            transition = None
+            notified_at = entry.get('notified_at')
+            if entry['state'] == 'pending' and now - entry['since'] >= policy['min_duration']:
+                entry['state'] = 'firing'
+                if notified_at is None or now - notified_at >= policy['cooldown']:
+                    transition = 'firing'
+            elif entry['state'] == 'firing':
+                if not entry['notified']:
+                    # Re-fired inside the cooldown: announce it once the cooldown is over
+                    if notified_at is None or now - notified_at >= policy['cooldown']:
+                        transition = 'firing'
+                elif alert['severity'] == 'critical' and entry.get('severity') == 'warning':
+                    transition = 'escalated'
+                elif notified_at is not None and now - notified_at >= policy['repeat']:
+                    transition = 'repeat'
+
+            if entry['state'] == 'firing':
+                entry['severity'] = alert['severity']
+            if transition:
+                entry['notified_at'] = now
+                entry['notified'] = True
+                notifications.append({**alert, 'transition': transition})
+
+        for key, entry in list(self.state.items()):
+            if key in active or entry['state'] == 'resolved':
+                continue
+            metrics = snapshots.get(entry['hostname'])
+            if metrics is None:
+                continue
+            if entry['type'] != 'system_offline' and metrics.get('status') != 'online':
+                continue  # no data for this host this round
+
+            # Hysteresis: stay firing until the value clears the band
+            value = metrics.get(entry['metric']) if entry.get('metric') else None
+            if (entry['state'] == 'firing' and value is not None and entry.get('threshold') is not None
+                    and float(value) > entry['threshold'] - self._policy(entry['type'])['hysteresis']):
+                continue
+
+            if entry['state'] == 'pending':
+                del self.state[key]
+                continue
+
+            entry['state'] = 'resolved'
+            entry['resolved_at'] = now
+            if entry.get('notified'):
+                notifications.append({
+                    'hostname': entry['hostname'],
+                    'type': entry['type'],
+                    'severity': 'resolved',
+                    'message': f"✅ Resolved: {entry['message']}",
+                    'service': key.split('|', 2)[2] or None,
+                    'transition': 'resolved',
+                })
+
+        # Forget long-resolved keys
+        for key, entry in list(self.state.items()):
+            if entry['state'] == 'resolved' and now - entry.get('resolved_at', now) > ALERT_STATE_RETENTION:
+                del self.state[key]
+
+        self.save()
+        return notifications
+
+
+ALERT_TRACKER = AlertTracker()
+
+
+class RuleEngine:
+    """Alert rules compiled from config and evaluated in one call per host.
+
+    Each rule has a 'when' expression (and optionally a 'critical' one) over
+    the host's metrics, e.g. "disk_percent > 80 and uptime_seconds > 600".
+    Expressions may use arithmetic, comparisons, and/or/not, and abs(),
+    min(), max() and rate(metric[, window_seconds]). rate() is change per
+    hour over the window. Rules can be limited to host or service globs with
+    'hosts'/'services'. Service-scope rules also see is_running,
+    service_name and service_cpu_percent / service_memory_mb /
+    service_process_count.
+
+    All rules in a scope are compiled into a single function that returns
+    every condition as one tuple. A host costs one call no matter how many
+    rules there are, and only rules that fire need more work. Missing
+    metrics evaluate as NaN, so comparisons against them are simply false.
+    """
+
+    FUNCTIONS = {'abs', 'min', 'max', 'rate'}
+    NODES = (
+        ast.Expression, ast.BoolOp, ast.And, ast.Or, ast.UnaryOp, ast.Not, ast.USub, ast.UAdd,
+        ast.BinOp, ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Compare, ast.Eq, ast.NotEq,
+        ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.Name, ast.Load, ast.Constant, ast.Call,
+    )
+
+    def __init__(self, rules=None, history_path=RULE_HISTORY_PATH, default_rules=DEFAULT_ALERT_RULES):
+        self.history_path = Path(history_path)
+        self.default_rules = default_rules
+        self.history = self._load_history()
+        self.rate_metrics = set()
+        self.rules = self._prepare_all(rules)
+        self.host_rules = [r for r in self.rules if r['scope'] == 'host']
+        self.service_rules = [r for r in self.rules if r['scope'] == 'service']
+        self._host_fn = self._compile_group(self.host_rules)
+        self._service_fn = self._compile_group(self.service_rules)
+        self._host_masks = {}
+
+    # -- compilation -------------------------------------------------------
+
+    def _prepare_all(self, rules):
+        """Prepare explicit rules (errors raise) or the configured ones.
+
+        A broken alert rules file must not stop the program, so config that
+        fails to load or compile is reported and the built-in rules are used.
+        """
+        if rules is not None:
+            return [self._prepare(rule) for rule in rules]
+        try:
+            return [self._prepare(rule) for rule in load_alert_rules(default=self.default_rules)]
+        except (OSError, ValueError, SyntaxError, KeyError, TypeError) as e:
+            print(f"Error in alert rules {ALERT_RULES_PATH}, using the built-in rules: {e}")
+            self.rate_metrics = set()
+            return [self._prepare(rule) for rule in self.default_rules]
+
+    def _prepare(self, rule):
+        rule = dict(rule)
+        rule.setdefault('scope', 'host')
+        rule.setdefault('severity', 'warning')
+        rule.setdefault('name', rule['type'])
+        rule['_when'] = self._parse(rule['when'])
+        rule['_critical'] = self._parse(rule['critical']) if rule.get('critical') else None
+        value = rule.get('value') or rule.get('metric')
+        rule['_value'] = self._compile_single(self._parse(value)) if value else None
+        return rule
+
+    def _parse(self, expression):
+        tree = ast.parse(str(expression), mode='eval')
+        for node in ast.walk(tree):
+            if not isinstance(node, self.NODES):
+                raise ValueError(f"Unsupported syntax in rule {expression!r}: {type(node).__name__}")
+            if isinstance(node, ast.Call):
+                if not isinstance(node.func, ast.Name) or node.func.id not in self.FUNCTIONS or node.keywords:
+                    raise ValueError(f"Unsupported function in rule {expression!r}")
+                if node.func.id == 'rate':
+                    if not node.args or not isinstance(node.args[0], ast.Name):
+                        raise ValueError(f"rate() needs a metric name in rule {expression!r}")
+                    self.rate_metrics.add(node.args[0].id)
+        return _RuleTransformer().visit(tree).body
+
+    def _namespace(self):
+        return {'NAN': NAN, '_rate': self._rate, 'abs': abs, 'min': min, 'max': max}
+
+    def _compile_single(self, body):
+        tree = ast.fix_missing_locations(ast.Expression(_lambda(body)))
+        return eval(compile(tree, '<alert rule>', 'eval'), self._namespace())
+
+    def _compile_group(self, rules):
+        """One function returning (when_0, critical_0, when_1, critical_1, ...)."""
+        elements = []
+        for rule in rules:
+            elements.append(rule['_when'])
+            elements.append(rule['_critical'] or ast.Constant(False))
+        batch = self._compile_single(ast.Tuple(elts=elements, ctx=ast.Load()))
+        singles = [(self._compile_single(r['_when']),
+                    self._compile_single(r['_critical']) if r['_critical'] else None) for r in rules]
+
+        def evaluate(m):
+            try:
+                return batch(m)
+            except Exception:
+                # A rule blew up (e.g. comparing a string to a number); fall
+                # back to rule-by-rule so the others still run
+                results = []
+                for rule, (when, critical) in zip(rules, singles):
+                    try:
+                        results.extend((when(m), critical(m) if critical else False))
+                    except Exception as e:
+                        print(f"Alert rule {rule['name']} failed: {e}")
+                        results.extend((False, False))
+                return tuple(results)
+
+        return evaluate
+
+    # -- rate() history ----------------------------------------------------
+
+    def _load_history(self):
+        try:
+            with open(self.history_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_history(self):
+        self.history_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.history_path.with_suffix('.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(self.history, f)
+        os.replace(tmp, self.history_path)
+
+    def _observe(self, hostname, metrics, now):
+        host = self.history.setdefault(hostname, {})
+        for metric in self.rate_metrics:
+            value = metrics.get(metric)
+            if value is None:
+                continue
+            samples = host.setdefault(metric, [])
+            if samples and now - samples[-1][0] < RULE_HISTORY_STEP:
+                continue
+            samples.append([now, float(value)])
+            while samples and now - samples[0][0] > RULE_HISTORY_SECONDS:
+                samples.pop(0)
+
+    def _rate(self, m, metric, window=3600):
+        """Change per hour of a metric over the last window seconds."""
+        samples = self.history.get(m.get('hostname'), {}).get(metric) or []
+        if len(samples) < 2:
+            return NAN
+        latest = samples[-1]
+        oldest = next((s for s in samples if latest[0] - s[0] <= window), latest)
+        elapsed = latest[0] - oldest[0]
+        if elapsed < 60:
+            return NAN
+        return (latest[1] - oldest[1]) * 3600.0 / elapsed
+
+    # -- evaluation --------------------------------------------------------
+
+    def _mask(self, hostname, rules, key):
+        """Which rules apply to a host (cached: globs are matched once per host)."""
+        cache_key = (hostname, key)
+        if cache_key not in self._host_masks:
+            self._host_masks[cache_key] = [
+                any(fnmatch.fnmatch(hostname, pattern) for pattern in rule.get('hosts', ['*']))
+                for rule in rules
+            ]
+        return self._host_masks[cache_key]
+
+    def _alert(self, rule, context, critical, service=None):
+        severity = 'critical' if critical else rule['severity']
+        value = None
+        if rule['_value'] is not None:
+            value = rule['_value'](context)
+            if isinstance(value, float) and value != value:
+                value = None  # NaN: a metric was missing
+            elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                value = round(value, 2)
+        fields = _RuleFields({**context, 'value': value, 'type': rule['type']})
+        alert = {
+            'hostname': context.get('hostname'),
+            'type': rule['type'],
+            'severity': severity,
+            'message': rule.get('message', '{type} on {hostname}').format_map(fields),
+            'rule': rule['name'],
+        }
+        if value is not None:
+            alert['value'] = value
+        if rule.get('metric'):
+            alert['metric'] = rule['metric']
+        if rule.get('threshold') is not None:
+            alert['threshold'] = rule['threshold']
+        if service:
+            alert['service'] = service
+        return alert
+
+    def evaluate(self, all_metrics, now=None):
+        """Evaluate every rule against a sweep and return the active alerts."""
+        now = time.time() if now is None else now
+        alerts = []
+
+        for system_data in all_metrics:
+            metrics = system_data['metrics']
+            hostname = metrics.get('hostname', 'unknown')
+            if self.rate_metrics and metrics.get('status') == 'online':
+                self._observe(hostname, metrics, now)
+
+            context = {k: (NAN if v is None else v) for k, v in metrics.items()}
+            context['hostname'] = hostname
+            # Only offline-style rules make sense without data
+            online = metrics.get('status') == 'online'
+
+            mask = self._mask(hostname, self.host_rules, 'host')
+            results = self._host_fn(context)
+            for i, rule in enumerate(self.host_rules):
+                if mask[i] and results[2 * i] and (online or rule.get('offline')):
+                    alerts.append(self._alert(rule, context, results[2 * i + 1]))
+
+            if not online or not self.service_rules:
+                continue
+            mask = self._mask(hostname, self.service_rules, 'service')
+            for svc in system_data.get('services', []):
+                svc_context = dict(context)
+                svc_context.update({
+                    'service_name': svc['service_name'],
+                    'is_running': bool(svc.get('is_running')),
+                    'service_cpu_percent': NAN if svc.get('cpu_percent') is None else svc['cpu_percent'],
+                    'service_memory_mb': NAN if svc.get('memory_mb') is None else svc['memory_mb'],
+                    'service_process_count': svc.get('process_count', NAN),
+                })
+                results = self._service_fn(svc_context)
+                for i, rule in enumerate(self.service_rules):
+                    if (mask[i] and results[2 * i]
+                            and any(fnmatch.fnmatch(svc['service_name'], p) for p in rule.get('services', ['*']))):
+                        alerts.append(self._alert(rule, svc_context, results[2 * i + 1],
+                                                  service=svc['service_name']))
+
+        if self.rate_metrics:
+            self._save_history()
+        return alerts
+
+
+class _RuleTransformer(ast.NodeTransformer):
+    """Rewrite metric names to m.get(name, NAN) and rate(x) to _rate(m, 'x')."""
+
+    def visit_Name(self, node):
+        return ast.Call(
+            func=ast.Attribute(value=ast.Name(id='m', ctx=ast.Load()), attr='get', ctx=ast.Load()),
+            args=[ast.Constant(node.id), ast.Name(id='NAN', ctx=ast.Load())],
+            keywords=[],
+        )
+
+    def visit_Call(self, node):
+        if node.func.id == 'rate':
+            args = [ast.Name(id='m', ctx=ast.Load()), ast.Constant(node.args[0].id)]
+            args += [self.visit(arg) for arg in node.args[1:]]
+            return ast.Call(func=ast.Name(id='_rate', ctx=ast.Load()), args=args, keywords=[])
+        node.args = [self.visit(arg) for arg in node.args]
+        return node
+
+
+class _RuleFields(dict):
+    """format_map() helper: unknown or NaN fields render as N/A."""
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None or (isinstance(value, float) and value != value):
+            return 'N/A'
+        return value
+
+
+def _lambda(body):
+    args = ast.arguments(posonlyargs=[], args=[ast.arg(arg='m')], vararg=None, kwonlyargs=[],
+                         kw_defaults=[], kwarg=None, defaults=[])
+    return ast.Lambda(args=args, body=body)
+
+
+def load_alert_rules(path=ALERT_RULES_PATH, default=DEFAULT_ALERT_RULES):
+    """Alert rules from the JSON config file, or default when there is none."""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+
+
+RULE_ENGINE = RuleEngine()
+
+
 def check_alerts(metrics, services):
-    """Check metrics against thresholds and return alerts."""
-    alerts = []
-
-    # CPU alerts
-    if metrics.get('cpu_percent') and metrics['cpu_percent'] > 90:
-        alerts.append({
-            'type': 'high_cpu',
-            'severity': 'critical' if metrics['cpu_percent'] > 95 else 'warning',
-            'message': f"CPU at {metrics['cpu_percent']}% on {metrics['hostname']}",
-            'value': metrics['cpu_percent'],
-        })
+    """Check metrics against the alert rules and return alerts."""
+    return RULE_ENGINE.evaluate([{'metrics': {**metrics, 'status': 'online'}, 'services': services}])
 
-    # Memory alerts
-    if metrics.get('memory_percent') and metrics['memory_percent'] > 85:
-        alerts.append({
-            'type': 'high_memory',
-            'severity': 'critical' if metrics['memory_percent'] > 95 else 'warning',
-            'message': f"Memory at {metrics['memory_percent']}% on {metrics['hostname']}",
-            'value': metrics['memory_percent'],
-        })
 
-    # Disk alerts
-    if metrics.get('disk_percent') and metrics['disk_percent'] > 80:
-        alerts.append({
-            'type': 'disk_space',
-            'severity': 'critical' if metrics['disk_percent'] > 90 else 'warning',
-            'message': f"Disk at {metrics['disk_percent']}% on {metrics['hostname']}",
-            'value': metrics['disk_percent'],
+# Layout (little-endian). Strings are a u8 length followed by UTF-8; NaN
+# stands in for missing values.
+#   batch    magic, version (u8), sample count (u16), hostname, system type
+#   sample   ts (f64), WIRE_METRICS, core count (u16) + f32 per core,
+#            service count (u8), then per service: name, running (u8),
+#            cpu_percent (f32), memory_mb (f32)
+WIRE_HEADER = struct.Struct('<4sBH')
+WIRE_SAMPLE = struct.Struct('<d' + ''.join(fmt for _, fmt in WIRE_METRICS))
+WIRE_SERVICE = struct.Struct('<Bff')
+WIRE_COUNT = struct.Struct('<H')
+
+
+def _wire_value(value):
+    return NAN if value is None else value
+
+
+def _wire_string(text):
+    data = str(text).encode('utf-8')[:255]
+    return bytes((len(data),)) + data
+
+
+def encode_samples(hostname, system_type, samples):
+    """Encode [{'ts', 'metrics', 'services'}] samples as one L7MS batch."""
+    parts = [WIRE_HEADER.pack(WIRE_MAGIC, WIRE_VERSION, len(samples)),
+             _wire_string(hostname), _wire_string(system_type)]
+    for sample in samples:
+        metrics = sample['metrics']
+        parts.append(WIRE_SAMPLE.pack(sample['ts'], *(_wire_value(metrics.get(key)) for key, _ in WIRE_METRICS)))
+
+        cores = metrics.get('cpu_per_core') or []
+        parts.append(WIRE_COUNT.pack(len(cores)))
+        parts.append(struct.pack(f'<{len(cores)}f', *cores))
+
+        services = (sample.get('services') or [])[:255]
+        parts.append(bytes((len(services),)))
+        for svc in services:
+            parts.append(_wire_string(svc['service_name']))
+            parts.append(WIRE_SERVICE.pack(bool(svc['is_running']), _wire_value(svc.get('cpu_percent')),
+                                           _wire_value(svc.get('memory_mb'))))
+    return b''.join(parts)
+
+
+def decode_samples(data):
+    """Decode an L7MS batch into {'hostname', 'system_type', 'samples'}.
+
+    Raises ValueError for foreign, newer or truncated payloads.
+    """
+    def number(value, key=None):
+        if value != value:
+            return None
+        return int(value) if key in WIRE_INTS else round(value, 2)
+
+    def string(offset):
+        end = offset + 1 + data[offset]
+        if end > len(data):
+            raise IndexError(offset)
+        return data[offset + 1:end].decode('utf-8', 'replace'), end
+
+    try:
+        magic, version, count = WIRE_HEADER.unpack_from(data)
+        if magic != WIRE_MAGIC:
+            raise ValueError("not an L7MS payload")
+        if version != WIRE_VERSION:
+            raise ValueError(f"unsupported L7MS version {version}")
+        hostname, offset = string(WIRE_HEADER.size)
+        system_type, offset = string(offset)
+
+        samples = []
+        for _ in range(count):
+            ts, *values = WIRE_SAMPLE.unpack_from(data, offset)
+            offset += WIRE_SAMPLE.size
+            metrics = {key: number(value, key) for (key, _), value in zip(WIRE_METRICS, values)}
+            metrics['timestamp'] = datetime.utcfromtimestamp(ts).isoformat()
+
+            (ncores,) = WIRE_COUNT.unpack_from(data, offset)
+            offset += WIRE_COUNT.size
+            metrics['cpu_per_core'] = [number(v) for v in struct.unpack_from(f'<{ncores}f', data, offset)]
+            offset += 4 * ncores
+
+            services = []
+            nservices = data[offset]
+            offset += 1
+            for _ in range(nservices):
+                name, offset = string(offset)
+                running, cpu, memory = WIRE_SERVICE.unpack_from(data, offset)
+                offset += WIRE_SERVICE.size
+                services.append({
+                    'service_name': name,
+                    'is_running': bool(running),
+                    'cpu_percent': number(cpu),
+                    'memory_mb': number(memory),
+                })
+            samples.append({'ts': ts, 'metrics': metrics, 'services': services})
+    except (struct.error, IndexError):
+        raise ValueError("truncated L7MS payload")
+
+    return {'hostname': hostname, 'system_type': system_type, 'samples': samples}
+
+
+class Pusher:
+    """Batches samples and POSTs them to central_collector.py's /ingest.
+
+    Samples that can't be delivered stay queued (up to PUSH_BACKLOG, oldest
+    dropped first) and go out with the next batch. A batch the collector
+    rejects with a 4xx (other than 408/429) would be rejected again, so it
+    is dropped instead of blocking everything queued behind it.
+    """
+
+    def __init__(self, url, token=PUSH_TOKEN, batch=PUSH_BATCH, backlog=PUSH_BACKLOG):
+        self.url = url
+        self.token = token
+        self.batch = max(1, batch)
+        self.queue = deque(maxlen=backlog)
+
+    def add(self, sample):
+        self.queue.append(sample)
+
+    def due(self):
+        return len(self.queue) >= self.batch
+
+    def flush(self):
+        """Send everything queued; returns False if the collector didn't take it."""
+        if not self.queue:
+            return True
+
+        samples = list(self.queue)
+        body = encode_samples(get_hostname(), get_system_type(), samples)
+        request = urllib.request.Request(self.url, data=body, method='POST', headers={
+            'Content-Type': WIRE_CONTENT_TYPE,
+            'X-Ingest-Token': self.token,
         })
 
-    # Service alerts
-    for svc in services:
-        if not svc['is_running']:
-            alerts.append({
-                'type': 'service_down',
-                'severity': 'critical',
-                'message': f"{svc['service_name']} is DOWN on {metrics['hostname']}",
-                'service': svc['service_name'],
-            })
+        try:
+            with urllib.request.urlopen(request, timeout=10) as response:
+                response.read()
+        except urllib.error.HTTPError as e:
+            if 400 <= e.code < 500 and e.code not in (408, 429):
+                print(f"Push rejected, dropping {len(samples)} samples: {e}")
+                self.queue.clear()
+            else:
+                print(f"Push failed ({len(samples)} samples queued): {e}")
+            return False
+        except (urllib.error.URLError, OSError) as e:
+            print(f"Push failed ({len(samples)} samples queued): {e}")
+            return False
+
+        self.queue.clear()
+        return True
+
 
-    return alerts
+def next_tick(tick, interval):
+    """Next fixed-rate tick after tick; ticks already missed are skipped rather than bunched up."""
+    tick += interval
+    now = time.monotonic()
+    if tick < now:
+        tick += (now - tick) // interval * interval + interval
+    return tick
+
+
+def install_signal_handlers():
+    """For the long-running modes: returns an Event set by SIGINT/SIGTERM.
+
+    SIGHUP (where available) makes the next tick re-detect host facts.
+    """
+    stop = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stop.set())
+    if hasattr(signal, 'SIGHUP'):
+        signal.signal(signal.SIGHUP, HOST_FACTS.invalidate)
+    return stop
+
+
+def run_push(url, interval=PUSH_INTERVAL):
+    """Sample every interval seconds and push batches to the collector.
+
+    Runs until SIGINT/SIGTERM. In this mode the collector does the alerting
+    and Supabase writes, so the agent only samples and ships.
+    """
+    stop = install_signal_handlers()
+    pusher = Pusher(url)
+    index = prime_counters()
+    print(f"Pushing samples from {get_hostname()} to {url} every {interval:g}s")
+
+    tick = time.monotonic()
+    while not stop.is_set():
+        services = get_service_status(SERVICES_CONFIG, index)
+        index = None
+        metrics = get_system_metrics()
+        pusher.add({'ts': time.time(), 'metrics': metrics, 'services': services})
+        if pusher.due():
+            pusher.flush()
+
+        tick = next_tick(tick, interval)
+        stop.wait(tick - time.monotonic())
+
+    pusher.flush()
+    print("Push agent stopped")
+
+
+def run_loop(interval=LOOP_INTERVAL):
+    """Collect and report every interval seconds until SIGINT/SIGTERM.
+
+    Unlike a cron-driven one-shot run, the Supabase client, host facts, local
+    IP and CPU counters stay warm between ticks, so a tick costs little more
+    than the metric reads themselves.
+    """
+    stop = install_signal_handlers()
+    print(f"System Monitor Agent looping on {get_hostname()} ({get_system_type()}) every {interval:g}s")
+    index = prime_counters()
+
+    tick = time.monotonic()
+    while not stop.is_set():
+        try:
+            run_once(index)
+        except Exception as e:
+            print(f"[{datetime.now()}] Collection failed: {e}")
+        index = None
 
+        tick = next_tick(tick, interval)
+        stop.wait(tick - time.monotonic())
 
-def main():
-    """Main monitoring loop."""
-    print(f"System Monitor Agent starting on {get_hostname()} ({get_system_type()})")
+    print("System Monitor Agent stopped")
 
+
+def run_once(index=None):
+    """Collect, alert and report once; returns the payload.
+
+    index is a process snapshot to reuse, e.g. the one prime_counters() took.
+    """
     # Collect metrics
-    metrics = get_system_metrics()
-    services = get_service_status(SERVICES_CONFIG)
+    services = get_service_status(SERVICES_CONFIG, index)
     backups = get_backup_status()
+    metrics = get_system_metrics()
+    if backups['newest_age_seconds'] is not None:
+        metrics['backup_age_hours'] = round(backups['newest_age_seconds'] / 3600, 1)
 
-    # Check for alerts
+    # Check for alerts; only state changes are forwarded
     alerts = check_alerts(metrics, services)
+    notifications = ALERT_TRACKER.update(alerts, {metrics['hostname']: {**metrics, 'status': 'online'}})
 
     # Prepare payload
     payload = {
@@ -353,17 +1955,20 @@ def main():
         'services': services,
         'backups': backups,
         'alerts': alerts,
+        'notifications': notifications,
         'collected_at': datetime.utcnow().isoformat(),
     }
 
     # Send to Supabase
     send_to_supabase(metrics, services, backups)
 
-    # Send to webhook if there are alerts
     if alerts:
         print(f"Alerts detected: {len(alerts)}")
         for alert in alerts:
             print(f"  [{alert['severity'].upper()}] {alert['message']}")
+
+    # Send to webhook if alert state changed
+    if notifications:
         send_to_webhook(payload)
 
     # Print summary
@@ -374,7 +1979,31 @@ def main():
     return payload
 
 
+def main():
+    """Single monitoring run."""
+    print(f"System Monitor Agent starting on {get_hostname()} ({get_system_type()})")
+
+    # Prime CPU counters first so the services/backup scan provides the
+    # sampling window instead of a blocking sleep
+    return run_once(prime_counters())
+
+
 if __name__ == '__main__':
-    result = main()
-    if '--json' in sys.argv:
-        print(json.dumps(result, indent=2))
+    parser = argparse.ArgumentParser(description='System monitor agent')
+    parser.add_argument('--json', action='store_true', help='print the collected payload as JSON')
+    parser.add_argument('--loop', action='store_true', help='keep running, collecting every --interval seconds')
+    parser.add_argument('--push', metavar='URL', default=PUSH_URL,
+                        help="stream samples to a collector's /ingest instead of running once")
+    parser.add_argument('--interval', type=float,
+                        help=f'seconds between samples (default {LOOP_INTERVAL:g} for --loop, '
+                             f'{PUSH_INTERVAL:g} for --push)')
+    args = parser.parse_args()
+
+    if args.push:
+        run_push(args.push, args.interval or PUSH_INTERVAL)
+    elif args.loop:
+        run_loop(args.interval or LOOP_INTERVAL)
+    else:
+        result = main()
+        if args.json:
+            print(json.dumps(result, indent=2))
@@ -40,6 +40,24 @@ CREATE TABLE IF NOT EXISTS system_metrics (
 CREATE INDEX IF NOT EXISTS idx_system_metrics_hostname_time
 ON system_metrics(hostname, timestamp DESC);
 
+-- Per-minute / per-hour aggregates computed by the collector
+CREATE TABLE IF NOT EXISTS system_metrics_rollup (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    hostname VARCHAR(100) NOT NULL,
+    metric VARCHAR(50) NOT NULL,
+    resolution VARCHAR(10) NOT NULL, -- '1m', '1h'
+    bucket_start TIMESTAMPTZ NOT NULL,
+    sample_count INTEGER,
+    min_value DECIMAL(10,3),
+    max_value DECIMAL(10,3),
+    avg_value DECIMAL(10,3),
+    p95_value DECIMAL(10,3),
+    UNIQUE(hostname, metric, resolution, bucket_start)
+);
+
+CREATE INDEX IF NOT EXISTS idx_system_metrics_rollup_lookup
+ON system_metrics_rollup(hostname, resolution, bucket_start DESC);
+
 -- Service health checks
 CREATE TABLE IF NOT EXISTS service_status (
     id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
@@ -47,7 +65,7 @@ CREATE TABLE IF NOT EXISTS service_status (
     service_name VARCHAR(100) NOT NULL,
     service_type VARCHAR(50),
     is_running BOOLEAN,
-    cpu_percent DECIMAL(5,2),
+    cpu_percent DECIMAL(7,2), -- summed over the service's processes; 100 = one core
     memory_mb DECIMAL(10,2),
     port INTEGER,
     last_checked TIMESTAMPTZ DEFAULT NOW(),
@@ -55,6 +73,10 @@ CREATE TABLE IF NOT EXISTS service_status (
     UNIQUE(hostname, service_name)
 );
 
+-- Widen cpu_percent on tables created when it was DECIMAL(5,2), which
+-- overflowed for services busy on more than ten cores
+ALTER TABLE service_status ALTER COLUMN cpu_percent TYPE DECIMAL(7,2);
+
 -- Alert rules
 CREATE TABLE IF NOT EXISTS alert_rules (
     id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
@@ -100,9 +122,66 @@ CREATE TABLE IF NOT EXISTS backup_tracking (
     size_bytes BIGINT,
     created_at TIMESTAMPTZ,
     verified BOOLEAN DEFAULT false,
-    extra_data JSONB
+    extra_data JSONB,
+    UNIQUE(hostname, backup_path)
 );
 
+-- Agents upsert only new/changed/missing backups on (hostname, backup_path);
+-- for tables created before that constraint existed
+CREATE UNIQUE INDEX IF NOT EXISTS idx_backup_tracking_path ON backup_tracking(hostname, backup_path);
+
+-- One-request write path for monitor_agent.py: a tick's metrics, changed
+-- service rows, backup changes and registry update in a single transaction.
+-- Optional; agents fall back to per-table writes when it doesn't exist.
+CREATE OR REPLACE FUNCTION ingest_agent_batch(
+    p_metrics JSONB DEFAULT '[]',
+    p_services JSONB DEFAULT '[]',
+    p_backups JSONB DEFAULT '[]',
+    p_registry JSONB DEFAULT NULL
+) RETURNS VOID LANGUAGE plpgsql AS $$
+BEGIN
+    INSERT INTO system_metrics (hostname, "timestamp", cpu_percent, memory_percent, memory_used_gb,
+        memory_total_gb, disk_percent, disk_used_gb, disk_total_gb, load_avg_1m, load_avg_5m,
+        load_avg_15m, uptime_seconds, process_count, extra_data)
+    SELECT hostname, COALESCE("timestamp", NOW()), cpu_percent, memory_percent, memory_used_gb,
+        memory_total_gb, disk_percent, disk_used_gb, disk_total_gb, load_avg_1m, load_avg_5m,
+        load_avg_15m, uptime_seconds, process_count, extra_data
+    FROM jsonb_populate_recordset(NULL::system_metrics, p_metrics);
+
+    INSERT INTO service_status (hostname, service_name, service_type, is_running, cpu_percent,
+        memory_mb, port, last_checked, extra_data)
+    SELECT hostname, service_name, service_type, is_running, cpu_percent,
+        memory_mb, port, COALESCE(last_checked, NOW()), extra_data
+    FROM jsonb_populate_recordset(NULL::service_status, p_services)
+    ON CONFLICT (hostname, service_name) DO UPDATE SET
+        service_type = EXCLUDED.service_type,
+        is_running = EXCLUDED.is_running,
+        cpu_percent = EXCLUDED.cpu_percent,
+        memory_mb = EXCLUDED.memory_mb,
+        port = EXCLUDED.port,
+        last_checked = EXCLUDED.last_checked,
+        extra_data = EXCLUDED.extra_data;
+
+    INSERT INTO backup_tracking (hostname, backup_type, backup_name, backup_path, size_bytes,
+        created_at, extra_data)
+    SELECT hostname, backup_type, backup_name, backup_path, size_bytes, created_at, extra_data
+    FROM jsonb_populate_recordset(NULL::backup_tracking, p_backups)
+    ON CONFLICT (hostname, backup_path) DO UPDATE SET
+        backup_type = EXCLUDED.backup_type,
+        backup_name = EXCLUDED.backup_name,
+        size_bytes = EXCLUDED.size_bytes,
+        created_at = EXCLUDED.created_at,
+        extra_data = EXCLUDED.extra_data;
+
+    IF jsonb_typeof(p_registry) = 'object' THEN
+        UPDATE system_registry
+        SET last_seen = (p_registry->>'last_seen')::TIMESTAMPTZ,
+            ip_address = p_registry->>'ip_address'
+        WHERE hostname = p_registry->>'hostname';
+    END IF;
+END;
+$$;
+
 -- Insert default systems
 INSERT INTO system_registry (hostname, display_name, system_type, ip_address, location, purpose, ssh_user) VALUES
 ('Jeffs-Mac-Studio', 'Mac Studio', 'mac', '127.0.0.1', 'Office', 'Primary workstation, Docker host', 'jgl'),
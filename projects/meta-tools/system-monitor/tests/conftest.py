@@ -0,0 +1,23 @@
+"""Shared setup for the system monitor tests.
+
+Both programs read their configuration at import time, so state, alert
+rules and credentials are pointed somewhere harmless before either is
+imported.
+"""
+
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+os.environ['MONITOR_STATE_DIR'] = tempfile.mkdtemp(prefix='l7-tests-')
+os.environ['MONITOR_ALERT_RULES'] = os.path.join(os.environ['MONITOR_STATE_DIR'], 'no-alert-rules.json')
+for key in ('SUPABASE_ANON_KEY', 'SUPABASE_SERVICE_ROLE_KEY', 'TELEGRAM_BOT_TOKEN',
+            'MONITOR_PUSH_URL', 'COLLECTOR_INGEST_TOKEN'):
+    os.environ[key] = ''
+
+import central_collector  # noqa: E402,F401
+import monitor_agent  # noqa: E402,F401
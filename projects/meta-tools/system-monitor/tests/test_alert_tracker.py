@@ -0,0 +1,92 @@
+import pytest
+
+import monitor_agent
+
+POLICY = {
+    'default': {'min_duration': 0, 'cooldown': 1800, 'repeat': 6 * 3600, 'hysteresis': 5},
+    'high_cpu': {'min_duration': 120},
+}
+ONLINE = {'web': {'status': 'online', 'cpu_percent': 10, 'disk_percent': 50}}
+
+
+@pytest.fixture
+def tracker(tmp_path):
+    return monitor_agent.AlertTracker(path=tmp_path / 'alerts.json', policy=POLICY)
+
+
+def alert(type_='service_down', severity='critical', **extra):
+    return {'hostname': 'web', 'type': type_, 'severity': severity,
+            'message': f'{type_} on web', 'service': extra.pop('service', 'nginx'), **extra}
+
+
+def transitions(notifications):
+    return [n['transition'] for n in notifications]
+
+
+def test_fire_then_resolve(tracker):
+    assert transitions(tracker.update([alert()], ONLINE, now=0)) == ['firing']
+    assert tracker.update([alert()], ONLINE, now=60) == []
+    assert transitions(tracker.update([], ONLINE, now=120)) == ['resolved']
+    assert tracker.update([], ONLINE, now=180) == []
+
+
+def test_refire_within_cooldown_is_announced_when_cooldown_ends(tracker):
+    tracker.update([alert()], ONLINE, now=0)
+    tracker.update([], ONLINE, now=60)
+
+    # Drops again ten minutes later: quiet for now...
+    assert tracker.update([alert()], ONLINE, now=600) == []
+    assert tracker.update([alert()], ONLINE, now=1200) == []
+    # ...but announced once the 30 minute cooldown has passed, not 6h later
+    assert transitions(tracker.update([alert()], ONLINE, now=1800)) == ['firing']
+    assert tracker.update([alert()], ONLINE, now=1860) == []
+
+
+def test_refire_that_clears_within_cooldown_stays_silent(tracker):
+    tracker.update([alert()], ONLINE, now=0)
+    tracker.update([], ONLINE, now=60)
+    assert tracker.update([alert()], ONLINE, now=600) == []
+    assert tracker.update([], ONLINE, now=700) == []
+
+
+def test_min_duration_holds_pending(tracker):
+    cpu = alert('high_cpu', 'warning', service=None, metric='cpu_percent', threshold=90)
+    assert tracker.update([cpu], ONLINE, now=0) == []
+    assert tracker.update([cpu], ONLINE, now=60) == []
+    assert transitions(tracker.update([cpu], ONLINE, now=120)) == ['firing']
+
+
+def test_pending_alert_that_clears_is_never_sent(tracker):
+    cpu = alert('high_cpu', 'warning', service=None, metric='cpu_percent', threshold=90)
+    tracker.update([cpu], ONLINE, now=0)
+    assert tracker.update([], ONLINE, now=60) == []
+    assert tracker.state == {}
+
+
+def test_hysteresis_keeps_metric_alert_firing(tracker):
+    disk = alert('disk_high', 'warning', service=None, metric='disk_percent', threshold=80)
+    tracker.update([disk], ONLINE, now=0)
+    near = {'web': {'status': 'online', 'disk_percent': 77}}
+    assert tracker.update([], near, now=60) == []
+    clear = {'web': {'status': 'online', 'disk_percent': 74}}
+    assert transitions(tracker.update([], clear, now=120)) == ['resolved']
+
+
+def test_escalation_and_repeat(tracker):
+    disk = alert('disk_high', 'warning', service=None, metric='disk_percent', threshold=80)
+    tracker.update([disk], ONLINE, now=0)
+    assert transitions(tracker.update([{**disk, 'severity': 'critical'}], ONLINE, now=60)) == ['escalated']
+    assert transitions(tracker.update([{**disk, 'severity': 'critical'}], ONLINE, now=60 + 6 * 3600)) == ['repeat']
+
+
+def test_hosts_without_data_are_left_alone(tracker):
+    tracker.update([alert()], ONLINE, now=0)
+    assert tracker.update([], {}, now=60) == []
+    assert tracker.update([], {'web': {'status': 'offline'}}, now=120) == []
+    assert transitions(tracker.update([], ONLINE, now=180)) == ['resolved']
+
+
+def test_state_persists(tracker, tmp_path):
+    tracker.update([alert()], ONLINE, now=0)
+    reloaded = monitor_agent.AlertTracker(path=tmp_path / 'alerts.json', policy=POLICY)
+    assert transitions(reloaded.update([], ONLINE, now=60)) == ['resolved']
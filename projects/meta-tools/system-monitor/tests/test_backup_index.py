@@ -0,0 +1,122 @@
+import os
+import time
+
+import monitor_agent
+
+
+def make_index(tmp_path):
+    backups = tmp_path / 'backups'
+    backups.mkdir(exist_ok=True)
+    index = monitor_agent.BackupIndex(sources=[('tradestation', str(backups), '*.zip')],
+                                      path=tmp_path / 'backups.json')
+    return index, backups
+
+
+def write(path, size, age=3600):
+    """A settled archive of size bytes, last modified age seconds ago."""
+    path.write_bytes(b'x' * size)
+    mtime = time.time() - age
+    os.utime(path, (mtime, mtime))
+
+
+def touch_dir(directory):
+    # Some filesystems keep coarse timestamps; make the directory change unmistakable
+    stat = os.stat(directory)
+    os.utime(directory, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+
+def rows(delta, kind):
+    return {(row['backup_name'], row['size_bytes'], row['extra_data']['status']) for row in delta[kind]}
+
+
+def test_rescan_reports_new_modified_and_deleted_files(tmp_path):
+    index, backups = make_index(tmp_path)
+    write(backups / 'a.zip', 10)
+    write(backups / 'b.zip', 20)
+    write(backups / 'c.zip', 30)
+    (backups / 'notes.txt').write_text('not a backup')
+
+    first = index.scan('pi')
+    assert rows(first, 'new') == {('a.zip', 10, 'present'), ('b.zip', 20, 'present'), ('c.zip', 30, 'present')}
+    assert (first['count'], first['total_bytes']) == (3, 60)
+
+    write(backups / 'd.zip', 40)
+    write(backups / 'b.zip', 25, age=1800)
+    (backups / 'c.zip').unlink()
+    touch_dir(backups)
+
+    delta = index.scan('pi')
+    assert rows(delta, 'new') == {('d.zip', 40, 'present')}
+    assert rows(delta, 'changed') == {('b.zip', 25, 'present')}
+    assert rows(delta, 'missing') == {('c.zip', 30, 'missing')}
+    assert (delta['count'], delta['total_bytes'], delta['newest_name']) == (3, 75, 'b.zip')
+    row = delta['missing'][0]
+    assert (row['hostname'], row['backup_type'], row['backup_path']) == \
+        ('pi', 'tradestation', os.path.normcase(str(backups / 'c.zip')))
+
+
+def test_unchanged_directory_is_not_listed_again(tmp_path):
+    index, backups = make_index(tmp_path)
+    write(backups / 'a.zip', 10)
+    assert index.scan('pi')['scanned_dirs'] == 1
+
+    delta = index.scan('pi')
+    assert delta['scanned_dirs'] == 0
+    assert delta['new'] == delta['changed'] == delta['missing'] == []
+    assert delta['count'] == 1
+
+    # The manifest carries over to the next run
+    reopened = monitor_agent.BackupIndex(sources=index.sources, path=tmp_path / 'backups.json')
+    assert reopened.scan('pi')['scanned_dirs'] == 0
+
+
+def test_directory_with_an_unsettled_file_is_rescanned(tmp_path):
+    index, backups = make_index(tmp_path)
+    write(backups / 'a.zip', 10, age=5)  # still being written
+    index.scan('pi')
+
+    write(backups / 'a.zip', 50, age=4)
+    delta = index.scan('pi')
+    assert delta['scanned_dirs'] == 1
+    assert rows(delta, 'changed') == {('a.zip', 50, 'present')}
+
+
+def test_removed_directory_reports_its_files_missing(tmp_path):
+    index, backups = make_index(tmp_path)
+    write(backups / 'a.zip', 10)
+    index.scan('pi')
+
+    (backups / 'a.zip').unlink()
+    backups.rmdir()
+    delta = index.scan('pi')
+    assert rows(delta, 'missing') == {('a.zip', 10, 'missing')}
+    assert delta['count'] == 0 and delta['newest_name'] is None
+
+
+def test_delta_is_upserted_on_backup_path(tmp_path, monkeypatch):
+    index, backups = make_index(tmp_path)
+    write(backups / 'a.zip', 10)
+    index.scan('pi')
+    write(backups / 'b.zip', 20)
+    (backups / 'a.zip').unlink()
+    touch_dir(backups)
+    delta = index.scan('pi')
+
+    batches = []
+    monkeypatch.setattr(monitor_agent, 'HAS_SUPABASE', True)
+    monkeypatch.setattr(monitor_agent, 'SUPABASE_KEY', 'key')
+    monkeypatch.setattr(monitor_agent, 'SPOOL', monitor_agent.Spool(directory=tmp_path / 'spool'))
+    monkeypatch.setattr(monitor_agent, 'WRITES', monitor_agent.WriteTracker(path=tmp_path / 'writes.json'))
+    monkeypatch.setattr(monitor_agent, 'write_batch', lambda records, registry: batches.append(records) or True)
+    monkeypatch.setattr(monitor_agent.LOCAL_ADDRESS, 'get', lambda: '10.0.0.2')
+    monitor_agent.WRITES.registry = {'hostname': 'pi', 'ip_address': '10.0.0.2', 'at': 2e9}
+
+    metrics = {'hostname': 'pi', 'timestamp': '2026-01-01T00:00:00', 'cpu_percent': 1.0}
+    assert monitor_agent.send_to_supabase(metrics, [], delta)
+
+    [records] = batches
+    [(op, upserted, on_conflict)] = [(op, table_rows, on_conflict) for table, op, table_rows, on_conflict in records
+                                     if table == 'backup_tracking']
+    assert (op, on_conflict) == ('upsert', 'hostname,backup_path')
+    assert {(row['backup_name'], row['extra_data']['status']) for row in upserted} == \
+        {('b.zip', 'present'), ('a.zip', 'missing')}
@@ -0,0 +1,84 @@
+import asyncio
+
+import pytest
+
+import central_collector
+from central_collector import CircuitBreaker, ssh_reached_host
+
+HOST = {'hostname': 'pi', 'display_name': 'Pi', 'type': 'linux', 'method': 'ssh',
+        'ssh_user': 'pi', 'ssh_host': 'pi.invalid', 'services': []}
+
+
+@pytest.fixture
+def breaker(tmp_path, monkeypatch):
+    breaker = CircuitBreaker(path=tmp_path / 'breakers.json', failures=2, cooldown=60)
+    monkeypatch.setattr(central_collector, 'BREAKER', breaker)
+    return breaker
+
+
+def test_opens_after_consecutive_failures(breaker):
+    breaker.record(HOST, False)
+    assert breaker.allow(HOST) == (True, None)
+    breaker.record(HOST, False)
+    allowed, reason = breaker.allow(HOST)
+    assert not allowed and 'Circuit open' in reason
+
+
+def test_success_resets_the_count(breaker):
+    breaker.record(HOST, False)
+    breaker.record(HOST, True)
+    breaker.record(HOST, False)
+    assert breaker.allow(HOST) == (True, None)
+
+
+def test_half_open_after_cooldown(breaker, monkeypatch):
+    breaker.record(HOST, False)
+    breaker.record(HOST, False)
+    breaker.state['pi']['opened_at'] -= 61
+
+    monkeypatch.setattr(breaker, 'port_open', lambda *args, **kwargs: False)
+    assert not breaker.allow(HOST)[0]
+    assert breaker.state['pi']['cooldown'] == 120
+
+    breaker.state['pi']['opened_at'] -= 121
+    monkeypatch.setattr(breaker, 'port_open', lambda *args, **kwargs: True)
+    assert breaker.allow(HOST) == (True, None)
+    assert breaker.state['pi']['state'] == 'half_open'
+    breaker.record(HOST, True)
+    entry = breaker.state['pi']
+    assert (entry['state'], entry['failures'], entry['cooldown']) == ('closed', 0, 60)
+
+
+def test_state_is_shared_through_disk(breaker):
+    breaker.record(HOST, False)
+    breaker.record(HOST, False)
+    assert not CircuitBreaker(path=breaker.path, failures=2, cooldown=60).allow(HOST)[0]
+
+
+@pytest.mark.parametrize('returncode, reached', [(0, True), (1, True), (127, True), (255, False), (None, False)])
+def test_ssh_reached_host(returncode, reached):
+    assert ssh_reached_host(returncode) is reached
+
+
+@pytest.mark.parametrize('returncode, opens', [(1, False), (255, True), (None, True)])
+def test_only_transport_errors_open_the_circuit(breaker, monkeypatch, returncode, opens):
+    monkeypatch.setattr(central_collector, 'run_ssh_command', lambda *args, **kwargs: ('boom', returncode))
+    for _ in range(2):
+        metrics, services = central_collector.collect_remote_metrics(HOST)
+        assert metrics['status'] != 'online'
+    assert (breaker.state['pi']['state'] == 'open') is opens
+
+
+@pytest.mark.parametrize('returncode, opens', [(1, False), (255, True)])
+def test_async_path_matches(breaker, monkeypatch, returncode, opens):
+    async def run(*args, **kwargs):
+        return 'boom', returncode
+
+    async def sweep():
+        semaphore = asyncio.Semaphore(1)
+        for _ in range(2):
+            await central_collector.collect_system_async(HOST, semaphore)
+
+    monkeypatch.setattr(central_collector, 'run_ssh_command_async', run)
+    asyncio.run(sweep())
+    assert (breaker.state['pi']['state'] == 'open') is opens
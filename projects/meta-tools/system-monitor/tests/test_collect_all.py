@@ -0,0 +1,78 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import central_collector
+
+
+def ssh_system(host):
+    return {'hostname': host, 'display_name': host, 'type': 'linux', 'method': 'ssh',
+            'ssh_user': 'pi', 'ssh_host': f'{host}.local', 'services': []}
+
+
+@pytest.fixture(autouse=True)
+def fresh_breaker(tmp_path, monkeypatch):
+    monkeypatch.setattr(central_collector, 'BREAKER',
+                        central_collector.CircuitBreaker(path=tmp_path / 'breaker.json'))
+
+
+@pytest.fixture
+def release():
+    """Set at teardown so hung stub calls don't outlive the test."""
+    event = threading.Event()
+    yield event
+    event.set()
+
+
+def test_host_deadline_cuts_ssh_short(monkeypatch):
+    timeouts = []
+
+    def run_ssh_command(host, user, command, timeout=30, input=None):
+        timeouts.append(timeout)
+        time.sleep(timeout)  # a host that never answers
+        return "Timeout", None
+
+    monkeypatch.setattr(central_collector, 'run_ssh_command', run_ssh_command)
+    started = time.monotonic()
+    [result] = central_collector.collect_all([ssh_system('hung')], host_timeout=0.3, sweep_timeout=5)
+
+    assert time.monotonic() - started < 2
+    assert timeouts and timeouts[0] <= 0.3
+    assert result['metrics']['status'] == 'offline'
+    assert result['metrics']['error'] == 'Timeout'
+
+
+def test_sweep_returns_at_its_deadline_with_hung_hosts_offline(monkeypatch, release):
+    def run_ssh_command(host, user, command, timeout=30, input=None):
+        if host == 'hung.local':
+            release.wait(30)  # ignores its timeout entirely
+        return "ssh: connect refused", 255
+
+    monkeypatch.setattr(central_collector, 'run_ssh_command', run_ssh_command)
+    started = time.monotonic()
+    results = central_collector.collect_all([ssh_system('hung'), ssh_system('down')],
+                                            host_timeout=10, sweep_timeout=0.5)
+
+    assert time.monotonic() - started < 2
+    assert [r['system']['hostname'] for r in results] == ['hung', 'down']
+    hung, down = (r['metrics'] for r in results)
+    assert hung['status'] == 'offline' and hung['error'].startswith('Sweep timeout')
+    assert down['status'] == 'offline' and down['error'] == 'ssh: connect refused'
+
+
+def test_async_sweep_returns_at_its_deadline(monkeypatch):
+    async def run_ssh_command_async(host, user, command, timeout=30, input=None):
+        if host == 'hung.local':
+            await asyncio.sleep(30)
+        return "ssh: connect refused", 255
+
+    monkeypatch.setattr(central_collector, 'run_ssh_command_async', run_ssh_command_async)
+    started = time.monotonic()
+    results = asyncio.run(central_collector.collect_all_async(
+        [ssh_system('hung'), ssh_system('down')], host_timeout=10, sweep_timeout=0.5))
+
+    assert time.monotonic() - started < 2
+    assert [r['metrics']['status'] for r in results] == ['offline', 'offline']
+    assert results[0]['metrics']['error'].startswith('Sweep timeout')
@@ -0,0 +1,58 @@
+from collections import namedtuple
+from types import SimpleNamespace
+
+import pytest
+
+import monitor_agent
+
+# Linux's psutil.cpu_times() fields
+Times = namedtuple('Times', 'user nice system idle iowait irq softirq steal guest guest_nice')
+
+
+def cores(*per_core):
+    """Times per core from dicts of the non-zero fields."""
+    return [Times(**{field: values.get(field, 0) for field in Times._fields}) for values in per_core]
+
+
+@pytest.fixture
+def counters(monkeypatch):
+    """Feed the sampler one list of per-core times per read."""
+    readings = []
+    fake = SimpleNamespace(cpu_times=lambda percpu=False: readings.pop(0))
+    monkeypatch.setattr(monitor_agent, 'psutil', fake, raising=False)
+    return readings
+
+
+def sample(readings, before, after):
+    readings[:] = [before, after]
+    sampler = monitor_agent.CpuSampler(min_interval=0)
+    sampler.prime()
+    return sampler.sample()
+
+
+def test_total_and_per_core_from_deltas(counters):
+    before = cores({'user': 100, 'idle': 100}, {'user': 50, 'idle': 500})
+    after = cores({'user': 130, 'system': 0, 'idle': 110}, {'user': 50, 'idle': 540})
+    # core 0: 30 of 40 busy; core 1: idle; overall 30 of 80
+    assert sample(counters, before, after) == (37.5, [75.0, 0.0])
+
+
+def test_iowait_is_idle_and_guest_time_is_not_counted_twice(counters):
+    before = cores({'user': 10, 'idle': 10})
+    # 20 user ticks, all running a guest (also reported as guest); 10 idle, 10 waiting on disk.
+    # Counting guest twice would give 40 of 60 busy.
+    after = cores({'user': 30, 'guest': 20, 'idle': 20, 'iowait': 10})
+    assert sample(counters, before, after) == (50.0, [50.0])
+
+
+def test_each_sample_is_relative_to_the_previous_one(counters):
+    counters[:] = [cores({'idle': 0}), cores({'user': 10, 'idle': 10}), cores({'user': 40, 'idle': 10})]
+    sampler = monitor_agent.CpuSampler(min_interval=0)
+    assert sampler.sample() == (50.0, [50.0])  # primes on first use
+    assert sampler.sample() == (100.0, [100.0])
+
+
+def test_no_elapsed_ticks_and_cpu_hotplug(counters):
+    same = cores({'user': 5, 'idle': 5})
+    assert sample(counters, same, same) == (0.0, [0.0])
+    assert sample(counters, cores({'idle': 1}), cores({'idle': 2}, {'idle': 2})) == (None, [])
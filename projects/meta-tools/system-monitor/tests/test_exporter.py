@@ -0,0 +1,69 @@
+from central_collector import MetricsExporter
+
+
+def result(host, status='online', **metrics):
+    return {'system': {'hostname': host},
+            'metrics': {'hostname': host, 'status': status, **metrics},
+            'services': [], 'elapsed': None}
+
+
+def alert(host):
+    return {'hostname': host, 'type': 'cpu', 'severity': 'warning', 'message': f'{host} busy'}
+
+
+def sample(page, name):
+    lines = [line for line in page.decode().splitlines() if line.startswith(name + ' ')]
+    return [line.split(' ', 1)[1] for line in lines]
+
+
+def test_alerts_active_counts_every_host_not_just_the_last_batch():
+    exporter = MetricsExporter()
+    exporter.update([result('pi'), result('nas')], 1.5, [alert('pi'), alert('nas')])
+    # Only pi was due; nas keeps its alert
+    exporter.update([result('pi')], 0.5, [])
+    assert sample(exporter.page(), 'l7_alerts_active') == ['1']
+    assert sample(exporter.page(), 'l7_sweep_duration_seconds') == ['0.5']
+
+    exporter.update([result('nas')], 0.5, [])
+    assert sample(exporter.page(), 'l7_alerts_active') == ['0']
+
+
+def test_empty_page_is_just_eof():
+    assert MetricsExporter().page() == b'# EOF\n'
+
+
+def test_page_is_openmetrics_text():
+    exporter = MetricsExporter()
+    pi = result('pi', cpu_percent=12.5, system_type='linux')
+    pi['services'] = [{'service_name': 'n8n', 'is_running': True}]
+    pi['elapsed'] = 0.42
+    exporter.update([pi, result('nas', status='offline', cpu_percent=99)], 1.25, [])
+    lines = exporter.page().decode().split('\n')
+
+    assert lines[-2:] == ['# EOF', '']
+    assert lines.count('# EOF') == 1
+    assert 'l7_host_up{host="pi",type="linux"} 1' in lines
+    assert 'l7_host_up{host="nas",type=""} 0' in lines
+    assert 'l7_host_cpu_percent{host="pi"} 12.5' in lines
+    assert not any(line.startswith('l7_host_cpu_percent{host="nas"') for line in lines)
+    assert 'l7_service_up{host="pi",service="n8n"} 1' in lines
+    assert 'l7_host_collection_seconds{host="pi"} 0.42' in lines
+    assert 'l7_sweep_duration_seconds 1.25' in lines
+
+    # Every sample belongs to a family announced with HELP and TYPE
+    families = {line.split()[2] for line in lines if line.startswith('# TYPE ')}
+    assert families == {line.split()[2] for line in lines if line.startswith('# HELP ')}
+    for line in lines:
+        if line and not line.startswith('#'):
+            name = line.split('{')[0].split(' ')[0]
+            assert name in families or name.rsplit('_', 1)[0] in families
+
+
+def test_label_values_are_escaped():
+    exporter = MetricsExporter()
+    odd = 'we"ird\\host\nname'
+    exporter.update([result(odd, cpu_percent=1.0)], None, [])
+    page = exporter.page().decode()
+
+    assert 'l7_host_cpu_percent{host="we\\"ird\\\\host\\nname"} 1.0\n' in page
+    assert 'l7_sweep_duration_seconds' not in page  # unknown duration is left out
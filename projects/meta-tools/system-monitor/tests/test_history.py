@@ -0,0 +1,91 @@
+import os
+from datetime import datetime, timezone
+
+import pytest
+
+from central_collector import HistoryStore
+
+T0 = 1_700_000_000 - 1_700_000_000 % 3600
+
+
+def sweep(host, **metrics):
+    return [{'metrics': {'hostname': host, 'status': 'online', **metrics}}]
+
+
+def make_store(tmp_path):
+    return HistoryStore(directory=tmp_path / 'history', metrics=('cpu_percent',))
+
+
+def test_minute_bucket_becomes_a_rollup_row(tmp_path):
+    store = make_store(tmp_path)
+    for i, value in enumerate(range(1, 21)):
+        assert store.record(sweep('pi', cpu_percent=value), now=T0 + i) == []
+
+    rows = store.record(sweep('pi', cpu_percent=50), now=T0 + 60)
+    assert rows == [{
+        'hostname': 'pi', 'metric': 'cpu_percent', 'resolution': '1m',
+        'bucket_start': '2023-11-14T22:00:00', 'sample_count': 20,
+        'min_value': 1.0, 'max_value': 20.0, 'avg_value': 10.5, 'p95_value': 19.0,
+    }]
+    # The same bucket is in the 1m tier for local queries
+    assert store.query('pi', 'cpu_percent', tier='1m') == {
+        'ts': [T0], 'avg': [10.5], 'min': [1.0], 'max': [20.0]}
+    store.close()
+
+
+def test_hour_bucket_and_silent_hosts_are_closed(tmp_path):
+    store = make_store(tmp_path)
+    store.record(sweep('pi', cpu_percent=10), now=T0)
+    store.record(sweep('pi', cpu_percent=30), now=T0 + 30)
+
+    # Nothing from pi for two hours: both open buckets are flushed
+    rows = store.record(sweep('nas', cpu_percent=5), now=T0 + 7200)
+    assert {(r['hostname'], r['resolution'], r['sample_count'], r['avg_value'], r['p95_value'])
+            for r in rows} == {('pi', '1m', 2, 20.0, 30.0), ('pi', '1h', 2, 20.0, 30.0)}
+    assert store.record(sweep('nas', cpu_percent=5), now=T0 + 7201) == []
+    store.close()
+
+
+def test_offline_hosts_are_not_recorded(tmp_path):
+    store = make_store(tmp_path)
+    store.record([{'metrics': {'hostname': 'pi', 'status': 'offline', 'cpu_percent': 1}}], now=T0)
+    assert store.stats('pi', 'cpu_percent', now=T0) is None
+    store.close()
+
+
+def test_many_hosts_fit_in_a_low_fd_limit(tmp_path):
+    resource = pytest.importorskip('resource')
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    in_use = len(os.listdir('/proc/self/fd')) if os.path.isdir('/proc/self/fd') else 64
+    store = HistoryStore(directory=tmp_path / 'history', max_open=24)
+    # 40 hosts x 4 metrics x 3 tiers = 480 ring files, far more than the limit
+    resource.setrlimit(resource.RLIMIT_NOFILE, (in_use + 40, hard))
+    try:
+        sweep_all = [{'metrics': {'hostname': f'host-{i}', 'status': 'online', 'cpu_percent': 1,
+                                  'memory_percent': 2, 'disk_percent': 3, 'load_avg_1m': 0.5}}
+                     for i in range(40)]
+        store.record(sweep_all, now=T0)
+        rows = store.record(sweep_all, now=T0 + 60)
+        assert store.stats('host-0', 'disk_percent', now=T0 + 60)['avg'] == 3
+    finally:
+        store.close()
+        resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+    assert len(rows) == 40 * 4  # one 1m bucket per host and metric
+
+
+def test_every_pushed_sample_is_recorded_at_its_own_time(tmp_path):
+    store = make_store(tmp_path)
+    samples = [{'hostname': 'pi', 'status': 'online', 'cpu_percent': value,
+                'timestamp': datetime.fromtimestamp(T0 + i * 15, timezone.utc).replace(tzinfo=None).isoformat()}
+               for i, value in enumerate((10, 20, 30, 40))]
+    pushed = [{'metrics': samples[-1], 'samples': samples}]
+
+    assert store.record(pushed, now=T0 + 50) == []
+    assert store.query('pi', 'cpu_percent') == {
+        'ts': [T0, T0 + 15, T0 + 30, T0 + 45], 'value': [10.0, 20.0, 30.0, 40.0]}
+
+    # A sweep with nothing new pushed records nothing
+    rows = store.record([{'metrics': samples[-1], 'samples': []}], now=T0 + 70)
+    assert rows == []
+    assert len(store.query('pi', 'cpu_percent')['ts']) == 4
+    store.close()
@@ -0,0 +1,47 @@
+import monitor_agent
+
+
+def make_facts(ttl=3600):
+    """HostFacts whose detection returns a new hostname each time it runs."""
+    facts = monitor_agent.HostFacts(ttl=ttl)
+    detected = []
+
+    def detect():
+        detected.append(None)
+        return {'hostname': f'host-{len(detected)}', 'system_type': 'linux', 'cpu_count': 4, 'boot_time': None}
+
+    facts._detect = detect
+    return facts, detected
+
+
+def test_facts_are_detected_once_per_ttl():
+    facts, detected = make_facts(ttl=3600)
+    assert facts.get(now=100)['hostname'] == 'host-1'
+    assert facts.get(now=3699)['hostname'] == 'host-1'
+    assert len(detected) == 1
+    assert facts.get(now=3700)['hostname'] == 'host-2'
+    assert facts.get(now=3701)['hostname'] == 'host-2'
+    assert len(detected) == 2
+
+
+def test_invalidate_redetects_on_next_access():
+    facts, detected = make_facts(ttl=3600)
+    facts.get(now=100)
+    facts.invalidate()
+    assert len(detected) == 1  # nothing happens until the facts are read
+    assert facts.get(now=101)['hostname'] == 'host-2'
+    assert facts.get(now=102)['hostname'] == 'host-2'
+
+
+def test_invalidate_works_as_a_signal_handler():
+    facts, detected = make_facts()
+    facts.get(now=0)
+    facts.invalidate(1, None)  # (signum, frame)
+    assert facts.get(now=1)['hostname'] == 'host-2'
+
+
+def test_detect_reports_this_host():
+    facts = monitor_agent.HostFacts()._detect()
+    assert facts['hostname'] == monitor_agent.socket.gethostname()
+    assert facts['system_type'] == monitor_agent.detect_system_type()
+    assert facts['cpu_count'] >= 1
@@ -0,0 +1,96 @@
+import json
+import urllib.error
+import urllib.request
+
+import pytest
+
+import central_collector
+from central_collector import IngestStore
+
+PUSH = {'hostname': 'pi', 'display_name': 'Pi', 'type': 'linux', 'method': 'push'}
+
+
+@pytest.fixture(autouse=True)
+def push_system(monkeypatch):
+    monkeypatch.setattr(central_collector, 'SYSTEMS', [PUSH])
+
+
+def batch(*stamps):
+    return {'hostname': 'pi', 'samples': [{'ts': ts, 'metrics': {'cpu_percent': ts % 100}} for ts in stamps]}
+
+
+def test_every_sample_is_collected_once():
+    store = IngestStore(stale=60)
+    assert store.ingest(batch(1000, 1010)) == 2
+    assert store.ingest(batch(1020)) == 1
+
+    result = store.collect(PUSH, now=1025)
+    assert result['metrics']['cpu_percent'] == 20
+    assert [m['cpu_percent'] for m in result['samples']] == [0, 10, 20]
+    assert all(m['status'] == 'online' and m['hostname'] == 'pi' for m in result['samples'])
+
+    # Nothing new: still online, but nothing more to store
+    result = store.collect(PUSH, now=1030)
+    assert result['metrics']['status'] == 'online'
+    assert result['samples'] == []
+
+
+def test_retried_samples_are_skipped():
+    store = IngestStore(stale=60)
+    store.ingest(batch(1000, 1010))
+    assert store.ingest(batch(1000, 1010, 1020)) == 1
+    assert [m['cpu_percent'] for m in store.collect(PUSH, now=1020)['samples']] == [0, 10, 20]
+
+
+def test_stale_host_is_offline():
+    store = IngestStore(stale=60)
+    store.ingest(batch(1000))
+    assert store.collect(PUSH, now=1100)['metrics']['status'] != 'online'
+
+
+@pytest.mark.parametrize('body', [
+    [1, 2],
+    'pi',
+    {'hostname': 'pi', 'samples': []},
+    {'hostname': 'pi', 'samples': [{'metrics': {}}]},
+    {'hostname': 'pi', 'samples': [{'ts': 'soon', 'metrics': {}}]},
+    {'hostname': 'pi', 'samples': [{'ts': 1}]},
+])
+def test_malformed_batches_are_rejected(body):
+    with pytest.raises(ValueError):
+        IngestStore().ingest(body)
+
+
+def test_unknown_host_is_rejected():
+    with pytest.raises(KeyError):
+        IngestStore().ingest({'hostname': 'nas', 'samples': []})
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setattr(central_collector, 'INGEST_TOKEN', 'secret')
+    monkeypatch.setattr(central_collector, 'INGEST', IngestStore())
+    server = central_collector.start_http_server(0, host='127.0.0.1')
+    yield f'http://127.0.0.1:{server.server_address[1]}/ingest'
+    server.shutdown()
+    server.server_close()
+
+
+def post(url, body):
+    request = urllib.request.Request(url, data=json.dumps(body).encode(), headers={
+        'X-Ingest-Token': 'secret', 'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(request, timeout=5) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+@pytest.mark.parametrize('body, status', [
+    (batch(1000), 202),
+    ([batch(1000)], 400),
+    ({'hostname': 'pi', 'samples': [{'metrics': {}}]}, 400),
+    ({'hostname': 'nas', 'samples': [{'ts': 1, 'metrics': {}}]}, 404),
+])
+def test_ingest_endpoint_status(server, body, status):
+    assert post(server, body) == status
@@ -0,0 +1,38 @@
+import monitor_agent
+
+
+def make_address(monkeypatch, fingerprints, ttl=300):
+    """A LocalAddress whose interfaces read as each of fingerprints in turn."""
+    resolved = []
+
+    def get_local_ip():
+        resolved.append(len(resolved))
+        return f'10.0.0.{len(resolved)}'
+
+    monkeypatch.setattr(monitor_agent, 'get_local_ip', get_local_ip)
+    address = monitor_agent.LocalAddress(ttl=ttl)
+    readings = iter(fingerprints)
+    address._fingerprint = lambda: next(readings)
+    return address, resolved
+
+
+def test_address_is_cached_until_the_interfaces_change(monkeypatch):
+    eth = (('eth0', ('10.0.0.1',)),)
+    wifi = (('eth0', ('10.0.0.1',)), ('wlan0', ('192.168.1.5',)))
+    address, resolved = make_address(monkeypatch, [eth, eth, eth, wifi, wifi])
+
+    assert [address.get(now=t) for t in (0, 1, 10_000)] == ['10.0.0.1'] * 3
+    assert len(resolved) == 1  # unchanged interfaces: never re-resolved, whatever the age
+    assert address.get(now=10_001) == '10.0.0.2'
+    assert address.get(now=10_002) == '10.0.0.2'
+    assert len(resolved) == 2
+
+
+def test_without_psutil_the_address_is_refreshed_after_ttl(monkeypatch):
+    address, resolved = make_address(monkeypatch, [None] * 4, ttl=300)
+
+    assert address.get(now=0) == '10.0.0.1'
+    assert address.get(now=300) == '10.0.0.1'
+    assert address.get(now=301) == '10.0.0.2'
+    assert address.get(now=302) == '10.0.0.2'
+    assert len(resolved) == 2
@@ -0,0 +1,73 @@
+import pytest
+
+import central_collector
+import monitor_agent
+
+
+@pytest.fixture
+def writes(monkeypatch):
+    """Record (table, op, rows, on_conflict) per write; set .down to fail them."""
+    calls = []
+
+    def write_rows(table, op, rows, on_conflict=None):
+        if write_rows.down:
+            raise ConnectionError('offline')
+        calls.append((table, op, [row['n'] for row in rows], on_conflict))
+
+    write_rows.down = False
+    monkeypatch.setattr(central_collector, 'write_rows', write_rows)
+    return calls, write_rows
+
+
+def make_writer(tmp_path, **kwargs):
+    return central_collector.MetricsWriter(spool=monitor_agent.Spool(directory=tmp_path / 'spool'), **kwargs)
+
+
+def test_flushes_once_enough_rows_are_pending(tmp_path):
+    writer = make_writer(tmp_path, max_rows=3, max_age=60)
+    assert not writer.should_flush()
+    writer.add('system_metrics', [{'n': 1}, {'n': 2}])
+    writer.add('system_metrics', [])
+    assert writer.pending() == 2 and not writer.should_flush()
+    writer.add('system_metrics_rollup', [{'n': 3}], op='upsert', on_conflict='k')
+    assert writer.should_flush()
+
+
+def test_flushes_once_the_oldest_row_is_old_enough(tmp_path):
+    writer = make_writer(tmp_path, max_rows=500, max_age=60)
+    writer.add('system_metrics', [{'n': 1}])
+    oldest = writer._oldest
+    writer.add('system_metrics', [{'n': 2}])  # a later row doesn't reset the age
+    assert writer._oldest == oldest
+    assert not writer.should_flush(now=oldest + 59.9)
+    assert writer.should_flush(now=oldest + 60)
+
+
+def test_flush_writes_each_table_in_one_request(tmp_path, writes):
+    calls, _ = writes
+    writer = make_writer(tmp_path)
+    writer.add('system_metrics', [{'n': 1}])
+    writer.add('system_metrics_rollup', [{'n': 2}], op='upsert', on_conflict='k')
+    writer.add('system_metrics', [{'n': 3}, {'n': 4}])
+
+    assert writer.flush()
+    assert calls == [('system_metrics', 'insert', [1, 3, 4], None),
+                     ('system_metrics_rollup', 'upsert', [2], 'k')]
+    assert writer.pending() == 0 and not writer.should_flush(now=float('inf'))
+
+
+def test_failed_rows_are_replayed_ahead_of_new_ones(tmp_path, writes):
+    calls, write_rows = writes
+    writer = make_writer(tmp_path)
+    write_rows.down = True
+    writer.add('system_metrics', [{'n': 1}])
+    assert not writer.flush()
+    writer.add('system_metrics', [{'n': 2}])
+    assert not writer.flush()  # still down: queued behind the backlog
+    assert calls == []
+
+    write_rows.down = False
+    writer.add('system_metrics', [{'n': 3}])
+    assert writer.flush()
+    assert [n for call in calls for n in call[2]] == [1, 2, 3]
+    assert not writer.spool.pending()
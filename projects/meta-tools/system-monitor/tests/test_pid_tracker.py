@@ -0,0 +1,100 @@
+import contextlib
+from types import SimpleNamespace
+
+import monitor_agent
+
+
+class FakeProc:
+    """A process whose CPU time grows by `step` seconds per reading."""
+
+    def __init__(self, pid, step=0.5):
+        self.pid = pid
+        self.step = step
+        self.seconds = 0.0
+
+    @contextlib.contextmanager
+    def oneshot(self):
+        yield
+
+    def cpu_times(self):
+        self.seconds += self.step
+        return SimpleNamespace(user=self.seconds, system=0.0)
+
+    def memory_info(self):
+        return SimpleNamespace(rss=64 * 1024**2)
+
+    def num_threads(self):
+        return 4
+
+    def num_fds(self):
+        return 10
+
+
+def make_index(procs):
+    index = monitor_agent.ProcessIndex.__new__(monitor_agent.ProcessIndex)
+    index.procs, index.by_name = [], {}
+    for pid, name, created in procs:
+        index.add({'name': name, 'cmdline': [name], 'create_time': created, 'proc': FakeProc(pid)})
+    return index
+
+
+SERVICES = {'test': [{'name': 'Node', 'process': 'node'}]}
+
+
+def use_fake_host(monkeypatch, index):
+    """Point prime_counters()/get_service_status() at a fake process table."""
+    snapshots = []
+
+    def service_index():
+        snapshots.append(index)
+        return index
+
+    monkeypatch.setattr(monitor_agent, 'HAS_PSUTIL', True)
+    monkeypatch.setattr(monitor_agent, 'SERVICES_CONFIG', SERVICES)
+    monkeypatch.setattr(monitor_agent, 'PID_TRACKER', monitor_agent.PidTracker(min_interval=0))
+    monkeypatch.setattr(monitor_agent, 'service_index', service_index)
+    monkeypatch.setattr(monitor_agent.CPU_SAMPLER, 'prime', lambda: None)
+    monkeypatch.setattr(monitor_agent.HOST_FACTS, 'get',
+                        lambda: {'hostname': 'box', 'system_type': 'test'})
+    return snapshots
+
+
+def test_first_tick_reuses_the_primed_snapshot(monkeypatch):
+    snapshots = use_fake_host(monkeypatch, make_index([(10, 'node', 1.0), (11, 'node', 1.0)]))
+
+    index = monitor_agent.prime_counters()
+    [status] = monitor_agent.get_service_status(monitor_agent.SERVICES_CONFIG, index)
+
+    assert len(snapshots) == 1
+    assert status['process_count'] == 2
+    # The baseline taken while priming gives the first tick a CPU reading
+    assert status['cpu_percent'] is not None and status['cpu_percent'] > 0
+    assert status['memory_mb'] == 128.0
+    assert (status['threads'], status['open_fds']) == (8, 20)
+
+
+def test_main_hands_the_primed_snapshot_to_run_once(monkeypatch):
+    index = make_index([(10, 'node', 1.0)])
+    snapshots = use_fake_host(monkeypatch, index)
+    seen = []
+    monkeypatch.setattr(monitor_agent, 'run_once', lambda index=None: seen.append(index))
+
+    monitor_agent.main()
+
+    assert seen == [index]
+    assert len(snapshots) == 1
+
+
+def test_without_a_baseline_cpu_is_unknown_and_recycled_pids_start_over(monkeypatch):
+    use_fake_host(monkeypatch, None)
+    tracker = monitor_agent.PID_TRACKER
+
+    first = make_index([(10, 'node', 1.0)])
+    _, matches = monitor_agent.match_services(SERVICES, first)
+    assert tracker.sample(matches)['Node']['cpu_percent'] is None
+    assert tracker.sample(matches)['Node']['cpu_percent'] > 0
+
+    # Same PID, new create_time: a different process, so no delta yet
+    recycled = make_index([(10, 'node', 2.0)])
+    _, matches = monitor_agent.match_services(SERVICES, recycled)
+    assert tracker.sample(matches)['Node']['cpu_percent'] is None
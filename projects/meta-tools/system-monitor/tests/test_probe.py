@@ -0,0 +1,72 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from central_collector import PROBE_SCRIPT, PROBE_VERSION, parse_probe_output, probe_result
+
+SYSTEM = {'hostname': 'pi', 'display_name': 'Pi', 'type': 'linux', 'method': 'ssh',
+          'ssh_user': 'pi', 'ssh_host': 'pi.local', 'services': ['NoSuchService']}
+
+
+def run_probe(tmp_path):
+    """Run PROBE_SCRIPT here the way a host runs it, with psutil hidden so ProcHost answers."""
+    hidden = tmp_path / 'hide-psutil'
+    hidden.mkdir(exist_ok=True)
+    (hidden / 'psutil.py').write_text("raise ImportError('hidden for the test')\n")
+    env = {**os.environ, 'HOME': str(tmp_path), 'PYTHONPATH': str(hidden)}
+    result = subprocess.run([sys.executable, '-', *SYSTEM['services']], input=PROBE_SCRIPT,
+                            capture_output=True, text=True, env=env, timeout=30)
+    assert result.returncode == 0, result.stderr
+    return result.stdout
+
+
+@pytest.mark.skipif(not os.path.exists('/proc/stat'), reason='ProcHost reads /proc')
+def test_probe_runs_on_proc_and_parses(tmp_path):
+    # The first run primes the saved counters; the second measures against them
+    for _ in range(2):
+        metrics, services = parse_probe_output(SYSTEM, run_probe(tmp_path))
+
+    assert (tmp_path / '.cache' / 'l7-probe' / 'state.json').exists()
+    assert metrics['hostname'] == 'pi' and metrics['status'] == 'online'
+    assert 0 <= metrics['cpu_percent'] <= 100
+    assert len(metrics['cpu_per_core']) == os.cpu_count()
+    assert 0 < metrics['memory_percent'] <= 100
+    assert metrics['disk_total_gb'] > 0 and metrics['process_count'] > 0
+    assert services == [{'service_name': 'NoSuchService', 'is_running': False, 'process_count': 0,
+                         'cpu_percent': None, 'memory_mb': None}]
+
+
+def document(version=PROBE_VERSION):
+    return json.dumps({'probe_version': version, 'metrics': {'cpu_percent': 12.5}, 'services': []})
+
+
+def test_current_version_parses():
+    metrics, services = parse_probe_output(SYSTEM, document())
+    assert metrics['cpu_percent'] == 12.5 and services == []
+
+
+@pytest.mark.parametrize('output, message', [
+    (document(PROBE_VERSION - 1), 'Unsupported probe version'),
+    (document(PROBE_VERSION + 1), 'Unsupported probe version'),
+    (document()[:20], 'Invalid probe output'),       # cut off mid-document
+    ('', 'Invalid probe output'),
+    ('Traceback (most recent call last):', 'Invalid probe output'),
+    ('[1, 2, 3]', 'Unsupported probe version'),
+    ('null', 'Unsupported probe version'),
+])
+def test_bad_output_is_rejected(output, message):
+    with pytest.raises(ValueError, match=message):
+        parse_probe_output(SYSTEM, output)
+
+    # SSH worked, so the host stays online with the probe error attached
+    metrics, services = probe_result(SYSTEM, output, True)
+    assert metrics['status'] == 'online' and metrics['error'].startswith(message)
+    assert services == []
+
+
+def test_failed_ssh_is_offline():
+    metrics, _ = probe_result(SYSTEM, 'ssh: connect refused', False)
+    assert metrics['status'] == 'offline' and metrics['error'] == 'ssh: connect refused'
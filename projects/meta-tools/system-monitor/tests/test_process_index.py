@@ -0,0 +1,45 @@
+import monitor_agent
+
+
+def make_index(table):
+    index = monitor_agent.ProcessIndex.__new__(monitor_agent.ProcessIndex)
+    index.procs, index.by_name = [], {}
+    for name, cmdline in table:
+        index.add({'name': name, 'cmdline': cmdline})
+    return index
+
+
+TABLE = [
+    ('node', ['node', '/opt/n8n/bin/n8n']),
+    ('Docker Desktop', ['Docker Desktop']),
+    ('node', ['node', 'server.js', '--mcp']),
+    ('bash', ['bash']),
+    ('com.docker.backend', ['com.docker.backend']),
+]
+
+
+def names(infos):
+    return [(info['name'], info['cmdline'][-1]) for info in infos]
+
+
+def test_name_substring_is_case_insensitive_and_in_snapshot_order():
+    matches = make_index(TABLE).match([('Docker', 'Docker', None), ('Node', 'node', None)])
+    assert names(matches['Docker']) == [('Docker Desktop', 'Docker Desktop'),
+                                        ('com.docker.backend', 'com.docker.backend')]
+    assert names(matches['Node']) == [('node', '/opt/n8n/bin/n8n'), ('node', '--mcp')]
+
+
+def test_cmdline_rules():
+    matches = make_index(TABLE).match([('n8n', 'n8n', 'n8n'), ('MCP', 'nomatch', 'mcp')])
+    assert names(matches['n8n']) == [('node', '/opt/n8n/bin/n8n')]
+    assert names(matches['MCP']) == [('node', '--mcp')]
+
+
+def test_unmatched_rule_and_empty_table():
+    assert make_index(TABLE).match([('Ollama', 'ollama', None)]) == {'Ollama': []}
+    assert make_index([]).match([('Node', 'node', 'x')]) == {'Node': []}
+
+
+def test_process_matched_by_name_and_cmdline_is_listed_once():
+    matches = make_index(TABLE).match([('Node', 'node', 'node')])
+    assert len(matches['Node']) == 2
@@ -0,0 +1,34 @@
+import urllib.error
+
+import pytest
+
+import monitor_agent
+
+
+def failing_push(monkeypatch, error):
+    def urlopen(request, timeout=None):
+        raise error
+    monkeypatch.setattr(monitor_agent.urllib.request, 'urlopen', urlopen)
+
+    pusher = monitor_agent.Pusher('http://collector/ingest', token='t', batch=1)
+    pusher.add({'ts': 1.0, 'metrics': {'cpu_percent': 1.0}, 'services': []})
+    return pusher
+
+
+def http_error(code):
+    return urllib.error.HTTPError('http://collector/ingest', code, 'error', {}, None)
+
+
+@pytest.mark.parametrize('code', [400, 403, 404, 413])
+def test_rejected_batch_is_dropped(monkeypatch, code):
+    pusher = failing_push(monkeypatch, http_error(code))
+    assert pusher.flush() is False
+    assert not pusher.queue
+
+
+@pytest.mark.parametrize('error', [http_error(500), http_error(503), http_error(429),
+                                   urllib.error.URLError('connection refused')])
+def test_batch_is_kept_for_retry(monkeypatch, error):
+    pusher = failing_push(monkeypatch, error)
+    assert pusher.flush() is False
+    assert len(pusher.queue) == 1
@@ -0,0 +1,123 @@
+import json
+import os
+
+import pytest
+
+import monitor_agent
+
+
+def engine(tmp_path, rules):
+    return monitor_agent.RuleEngine(rules, history_path=tmp_path / 'rule_history.json')
+
+
+def host(**metrics):
+    return {'metrics': {'hostname': 'web', 'status': 'online', **metrics}, 'services': []}
+
+
+@pytest.mark.parametrize('expression', [
+    "__import__('os').system('true')",
+    'cpu_percent.__class__',
+    'cpu_percent if status else 0',
+    '[cpu_percent][0] > 1',
+    '(lambda: 1)()',
+    'len(hostname) > 1',
+    'rate(1 + 2) > 1',
+])
+def test_unsafe_or_unsupported_expressions_are_rejected(tmp_path, expression):
+    with pytest.raises((ValueError, SyntaxError)):
+        engine(tmp_path, [{'type': 't', 'when': expression}])
+
+
+def test_host_rules_fire_with_severity(tmp_path):
+    rules = engine(tmp_path, [
+        {'type': 'high_cpu', 'when': 'cpu_percent > 90', 'critical': 'cpu_percent > 95',
+         'metric': 'cpu_percent', 'threshold': 90, 'message': 'CPU {cpu_percent}% on {hostname}'},
+    ])
+    assert rules.evaluate([host(cpu_percent=50)]) == []
+    [warning] = rules.evaluate([host(cpu_percent=92)])
+    assert warning['severity'] == 'warning'
+    assert warning['message'] == 'CPU 92% on web'
+    assert warning['value'] == 92
+    [critical] = rules.evaluate([host(cpu_percent=99)])
+    assert critical['severity'] == 'critical'
+
+
+def test_missing_metrics_never_fire(tmp_path):
+    rules = engine(tmp_path, [{'type': 'disk', 'when': 'disk_percent > 80', 'metric': 'disk_percent'}])
+    assert rules.evaluate([host(disk_percent=None)]) == []
+    assert rules.evaluate([host()]) == []
+
+
+def test_offline_hosts_only_match_offline_rules(tmp_path):
+    rules = engine(tmp_path, [
+        {'type': 'offline', 'when': "status == 'offline'", 'offline': True},
+        {'type': 'cpu', 'when': 'cpu_percent > 0'},
+    ])
+    offline = {'metrics': {'hostname': 'web', 'status': 'offline', 'cpu_percent': 5}}
+    assert [a['type'] for a in rules.evaluate([offline])] == ['offline']
+
+
+def test_service_rules_with_globs(tmp_path):
+    rules = engine(tmp_path, [
+        {'type': 'down', 'scope': 'service', 'when': 'not is_running', 'services': ['ng*']},
+    ])
+    data = host()
+    data['services'] = [{'service_name': 'nginx', 'is_running': False},
+                        {'service_name': 'redis', 'is_running': False},
+                        {'service_name': 'ngrok', 'is_running': True}]
+    assert [(a['type'], a['service']) for a in rules.evaluate([data])] == [('down', 'nginx')]
+
+
+def test_host_globs(tmp_path):
+    rules = engine(tmp_path, [{'type': 'cpu', 'when': 'cpu_percent > 0', 'hosts': ['db*']}])
+    assert rules.evaluate([host(cpu_percent=5)]) == []
+
+
+def test_rate_is_change_per_hour(tmp_path):
+    rules = engine(tmp_path, [{'type': 'filling', 'when': 'rate(disk_percent) > 1'}])
+    assert rules.evaluate([host(disk_percent=50)], now=0) == []
+    assert [a['type'] for a in rules.evaluate([host(disk_percent=52)], now=3600)] == ['filling']
+
+
+def test_non_numeric_value_expression_is_not_rounded(tmp_path):
+    rules = engine(tmp_path, [
+        {'type': 'state', 'when': "status == 'online'", 'value': 'status', 'message': '{hostname} is {value}'},
+        {'type': 'flag', 'when': 'cpu_percent > 1', 'value': 'cpu_percent > 1'},
+    ])
+    alerts = {a['type']: a for a in rules.evaluate([host(cpu_percent=5)])}
+    assert alerts['state']['value'] == 'online'
+    assert alerts['state']['message'] == 'web is online'
+    assert alerts['flag']['value'] is True
+
+
+def write_rules_file(content):
+    path = os.environ['MONITOR_ALERT_RULES']
+    with open(path, 'w') as f:
+        f.write(content)
+    return path
+
+
+@pytest.mark.parametrize('content', [
+    '{"type": ',                                           # not JSON
+    json.dumps([{'type': 'x', 'when': "__import__('os')"}]),  # fails the whitelist
+    json.dumps([{'type': 'x', 'when': 'cpu_percent >'}]),  # syntax error
+    json.dumps([{'when': 'cpu_percent > 1'}]),             # no type
+    json.dumps({'type': 'x'}),                             # not a list
+])
+def test_broken_rules_file_falls_back_to_defaults(tmp_path, content, capsys):
+    path = write_rules_file(content)
+    try:
+        rules = monitor_agent.RuleEngine(history_path=tmp_path / 'rule_history.json')
+    finally:
+        os.remove(path)
+    assert [r['type'] for r in rules.rules] == [r['type'] for r in monitor_agent.DEFAULT_ALERT_RULES]
+    assert 'using the built-in rules' in capsys.readouterr().out
+
+
+def test_collector_passes_its_own_default_rules(tmp_path):
+    import central_collector
+
+    rules = monitor_agent.RuleEngine(history_path=tmp_path / 'rule_history.json',
+                                     default_rules=central_collector.DEFAULT_ALERT_RULES)
+    assert [r['type'] for r in rules.rules] == [r['type'] for r in central_collector.DEFAULT_ALERT_RULES]
+    assert 'system_offline' in [r['type'] for r in central_collector.RULE_ENGINE.rules]
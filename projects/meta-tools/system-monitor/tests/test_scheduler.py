@@ -0,0 +1,136 @@
+import random
+
+import pytest
+
+from central_collector import Scheduler
+
+PI = {'hostname': 'pi', 'method': 'ssh'}
+NAS = {'hostname': 'nas', 'method': 'ssh', 'interval': 30}
+
+
+def make_scheduler(systems=(PI,), jitter=0.0, **kwargs):
+    kwargs.setdefault('adaptive', False)
+    return Scheduler(list(systems), default_interval=10, jitter=jitter, rules=[], **kwargs)
+
+
+def test_ticks_are_fixed_rate_from_the_anchor():
+    scheduler = make_scheduler([PI, NAS])
+    anchor = scheduler.hosts['pi']['nominal']
+    assert scheduler.due(anchor) == [PI, NAS]
+
+    # A 3s collection doesn't push the next tick back
+    scheduler.advance('pi', now=anchor + 3)
+    assert scheduler.hosts['pi']['due'] == anchor + 10
+    assert PI not in scheduler.due(anchor + 9.9)
+    assert PI in scheduler.due(anchor + 10)
+
+    # Per-system interval
+    nas_anchor = scheduler.hosts['nas']['nominal']
+    scheduler.advance('nas', now=nas_anchor + 1)
+    assert scheduler.hosts['nas']['due'] == nas_anchor + 30
+
+
+def test_overrun_skips_missed_ticks_instead_of_bunching():
+    scheduler = make_scheduler()
+    anchor = scheduler.hosts['pi']['nominal']
+    # The ticks at +10 and +20 passed during the collection
+    scheduler.advance('pi', now=anchor + 25)
+    assert scheduler.hosts['pi']['due'] == anchor + 30
+    assert scheduler.hosts['pi']['skipped'] == 2
+
+
+def test_jitter_stays_within_bounds_and_does_not_accumulate():
+    random.seed(7)
+    scheduler = make_scheduler(jitter=0.1)
+    anchor = scheduler.hosts['pi']['nominal']
+    for k in range(1, 50):
+        scheduler.advance('pi', now=anchor + 10 * k - 9)
+        host = scheduler.hosts['pi']
+        assert host['nominal'] == pytest.approx(anchor + 10 * k)
+        assert host['nominal'] <= host['due'] <= host['nominal'] + 1.0
+    assert scheduler.hosts['pi']['skipped'] == 0
+
+
+def test_held_host_is_not_due_until_advanced():
+    scheduler = make_scheduler()
+    anchor = scheduler.hosts['pi']['nominal']
+    scheduler.hold('pi')
+    assert scheduler.due(anchor + 1000) == []
+    scheduler.advance('pi', now=anchor + 1)
+    assert scheduler.next_wakeup() == anchor + 10
+
+
+RULES = [{'metric': 'cpu_percent', 'threshold': 90}]
+
+
+def online(cpu, services=()):
+    return {'metrics': {'status': 'online', 'cpu_percent': cpu},
+            'services': [{'service_name': name, 'is_running': up} for name, up in services]}
+
+
+OFFLINE = {'metrics': {'status': 'offline'}, 'services': []}
+
+
+def make_adaptive(systems=(PI,)):
+    return Scheduler(list(systems), default_interval=10, jitter=0.0, adaptive=True, rules=RULES)
+
+
+def poll(scheduler, result, now, hostname='pi'):
+    """Collect a host at now; returns its new interval and checks it re-anchored there."""
+    scheduler.advance(hostname, result, now=now)
+    host = scheduler.hosts[hostname]
+    assert host['due'] == pytest.approx(now + host['interval'])
+    return host['interval']
+
+
+def test_stable_host_stretches_gradually_up_to_the_cap():
+    scheduler = make_adaptive()
+    now = scheduler.hosts['pi']['nominal']
+    intervals = []
+    for _ in range(6):
+        intervals.append(poll(scheduler, online(20.0), now))
+        now += intervals[-1]
+    assert intervals == [10, 15, 22.5, 33.75, 40, 40]
+
+
+def test_breach_snaps_back_to_the_hot_interval():
+    scheduler = make_adaptive()
+    now = scheduler.hosts['pi']['nominal']
+    for _ in range(4):
+        now += poll(scheduler, online(20.0), now)
+    assert scheduler.hosts['pi']['interval'] == 33.75
+
+    # Moving to within ADAPTIVE_MARGIN of the threshold: 10 / ADAPTIVE_HOT_FACTOR, floored at 5
+    intervals = [poll(scheduler, online(95.0), now)]
+    for _ in range(4):
+        now += intervals[-1]
+        intervals.append(poll(scheduler, online(95.0), now))
+    # Hot for ADAPTIVE_HOT_POLLS polls, then stretching again from the base
+    assert intervals == [5, 5, 5, 5, 15]
+
+
+def test_service_flap_makes_the_host_hot():
+    scheduler = make_adaptive()
+    now = scheduler.hosts['pi']['nominal']
+    now += poll(scheduler, online(20.0, [('n8n', True)]), now)
+    now += poll(scheduler, online(20.0, [('n8n', True)]), now)
+    assert poll(scheduler, online(20.0, [('n8n', False)]), now) == 5
+
+
+def test_offline_host_backs_off_then_recovers():
+    scheduler = make_adaptive()
+    now = scheduler.hosts['pi']['nominal']
+    intervals = []
+    for result in (OFFLINE, OFFLINE, online(20.0)):
+        intervals.append(poll(scheduler, result, now))
+        now += intervals[-1]
+    assert intervals == [20, 40, 10]
+
+
+def test_push_hosts_keep_their_interval():
+    push = {'hostname': 'mini', 'method': 'push'}
+    scheduler = make_adaptive([push])
+    now = scheduler.hosts['mini']['nominal']
+    for result in (online(20.0), online(20.0), OFFLINE):
+        now += poll(scheduler, result, now, 'mini')
+    assert scheduler.hosts['mini']['interval'] == 10
@@ -0,0 +1,266 @@
+import json
+
+import pytest
+
+import monitor_agent
+
+
+def make_spool(tmp_path, **kwargs):
+    return monitor_agent.Spool(directory=tmp_path / 'spool', **kwargs)
+
+
+def collect(spool):
+    """Replay everything into a list of (table, op, rows, on_conflict)."""
+    sent = []
+    while spool.replay(lambda *call: sent.append(call)):
+        pass
+    return sent
+
+
+def test_replay_groups_rows_in_order(tmp_path):
+    spool = make_spool(tmp_path)
+    spool.append('system_metrics', [{'n': 1}])
+    spool.append('system_metrics', [{'n': 2}, {'n': 3}])
+    spool.append('service_status', [{'hostname': 'a', 'service_name': 's', 'v': 1}],
+                 op='upsert', on_conflict='hostname,service_name')
+    spool.append('service_status', [{'hostname': 'a', 'service_name': 's', 'v': 2}],
+                 op='upsert', on_conflict='hostname,service_name')
+
+    assert spool.pending()
+    assert collect(spool) == [
+        ('system_metrics', 'insert', [{'n': 1}, {'n': 2}, {'n': 3}], None),
+        ('service_status', 'upsert', [{'hostname': 'a', 'service_name': 's', 'v': 2}], 'hostname,service_name'),
+    ]
+    assert not spool.pending()
+
+
+def test_failed_sink_leaves_records_spooled(tmp_path):
+    spool = make_spool(tmp_path)
+    spool.append('system_metrics', [{'n': 1}])
+
+    def failing(*call):
+        raise RuntimeError('offline')
+
+    assert spool.replay(failing) == 0
+    assert spool.pending()
+    assert collect(spool) == [('system_metrics', 'insert', [{'n': 1}], None)]
+
+
+def test_cursor_survives_restart(tmp_path):
+    spool = make_spool(tmp_path)
+    spool.append('system_metrics', [{'n': 1}])
+    assert collect(spool)
+    spool.append('system_metrics', [{'n': 2}])
+    spool.sync()
+
+    reopened = make_spool(tmp_path)
+    assert collect(reopened) == [('system_metrics', 'insert', [{'n': 2}], None)]
+
+
+def test_replay_window_is_bounded(tmp_path):
+    spool = make_spool(tmp_path)
+    for n in range(5):
+        spool.append('system_metrics', [{'n': n}])
+    sent = []
+    assert spool.replay(lambda *call: sent.append(call), max_records=2) == 2
+    assert sent == [('system_metrics', 'insert', [{'n': 0}, {'n': 1}], None)]
+    assert [row['n'] for call in collect(spool) for row in call[2]] == [2, 3, 4]
+
+
+def test_corrupt_line_is_quarantined(tmp_path):
+    spool = make_spool(tmp_path)
+    spool.append('system_metrics', [{'n': 1}])
+    spool.sync()
+    segment = next((tmp_path / 'spool').glob('segment-*.jsonl'))
+    with open(segment, 'ab') as f:
+        f.write(b'{"table": "system_metr\xff garbage\n')
+    spool.append('system_metrics', [{'n': 2}])
+
+    assert collect(spool) == [('system_metrics', 'insert', [{'n': 1}, {'n': 2}], None)]
+    assert not spool.pending()
+    assert b'garbage' in (tmp_path / 'spool' / 'spool.corrupt').read_bytes()
+
+
+def test_torn_write_does_not_swallow_next_record(tmp_path):
+    spool = make_spool(tmp_path)
+    spool.append('system_metrics', [{'n': 1}])
+    spool.sync()
+    segment = next((tmp_path / 'spool').glob('segment-*.jsonl'))
+    with open(segment, 'ab') as f:
+        f.write(b'{"table": "system_metrics", "rows": [{"n"')  # crashed mid-write
+
+    # A new process appends to the same segment
+    reopened = make_spool(tmp_path)
+    reopened.append('system_metrics', [{'n': 2}])
+    reopened.sync()
+
+    assert collect(reopened) == [('system_metrics', 'insert', [{'n': 1}, {'n': 2}], None)]
+
+
+def test_segments_roll_and_are_deleted_once_replayed(tmp_path):
+    spool = make_spool(tmp_path, segment_bytes=200)
+    for n in range(20):
+        spool.append('system_metrics', [{'n': n, 'pad': 'x' * 50}])
+    spool.sync()
+    assert len(list((tmp_path / 'spool').glob('segment-*.jsonl'))) > 1
+
+    assert [row['n'] for call in collect(spool) for row in call[2]] == list(range(20))
+    assert len(list((tmp_path / 'spool').glob('segment-*.jsonl'))) == 1
+
+
+def test_max_bytes_drops_oldest_segments(tmp_path):
+    spool = make_spool(tmp_path, segment_bytes=200, max_bytes=600)
+    for n in range(40):
+        spool.append('system_metrics', [{'n': n, 'pad': 'x' * 50}])
+    spool.sync()
+
+    replayed = [row['n'] for call in collect(spool) for row in call[2]]
+    assert replayed and replayed[-1] == 39
+    assert replayed[0] > 0
+    assert replayed == sorted(replayed)
+
+
+def test_cursor_file_is_json(tmp_path):
+    spool = make_spool(tmp_path)
+    spool.append('system_metrics', [{'n': 1}])
+    collect(spool)
+    cursor = json.loads((tmp_path / 'spool' / 'cursor.json').read_text())
+    assert set(cursor) == {'segment', 'offset'}
+
+
+class APIError(Exception):
+    """Stands in for postgrest's APIError, which carries the SQLSTATE in .code."""
+
+    def __init__(self, code):
+        super().__init__(f"error {code}")
+        self.code = code
+
+
+@pytest.mark.parametrize('error, permanent', [
+    (APIError('42P01'), True),     # undefined table
+    (APIError('22003'), True),     # numeric value out of range
+    (APIError('23505'), True),     # unique violation
+    (APIError('PGRST204'), True),  # unknown column
+    (APIError('PGRST301'), False),  # JWT problem: fixable by config
+    (APIError('57014'), False),    # statement timeout
+    (ConnectionError('refused'), False),
+    (TimeoutError(), False),
+])
+def test_is_permanent_error(error, permanent):
+    assert monitor_agent.is_permanent_error(error) is permanent
+
+
+def test_rejected_table_is_dead_lettered_and_replay_continues(tmp_path):
+    spool = make_spool(tmp_path)
+    spool.append('system_metrics_rollup', [{'n': 1}], op='upsert', on_conflict='n')
+    spool.append('system_metrics', [{'n': 2}])
+    sent = []
+
+    def sink(table, op, rows, on_conflict):
+        if table == 'system_metrics_rollup':
+            raise APIError('42P01')
+        sent.append((table, rows))
+
+    assert spool.replay(sink) == 2
+    assert sent == [('system_metrics', [{'n': 2}])]
+    assert not spool.pending()
+    dead = [json.loads(line) for line in (tmp_path / 'spool' / 'spool.dead').read_text().splitlines()]
+    assert [(d['table'], d['rows'], d['error']) for d in dead] == [('system_metrics_rollup', [{'n': 1}], 'error 42P01')]
+
+
+def test_failed_spools_transient_and_dead_letters_permanent(tmp_path):
+    spool = make_spool(tmp_path)
+    spool.failed('system_metrics', [{'n': 1}], ConnectionError('down'))
+    spool.failed('service_status', [{'n': 2}], APIError('22003'), op='upsert', on_conflict='n')
+    assert collect(spool) == [('system_metrics', 'insert', [{'n': 1}], None)]
+    assert 'service_status' in (tmp_path / 'spool' / 'spool.dead').read_text()
+
+
+def test_collector_writer_keeps_writing_past_a_rejected_table(tmp_path, monkeypatch):
+    import central_collector
+
+    calls = []
+
+    def write_rows(table, op, rows, on_conflict=None):
+        calls.append(table)
+        if table == 'system_metrics_rollup':
+            raise APIError('42P01')
+
+    monkeypatch.setattr(central_collector, 'write_rows', write_rows)
+    writer = central_collector.MetricsWriter(spool=make_spool(tmp_path))
+    for _ in range(2):
+        writer.add('system_metrics_rollup', [{'n': 1}], op='upsert', on_conflict='n')
+        writer.add('system_metrics', [{'n': 2}])
+        writer.flush()
+    assert calls.count('system_metrics') == 2
+    assert not writer.spool.pending()
+
+
+def test_agent_writes_other_tables_when_one_is_rejected(tmp_path, monkeypatch):
+    written = []
+
+    def write_batch(records, registry):
+        raise APIError('22003')  # e.g. a service's cpu_percent overflows its column
+
+    def write_rows(table, op, rows, on_conflict=None):
+        if table == 'service_status':
+            raise APIError('22003')
+        written.append(table)
+
+    spool = make_spool(tmp_path)
+    monkeypatch.setattr(monitor_agent, 'HAS_SUPABASE', True)
+    monkeypatch.setattr(monitor_agent, 'SUPABASE_KEY', 'key')
+    monkeypatch.setattr(monitor_agent, 'SPOOL', spool)
+    monkeypatch.setattr(monitor_agent, 'WRITES', monitor_agent.WriteTracker(path=tmp_path / 'writes.json'))
+    monkeypatch.setattr(monitor_agent.LOCAL_ADDRESS, 'get', lambda: '10.0.0.2')
+    monkeypatch.setattr(monitor_agent, 'write_batch', write_batch)
+    monkeypatch.setattr(monitor_agent, 'write_rows', write_rows)
+    monkeypatch.setattr(monitor_agent, 'get_supabase', lambda: pytest.fail('registry is not due'))
+    monitor_agent.WRITES.registry = {'hostname': 'pi', 'ip_address': '10.0.0.2', 'at': 2e9}
+
+    metrics = {'hostname': 'pi', 'timestamp': '2026-01-01T00:00:00', 'cpu_percent': 1.0}
+    services = [{'hostname': 'pi', 'service_name': 'node', 'service_type': 'process', 'is_running': True,
+                 'process_count': 12, 'cpu_percent': 1200.0, 'memory_mb': 1.0}]
+    backups = {'new': [], 'changed': [], 'missing': []}
+    assert monitor_agent.send_to_supabase(metrics, services, backups) is False
+
+    assert written == ['system_metrics']
+    assert not spool.pending()
+    assert 'service_status' in (tmp_path / 'spool' / 'spool.dead').read_text()
+    # Not recorded as written, so the row is retried once it changes or is due
+    assert monitor_agent.WRITES.services == {}
+
+
+class RollupTableClient:
+    """Just enough of a Supabase client for check_rollup_table()'s probe."""
+
+    def __init__(self, error=None):
+        self.error = error
+
+    def __getattr__(self, name):
+        return lambda *args: self
+
+    def execute(self):
+        if self.error:
+            raise self.error
+
+
+@pytest.mark.parametrize('error, enabled', [
+    (None, True),
+    (APIError('42P01'), False),
+    (ConnectionError('refused'), True),
+])
+def test_rollups_are_disabled_when_the_table_is_missing(monkeypatch, error, enabled):
+    import central_collector
+
+    monkeypatch.setattr(central_collector, 'HAS_SUPABASE', True)
+    monkeypatch.setattr(central_collector, 'SUPABASE_KEY', 'key')
+    monkeypatch.setattr(central_collector, 'ROLLUPS_ENABLED', True)
+    monkeypatch.setattr(central_collector, 'get_supabase', lambda: RollupTableClient(error))
+    central_collector.check_rollup_table()
+    assert central_collector.ROLLUPS_ENABLED is enabled
+
+    added = []
+    monkeypatch.setattr(central_collector.WRITER, 'add', lambda table, rows, **kw: added.append(table))
+    central_collector.send_to_supabase([], flush=False, rollups=[{'n': 1}])
+    assert ('system_metrics_rollup' in added) is enabled
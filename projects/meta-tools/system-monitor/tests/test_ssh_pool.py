@@ -0,0 +1,97 @@
+import os
+import shutil
+import subprocess
+import tempfile
+from pathlib import Path
+
+import pytest
+
+import central_collector
+from central_collector import SSHPool
+
+
+@pytest.fixture
+def ssh(monkeypatch):
+    """Record every ssh argv; replies are (returncode, stderr), default success."""
+    calls, replies = [], []
+
+    def run(args, capture_output=True, text=True, input=None, timeout=None):
+        calls.append(args)
+        returncode, stderr = replies.pop(0) if replies and '-O' not in args else (0, '')
+        return subprocess.CompletedProcess(args, returncode, stdout='out', stderr=stderr)
+
+    monkeypatch.setattr(central_collector.subprocess, 'run', run)
+    return calls, replies
+
+
+@pytest.fixture
+def short_dir():
+    """A control dir short enough for sockets (pytest's tmp_path often isn't)."""
+    if not os.path.isdir('/tmp'):
+        pytest.skip('needs /tmp')
+    base = Path(tempfile.mkdtemp(prefix='cm', dir='/tmp'))
+    yield base / 'cm'
+    shutil.rmtree(base)
+
+
+def option(args, name):
+    values = [args[i + 1].split('=', 1)[1] for i, arg in enumerate(args)
+              if arg == '-o' and args[i + 1].startswith(name + '=')]
+    return values[0] if values else None
+
+
+def test_commands_ride_the_control_master(short_dir, ssh):
+    calls, _ = ssh
+    pool = SSHPool(control_dir=short_dir, persist=600)
+    result = pool.run('pi.local', 'pi', 'python3 -', input='print(1)')
+
+    assert result.returncode == 0
+    [args] = calls
+    assert args[0] == 'ssh' and args[-2:] == ['pi@pi.local', 'python3 -']
+    assert option(args, 'ControlMaster') == 'auto'
+    assert option(args, 'ControlPath') == str(short_dir / '%C')
+    assert option(args, 'ControlPersist') == '600'
+    assert short_dir.is_dir()
+
+
+def test_socket_path_fits_for_any_host_name(short_dir, ssh):
+    calls, _ = ssh
+    pool = SSHPool(control_dir=short_dir)
+    pool.run('a' * 200 + '.example.com', 'user', 'true')
+
+    # %C is a fixed-length hash of the connection, not the host name
+    assert pool.multiplex
+    assert option(calls[0], 'ControlPath') == str(short_dir / '%C')
+
+
+def test_too_long_control_dir_falls_back_to_plain_ssh(tmp_path, ssh):
+    calls, _ = ssh
+    pool = SSHPool(control_dir=tmp_path / ('d' * 80))
+    pool.run('pi.local', 'pi', 'true')
+    pool.reset('pi@pi.local')
+
+    assert not pool.multiplex
+    assert calls == [calls[0]]  # no `ssh -O` control commands
+    assert option(calls[0], 'ControlMaster') == 'no'
+    assert option(calls[0], 'ControlPath') == 'none'
+    assert not (tmp_path / ('d' * 80)).exists()
+
+
+def test_broken_control_socket_is_reset_and_retried_once(short_dir, ssh):
+    calls, replies = ssh
+    replies.append((255, 'mux_client_request_session: read from master failed: Broken pipe'))
+    pool = SSHPool(control_dir=short_dir)
+    result = pool.run('pi.local', 'pi', 'true')
+
+    assert result.returncode == 0
+    assert [args[args.index('-O') + 1] if '-O' in args else args[-1] for args in calls] == \
+        ['true', 'exit', 'true']
+
+
+def test_unreachable_host_is_not_retried(short_dir, ssh):
+    calls, replies = ssh
+    replies.append((255, 'ssh: connect to host pi.local port 22: Connection refused'))
+    result = SSHPool(control_dir=short_dir).run('pi.local', 'pi', 'true')
+
+    assert result.returncode == 255
+    assert len(calls) == 1
@@ -0,0 +1,52 @@
+import json
+
+import pytest
+
+import monitor_agent
+
+SAMPLE = {
+    'ts': 1_700_000_000.5,
+    'metrics': {
+        'cpu_percent': 12.5, 'memory_percent': 40.25, 'memory_used_gb': 3.2, 'memory_total_gb': 8.0,
+        'disk_percent': 71.0, 'disk_used_gb': None, 'disk_total_gb': 100.0,
+        'load_avg_1m': 0.5, 'load_avg_5m': 0.25, 'load_avg_15m': 0.15,
+        'uptime_seconds': 86400, 'process_count': 312, 'cpu_per_core': [10.0, 15.0],
+    },
+    'services': [
+        {'service_name': 'node', 'is_running': True, 'cpu_percent': 150.5, 'memory_mb': 512.25},
+        {'service_name': 'n8n', 'is_running': False, 'cpu_percent': None, 'memory_mb': None},
+    ],
+}
+
+
+def test_round_trip():
+    # Floats travel as f32 and are rounded to 2 places on decode
+    batch = monitor_agent.decode_samples(monitor_agent.encode_samples('pi', 'linux', [SAMPLE, SAMPLE]))
+    assert (batch['hostname'], batch['system_type'], len(batch['samples'])) == ('pi', 'linux', 2)
+
+    sample = batch['samples'][0]
+    assert sample['ts'] == SAMPLE['ts']
+    metrics = sample['metrics']
+    for key, value in SAMPLE['metrics'].items():
+        assert metrics[key] == value, key
+    assert isinstance(metrics['process_count'], int)
+    assert metrics['timestamp'] == '2023-11-14T22:13:20.500000'
+
+    services = {s['service_name']: s for s in sample['services']}
+    assert services['node']['is_running'] and services['node']['cpu_percent'] == 150.5
+    assert not services['n8n']['is_running'] and services['n8n']['memory_mb'] is None
+
+
+def test_much_smaller_than_json():
+    assert len(monitor_agent.encode_samples('pi', 'linux', [SAMPLE])) * 4 < len(json.dumps(SAMPLE))
+
+
+@pytest.mark.parametrize('mangle, message', [
+    (lambda data: b'JSON' + data[4:], 'not an L7MS'),
+    (lambda data: data[:4] + bytes((99,)) + data[5:], 'unsupported L7MS version 99'),
+    (lambda data: data[:-3], 'truncated'),
+])
+def test_bad_payloads_are_rejected(mangle, message):
+    data = monitor_agent.encode_samples('pi', 'linux', [SAMPLE])
+    with pytest.raises(ValueError, match=message):
+        monitor_agent.decode_samples(mangle(data))
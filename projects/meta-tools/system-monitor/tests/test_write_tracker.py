@@ -0,0 +1,47 @@
+from monitor_agent import SERVICE_REFRESH_SECONDS, WriteTracker
+
+
+def row(**changes):
+    return {'hostname': 'pi', 'service_name': 'node', 'service_type': 'process', 'is_running': True,
+            'process_count': 4, 'cpu_percent': 10.0, 'memory_mb': 200.0, **changes}
+
+
+def written(tmp_path, now=1000):
+    tracker = WriteTracker(path=tmp_path / 'writes.json')
+    tracker.commit([row()], None, now)
+    return tracker
+
+
+def test_new_rows_are_due(tmp_path):
+    tracker = WriteTracker(path=tmp_path / 'writes.json')
+    assert tracker.services_due([row()], 1000) == [row()]
+
+
+def test_small_changes_are_skipped(tmp_path):
+    tracker = written(tmp_path)
+    assert tracker.services_due([row(cpu_percent=14.0, memory_mb=210.0)], 1060) == []
+
+
+def test_changes_are_due(tmp_path):
+    tracker = written(tmp_path)
+    for changed in (row(is_running=False), row(process_count=5), row(cpu_percent=15.0),
+                    row(memory_mb=221.0), row(service_type='docker')):
+        assert tracker.services_due([changed], 1060) == [changed]
+
+
+def test_unchanged_rows_are_refreshed(tmp_path):
+    tracker = written(tmp_path)
+    assert tracker.services_due([row()], 1000 + SERVICE_REFRESH_SECONDS) == [row()]
+
+
+def test_state_is_persisted(tmp_path):
+    written(tmp_path)
+    tracker = WriteTracker(path=tmp_path / 'writes.json')
+    assert tracker.services_due([row()], 1060) == []
+
+
+def test_registry_is_due_when_the_ip_changes(tmp_path):
+    tracker = WriteTracker(path=tmp_path / 'writes.json')
+    tracker.commit([], {'hostname': 'pi', 'ip_address': '10.0.0.2'}, 1000)
+    assert not tracker.registry_due('pi', '10.0.0.2', 1060)
+    assert tracker.registry_due('pi', '10.0.0.3', 1060)